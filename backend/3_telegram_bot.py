@@ -1,14 +1,22 @@
 # 3_telegram_bot_final.py - ОСНОВНОЙ БОТ
 
+import asyncio
 import logging
+import signal
 import sys
-import time
-import requests
-from config import BOT_TOKEN, DEBUG
-from llm_generator_final import get_answer, clear_history
-import subprocess
-import time
-import requests
+from config import BOT_TOKEN, TELEGRAM_API_BASE, DEBUG, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+from config import METRICS_LOG_INTERVAL, SHUTDOWN_DRAIN_TIMEOUT, BOT_WORKERS, WARMUP_ENABLED
+from bot_handlers import ChatHandlers
+from dispatcher import UpdateDispatcher
+from sharding import ShardRouter
+from outbound import OutboundSender
+from update_state import UpdateStateStore
+from history_store import history_store
+from ollama_client import ollama
+from metrics import metrics
+from model_warmup import model_warmup
+from retriever import retriever
+from http_clients import TELEGRAM, get_async_client, get_async_timeout, close_async_clients
 
 
 
@@ -23,88 +31,213 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
 
 
-def get_updates(offset=None, timeout=30):
+async def get_updates(offset=None, timeout=30):
     """Получает обновления"""
     try:
-        params = {"timeout": timeout, "offset": offset}
-        resp = requests.get(f"{TELEGRAM_API_URL}/getUpdates", params=params, timeout=60)
+        params = {"timeout": timeout}
+        if offset is not None:
+            params["offset"] = offset
+        resp = await get_async_client(TELEGRAM).get(
+            f"{TELEGRAM_API_URL}/getUpdates",
+            params=params,
+            timeout=get_async_timeout(TELEGRAM, read=timeout + 30),
+        )
         return resp.json().get("result", [])
     except Exception as e:
         logger.error(f"❌ Ошибка получения обновлений: {e}")
         return []
 
 
-def send_message(chat_id, text):
-    """Отправляет сообщение"""
-    if len(text) > 4096:
-        text = text[:4090] + "..."
-    
+async def set_webhook(url, secret=None):
+    """Регистрирует webhook в Telegram"""
+    params = {"url": url, "drop_pending_updates": False}
+    if secret:
+        params["secret_token"] = secret
     try:
-        params = {"chat_id": chat_id, "text": text}
-        requests.post(f"{TELEGRAM_API_URL}/sendMessage", data=params, timeout=10)
+        resp = await get_async_client(TELEGRAM).post(f"{TELEGRAM_API_URL}/setWebhook", data=params)
+        return resp.json().get("ok", False)
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки сообщения: {e}")
+        logger.error(f"❌ Ошибка установки webhook: {e}")
+        return False
 
 
-def main():
-    """Основной цикл бота"""
-    
-    logger.info("\n" + "="*60)
-    logger.info("🟢 RAG AI-клон v4 (FIXED)")
-    logger.info("="*60)
-    logger.info("📱 Бот готов к работе...")
-    logger.info("⌨️  Нажми CTRL+C чтобы остановить\n")
-    
-    last_update_id = None
+async def delete_webhook():
+    """Снимает webhook, иначе getUpdates возвращает 409"""
+    try:
+        await get_async_client(TELEGRAM).post(f"{TELEGRAM_API_URL}/deleteWebhook")
+    except Exception as e:
+        logger.error(f"❌ Ошибка снятия webhook: {e}")
+
+
+# Все исходящие сообщения идут через лимитер (глобальный + по чатам, учёт 429)
+sender = OutboundSender(TELEGRAM_API_URL)
+handlers = ChatHandlers(sender)
+
+
+async def log_metrics_periodically():
+    """Раз в METRICS_LOG_INTERVAL секунд пишет метрики в лог"""
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        metrics.log_snapshot()
+
+
+async def persist_state_periodically(state):
+    """Сбрасывает офсет на диск раз в секунду, если он сдвинулся"""
+    while True:
+        await asyncio.sleep(1)
+        await asyncio.to_thread(state.save)
+
+
+async def run_polling(accept_update, state):
+    """Цикл getUpdates: раздаёт обновления воркерам и сразу идёт за следующими"""
+    await delete_webhook()
+    last_update_id = state.next_fetch_offset()
     
     while True:
         try:
-            updates = get_updates(last_update_id)
+            updates = await get_updates(last_update_id)
             
             for update in updates:
                 last_update_id = update.get("update_id", 0) + 1
-                
-                msg = update.get("message", {})
-                chat_id = msg.get("chat", {}).get("id")
-                username = msg.get("from", {}).get("username", "Unknown")
-                text = msg.get("text", "").strip()
-                
-                if not chat_id or not text:
-                    continue
-                
-                logger.info(f"Q [{chat_id}] (@{username}): {text}")
-                
-                # Специальные команды
-                if text == "/start":
-                    send_message(chat_id, "👋 Привет! Я RAG AI-клон. Напиши что-нибудь!")
-                    continue
-                
-                if text == "/clear":
-                    clear_history(chat_id)
-                    send_message(chat_id, "🗑️ История диалога очищена")
-                    continue
-                
-                # Получаем ответ
-                answer = get_answer(text, chat_id=chat_id)
-                
-                if answer:
-                    logger.info(f"A: {answer}\n")
-                    send_message(chat_id, answer)
-                else:
-                    logger.warning(f"A: (empty)\n")
-                    send_message(chat_id, "Хм, не знаю что ответить...")
-                
-                time.sleep(0.5)
+                accept_update(update)
+            
+            # Следующий getUpdates подтвердит эти обновления в Telegram,
+            # поэтому сначала фиксируем их в журнале на диске (не блокируя event loop)
+            await asyncio.to_thread(state.save)
         
-        except KeyboardInterrupt:
-            logger.info("\n⛔ Бот остановлен")
-            break
         except Exception as e:
             logger.error(f"❌ Ошибка: {e}")
-            time.sleep(5)
+            await asyncio.sleep(5)
+
+
+async def run_webhook(accept_update, state, stop_event):
+    """Webhook: Telegram сам присылает обновления, холостого опроса нет"""
+    from webhook_server import serve_webhook
+    
+    if WEBHOOK_URL:
+        url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+        ok = await set_webhook(url, WEBHOOK_SECRET)
+        logger.info(f"{'✅' if ok else '❌'} setWebhook: {url}")
+    else:
+        logger.warning("⚠️ WEBHOOK_URL не задан - webhook в Telegram не регистрирую")
+    
+    async def on_update(update):
+        # Telegram считает обновление доставленным после ответа 200,
+        # поэтому отвечаем только после записи журнала
+        accept_update(update)
+        await asyncio.to_thread(state.save)
+    
+    await serve_webhook(on_update, stop_event)
+
+
+async def run_bot(mode=BOT_MODE, workers=BOT_WORKERS):
+    """Запускает бота в выбранном режиме получения обновлений.
+    
+    Остановка (SIGINT/SIGTERM): прекращаем приём, ждём незавершённые ответы
+    до SHUTDOWN_DRAIN_TIMEOUT секунд, сохраняем состояние. Неотвеченные
+    обновления остаются в журнале и обрабатываются после рестарта.
+    """
+    state = UpdateStateStore()
+    replay = state.load()
+    if workers > 1:
+        # Шардов не больше, чем слотов LLM, - иначе доли бюджета не хватит всем
+        dispatcher = ShardRouter(workers, sender, on_complete=state.complete, slots=ollama.router.capacity)
+        dispatcher.start()
+    else:
+        dispatcher = UpdateDispatcher(
+            handlers.handle_command, handlers.handle_message, handlers.handle_shed,
+            on_complete=state.complete,
+        )
+    
+    def accept_update(update):
+        if state.begin(update):
+            dispatcher.dispatch(update)
+        else:
+            metrics.inc("bot_duplicate_updates_total")
+            logger.info(f"♻️ Повтор update_id={update.get('update_id')} - пропускаю")
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: остаётся KeyboardInterrupt
+    
+    if workers <= 1:
+        # Журнал истории читается до первых ответов, но не на event loop
+        await asyncio.to_thread(history_store.load)
+    if replay:
+        logger.info(f"🔁 Повторно обрабатываю {len(replay)} незавершённых обновлений")
+    for update in replay:
+        dispatcher.dispatch(update)
+    
+    background = [
+        asyncio.create_task(log_metrics_periodically()),
+        asyncio.create_task(persist_state_periodically(state)),
+    ]
+    if workers <= 1:
+        # Модель эмбеддингов и коллекция грузятся в фоне, не задерживая приём
+        background.append(asyncio.create_task(asyncio.to_thread(retriever.warmup)))
+    if WARMUP_ENABLED:
+        # Модель загружается и прогревается, пока бот уже принимает сообщения;
+        # с шардами это делает основной процесс за всех
+        background.append(asyncio.create_task(model_warmup.run()))
+    if mode == "webhook":
+        intake = asyncio.create_task(run_webhook(accept_update, state, stop_event))
+    else:
+        intake = asyncio.create_task(run_polling(accept_update, state))
+    
+    try:
+        stop_waiter = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({intake, stop_waiter}, return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+    finally:
+        logger.info("⏹️ Останавливаю приём обновлений...")
+        stop_event.set()
+        if mode != "webhook":
+            intake.cancel()
+        await asyncio.gather(intake, return_exceptions=True)
+        
+        try:
+            await asyncio.wait_for(dispatcher.join(), SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не все ответы успели за {SHUTDOWN_DRAIN_TIMEOUT} сек - доделаю после рестарта")
+        
+        state.save()
+        for task in background:
+            task.cancel()
+        await ollama.close()
+        await close_async_clients()
+        history_store.close()
+        logger.info("💾 Состояние сохранено")
+
+
+def main():
+    """Основной цикл бота"""
+    
+    logger.info("\n" + "="*60)
+    logger.info("🟢 RAG AI-клон v4 (FIXED)")
+    logger.info("="*60)
+    mode = "webhook" if "--webhook" in sys.argv else BOT_MODE
+    if mode == "webhook" and not WEBHOOK_SECRET:
+        # Проверяем до запуска: ошибка внутри задачи приёма лишь тихо остановила бы бота
+        raise ValueError("❌ WEBHOOK_SECRET не установлен в .env - webhook без него не запускаю")
+    workers = BOT_WORKERS
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    
+    logger.info("📱 Бот готов к работе...")
+    logger.info(f"⚙️  Режим: {mode}, параллельных запросов к LLM: {ollama.router.capacity} (на {len(ollama.router.backends)} серверах Ollama), шардов: {workers}")
+    logger.info("⌨️  Нажми CTRL+C чтобы остановить\n")
+    
+    try:
+        asyncio.run(run_bot(mode, workers))
+    except KeyboardInterrupt:
+        logger.info("\n⛔ Бот остановлен")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+# bot_handlers.py - ОБРАБОТЧИКИ СООБЩЕНИЙ БОТА
+#
+# Не зависят от того, откуда пришли обновления и как уходят ответы:
+# sender - OutboundSender в основном процессе или RemoteSender в
+# процессе-шарде (см. sharding.py).
+
+import logging
+import time
+from contextlib import aclosing
+from config import STREAM_REPLIES, STREAM_EDIT_INTERVAL
+from llm_generator_final import get_answer, clear_history, stream_answer_simple
+from prompt_assets import prompt_assets
+from history_store import history_store
+from response_cache import response_cache, PartialAnswer, is_complete
+
+logger = logging.getLogger(__name__)
+
+
+class ChatHandlers:
+    """Команды, ответы LLM и ответ "занят" поверх заданного отправителя"""
+
+    def __init__(self, sender):
+        self.sender = sender
+
+    async def handle_command(self, chat_id, text):
+        """Обрабатывает /start и /clear без ожидания LLM"""
+        if text == "/start":
+            await self.sender.send_message(chat_id, "👋 Привет! Я RAG AI-клон. Напиши что-нибудь!")
+        elif text == "/clear":
+            clear_history(chat_id)
+            await self.sender.send_message(chat_id, "🗑️ История диалога очищена")
+
+    async def handle_message(self, chat_id, text):
+        """Получает ответ (кэш или LLM) и отправляет его в чат"""
+        # Ответ зависит от предыдущей реплики бота - она входит в ключ кэша
+        answer, source = await response_cache.get_or_generate(
+            text, prompt_assets.version, lambda: self._generate(chat_id, text),
+            context=history_store.context_key(chat_id),
+        )
+        if is_complete(answer):
+            history_store.add_turn(chat_id, text, answer)
+
+        if source == "generated" and STREAM_REPLIES:
+            # Потоковый ответ уже показан правками сообщения
+            logger.info(f"A [{chat_id}]: {answer}\n")
+            return
+
+        if answer:
+            logger.info(f"A [{chat_id}] ({source}): {answer}\n")
+            await self.sender.send_message(chat_id, answer)
+        else:
+            logger.warning(f"A [{chat_id}]: (empty)\n")
+            await self.sender.send_message(chat_id, "Хм, не знаю что ответить...")
+
+    async def _generate(self, chat_id, text):
+        """Генерация LLM: потоком в чат или целиком"""
+        if STREAM_REPLIES:
+            return await self.stream_reply(chat_id, text)
+
+        await self.sender.send_chat_action(chat_id)
+        return await get_answer(text, chat_id=chat_id)
+
+    async def handle_shed(self, chat_id, text):
+        """Быстрый ответ, когда очередь к LLM переполнена или сообщение устарело"""
+        await self.sender.send_message(chat_id, "⏳ Сейчас много сообщений, не успеваю ответить. Напиши чуть позже!")
+
+    async def stream_reply(self, chat_id, text):
+        """Плейсхолдер + правки не чаще STREAM_EDIT_INTERVAL; возвращает итоговый текст.
+
+        Если поток оборвался после показанного текста, возвращает PartialAnswer -
+        такой ответ не кэшируется и не пишется в историю.
+        """
+        message_id = await self.sender.send_message(chat_id, "✍️ ...")
+        if message_id is None:
+            return None
+
+        shown = ""
+        latest = ""
+        last_edit = time.monotonic()
+        try:
+            stream = stream_answer_simple(text, chat_id)
+            async with aclosing(stream):
+                async for latest in stream:
+                    if latest != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                        await self.sender.edit_message(chat_id, message_id, latest)
+                        shown = latest
+                        last_edit = time.monotonic()
+        except Exception as e:
+            logger.warning(f"⚠️ Поток прерван [{chat_id}]: {e}")
+            if latest:
+                latest = PartialAnswer(latest)
+            else:
+                # Ничего не успели показать - пробуем обычный путь с повторами
+                latest = await get_answer(text, chat_id=chat_id)
+
+        final = latest or "Хм, не знаю что ответить..."
+        if final != shown:
+            await self.sender.edit_message(chat_id, message_id, final)
+        return final
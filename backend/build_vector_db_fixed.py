@@ -1,93 +1,88 @@
 # 0_build_vector_db_improved.py - ИНДЕКСИРОВАНИЕ + LLM-ПАРСИНГ ФАКТОВ (Mistral)
 
+import asyncio
+import hashlib
+import itertools
 import json
 import logging
 import re
+import sys
 from pathlib import Path
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Iterable, Iterator
 import chromadb
-from chromadb.utils import embedding_functions
-import requests
-from config import MESSAGES_FILE, CHROMA_DB_DIR, DEBUG, OLLAMA_API_URL, OLLAMA_MODEL
+import httpx
+from config import MESSAGES_FILE, CHROMA_DB_DIR, DEBUG
+from config import COLLECTION_NAME, EMBEDDING_MODEL, FACTS_DEADLINE, PROMPT_MAX_CTX, PROMPT_NUM_PREDICT
+from config import INDEX_BATCH_SIZE, INDEX_PARALLEL_MIN_DOCS, DEDUP_ENABLED
+from dedup import Deduplicator
+from embedding_cache import cached_embedding_function
+from http_clients import close_async_clients
+from index_pipeline import EmbeddingPipeline, resolve_workers
+from llm_scheduler import BACKGROUND
+from message_stream import iter_messages, JsonArrayWriter
+from ollama_client import ollama
+from prompt_assembler import prompt_assembler
+from retry_policy import RetryPolicy, CircuitOpenError, ollama_breaker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Ollama config - используем значения из config.py
 OLLAMA_TIMEOUT = 600  # Увеличено до 10 минут для больших промптов
-OLLAMA_MAX_RETRIES = 3  # Количество попыток при ошибках
+
+# Сколько первых очищенных (и уникальных) сообщений отдавать на извлечение фактов
+FACTS_SAMPLE_SIZE = 1000
+
+facts_retry = RetryPolicy("facts", deadline=FACTS_DEADLINE, attempt_timeout=OLLAMA_TIMEOUT, breaker=ollama_breaker)
 
 
 class OllamaFactExtractor:
     """Использует Mistral 7B для извлечения фактов из сообщений"""
 
     @staticmethod
-    def call_mistral(prompt: str, temperature: float = 0.3) -> str:
-        """Вызывает Mistral 7B локально через Ollama с retry логикой"""
-        import time
-        
-        for attempt in range(OLLAMA_MAX_RETRIES):
-            try:
-                logger.debug(f"🔄 Попытка {attempt + 1}/{OLLAMA_MAX_RETRIES} вызова Mistral...")
-                
-                # Ограничиваем размер промпта для избежания таймаутов
-                max_prompt_length = 2000  # Ограничение длины промпта
-                current_prompt = prompt
-                if len(current_prompt) > max_prompt_length:
-                    logger.warning(f"⚠️ Промпт слишком длинный ({len(current_prompt)} символов), обрезаю до {max_prompt_length}")
-                    current_prompt = current_prompt[:max_prompt_length] + "..."
-                
-                response = requests.post(
-                    f"{OLLAMA_API_URL}/api/generate",
-                    json={
-                        "model": OLLAMA_MODEL,
-                        "prompt": current_prompt,
-                        "stream": False,
-                        "temperature": temperature,
-                    },
-                    timeout=OLLAMA_TIMEOUT,
-                )
-                response.raise_for_status()
-                result = response.json()
-                
-                if "response" not in result:
-                    raise ValueError(f"Неожиданный ответ от Ollama: {result}")
-                
-                return result["response"]
-                
-            except requests.exceptions.Timeout:
-                wait_time = (attempt + 1) * 5  # Экспоненциальная задержка
-                logger.warning(f"⏱️ Таймаут при вызове Mistral (попытка {attempt + 1}/{OLLAMA_MAX_RETRIES}). Жду {wait_time} сек...")
-                if attempt < OLLAMA_MAX_RETRIES - 1:
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    logger.error("❌ Превышен таймаут после всех попыток")
-                    raise
-                    
-            except requests.exceptions.ConnectionError:
-                logger.error("❌ Ollama не запущена! Запусти: ollama serve")
-                raise
-                
-            except requests.exceptions.HTTPError as e:
-                if e.response.status_code == 500:
-                    wait_time = (attempt + 1) * 3
-                    logger.warning(f"⚠️ Ошибка 500 от Ollama (попытка {attempt + 1}/{OLLAMA_MAX_RETRIES}). Жду {wait_time} сек...")
-                    if attempt < OLLAMA_MAX_RETRIES - 1:
-                        time.sleep(wait_time)
-                        continue
-                raise
-                
-            except Exception as e:
-                logger.error(f"❌ Ошибка при вызове Mistral: {e}")
-                if attempt < OLLAMA_MAX_RETRIES - 1:
-                    wait_time = (attempt + 1) * 2
-                    logger.warning(f"🔄 Повторная попытка через {wait_time} сек...")
-                    time.sleep(wait_time)
-                    continue
-                raise
-        
-        raise RuntimeError("Не удалось выполнить запрос после всех попыток")
+    async def call_mistral(prompt: str, temperature: float = 0.3) -> str:
+        """Вызывает Mistral 7B локально через Ollama (повторы - facts_retry)"""
+        # Промпт должен поместиться в окно контекста вместе с ответом
+        budget = PROMPT_MAX_CTX - PROMPT_NUM_PREDICT
+        fitted, _ = await prompt_assembler.fit_text(prompt, budget)
+        if fitted != prompt:
+            logger.warning(f"⚠️ Промпт не помещается в {budget} токенов, обрезаю ({len(prompt)} -> {len(fitted)} символов)")
+        prompt = fitted
+        # Тот же num_ctx, что у бота: иначе Ollama перезагружала бы модель
+        options = {"temperature": temperature, "num_ctx": PROMPT_MAX_CTX}
+
+        async def attempt(timeout):
+            # Фоновый класс: ответы бота в чате идут вперёд
+            result = await ollama.generate(
+                prompt,
+                options=options,
+                timeout=timeout,
+                priority=BACKGROUND,
+            )
+            if "response" not in result:
+                raise ValueError(f"Неожиданный ответ от Ollama: {result}")
+            return result["response"]
+
+        try:
+            return await facts_retry.run(attempt)
+        except (httpx.ConnectError, CircuitOpenError):
+            logger.error("❌ Ollama не запущена! Запусти: ollama serve")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка при вызове Mistral: {type(e).__name__}: {e}")
+            raise
+
+    @staticmethod
+    async def call_mistral_many(prompts: List[str]) -> List[str]:
+        """Отправляет промпты одновременно; сколько реально уйдёт в Ollama
+        параллельно, решает лимит фоновых слотов (LLM_BACKGROUND_SHARE)"""
+        try:
+            return await asyncio.gather(
+                *(OllamaFactExtractor.call_mistral(prompt) for prompt in prompts)
+            )
+        finally:
+            await ollama.close()
+            await close_async_clients()
 
     @staticmethod
     def extract_facts(messages: List[str]) -> Dict[str, Any]:
@@ -124,18 +119,6 @@ class OllamaFactExtractor:
     "occupation": "профессия или null"
 }}"""
 
-        personal_response = OllamaFactExtractor.call_mistral(personal_prompt)
-        try:
-            personal_data = json.loads(personal_response)
-        except json.JSONDecodeError:
-            personal_data = {
-                "full_name": None,
-                "age": None,
-                "location": None,
-                "timezone": None,
-                "occupation": None,
-            }
-
         # ===== STEP 2: ИНТЕРЕСЫ И ХОББИ =====
         logger.info("🎮 Step 2: Извлекаю интересы и хобби...")
         hobbies_prompt = f"""Проанализируй эти сообщения и найди интересы:
@@ -151,18 +134,6 @@ class OllamaFactExtractor:
     "other_interests": ["другие интересы"]
 }}"""
 
-        hobbies_response = OllamaFactExtractor.call_mistral(hobbies_prompt)
-        try:
-            hobbies_data = json.loads(hobbies_response)
-        except json.JSONDecodeError:
-            hobbies_data = {
-                "games": [],
-                "music": [],
-                "programming": False,
-                "sports": [],
-                "other_interests": [],
-            }
-
         # ===== STEP 3: УБЕЖДЕНИЯ И ЦЕННОСТИ =====
         logger.info("🎯 Step 3: Извлекаю убеждения и ценности...")
         beliefs_prompt = f"""Проанализируй эти сообщения и определи убеждения человека:
@@ -176,16 +147,6 @@ class OllamaFactExtractor:
     "important_beliefs": ["важные убеждения"]
 }}"""
 
-        beliefs_response = OllamaFactExtractor.call_mistral(beliefs_prompt)
-        try:
-            beliefs_data = json.loads(beliefs_response)
-        except json.JSONDecodeError:
-            beliefs_data = {
-                "core_values": [],
-                "life_philosophy": None,
-                "important_beliefs": [],
-            }
-
         # ===== STEP 4: СТИЛЬ ОБЩЕНИЯ =====
         logger.info("💬 Step 4: Анализирую стиль общения...")
         style_prompt = f"""Проанализируй стиль общения в этих сообщениях:
@@ -200,17 +161,6 @@ class OllamaFactExtractor:
     "keyword_style": ["частые слова/фразы"]
 }}"""
 
-        style_response = OllamaFactExtractor.call_mistral(style_prompt)
-        try:
-            style_data = json.loads(style_response)
-        except json.JSONDecodeError:
-            style_data = {
-                "tone": "unknown",
-                "personality_traits": [],
-                "communication_style": "unknown",
-                "keyword_style": [],
-            }
-
         # ===== STEP 5: ОБРАЗОВАНИЕ И НАВЫКИ =====
         logger.info("💻 Step 5: Извлекаю образование и навыки...")
         skills_prompt = f"""Проанализируй эти сообщения и определи навыки:
@@ -225,7 +175,63 @@ class OllamaFactExtractor:
     "specialization": "область специализации или null"
 }}"""
 
-        skills_response = OllamaFactExtractor.call_mistral(skills_prompt)
+        # Все промпты уходят одновременно, Ollama отвечает по мере освобождения слотов
+        logger.info("🚀 Отправляю 5 запросов к Mistral...")
+        (
+            personal_response,
+            hobbies_response,
+            beliefs_response,
+            style_response,
+            skills_response,
+        ) = asyncio.run(OllamaFactExtractor.call_mistral_many([
+            personal_prompt,
+            hobbies_prompt,
+            beliefs_prompt,
+            style_prompt,
+            skills_prompt,
+        ]))
+
+        try:
+            personal_data = json.loads(personal_response)
+        except json.JSONDecodeError:
+            personal_data = {
+                "full_name": None,
+                "age": None,
+                "location": None,
+                "timezone": None,
+                "occupation": None,
+            }
+
+        try:
+            hobbies_data = json.loads(hobbies_response)
+        except json.JSONDecodeError:
+            hobbies_data = {
+                "games": [],
+                "music": [],
+                "programming": False,
+                "sports": [],
+                "other_interests": [],
+            }
+
+        try:
+            beliefs_data = json.loads(beliefs_response)
+        except json.JSONDecodeError:
+            beliefs_data = {
+                "core_values": [],
+                "life_philosophy": None,
+                "important_beliefs": [],
+            }
+
+        try:
+            style_data = json.loads(style_response)
+        except json.JSONDecodeError:
+            style_data = {
+                "tone": "unknown",
+                "personality_traits": [],
+                "communication_style": "unknown",
+                "keyword_style": [],
+            }
+
         try:
             skills_data = json.loads(skills_response)
         except json.JSONDecodeError:
@@ -295,6 +301,9 @@ class OllamaFactExtractor:
 class MessageProcessor:
     """Класс для обработки и очистки сообщений"""
 
+    # Поля сообщения из 1_collect_data.py, которые попадают в метаданные документа
+    STABLE_METADATA_KEYS = ("message_id", "date", "chat_title")
+
     @staticmethod
     def clean_text(text: str) -> str:
         """Очистка текста от мусора"""
@@ -346,19 +355,14 @@ class MessageProcessor:
             }
 
     @staticmethod
-    def prepare_messages(messages: List[Any]) -> tuple:
-        """Обработка и подготовка всех сообщений"""
-        valid_messages = []
-        valid_texts = []
-        valid_metadatas = []
-        stats = {
-            "total": len(messages),
-            "valid": 0,
-            "invalid": 0,
-            "invalid_reasons": {},
-        }
+    def new_stats() -> Dict[str, Any]:
+        return {"total": 0, "valid": 0, "invalid": 0, "invalid_reasons": {}}
 
-        for i, msg in enumerate(messages):
+    @staticmethod
+    def iter_prepared(messages: Iterable[Any], stats: Dict[str, Any]) -> Iterator[tuple]:
+        """Поток (очищенное сообщение, текст для вектора, метаданные); stats заполняется по ходу"""
+        for msg in messages:
+            stats["total"] += 1
             if not MessageProcessor.is_valid_message(msg):
                 stats["invalid"] += 1
                 reason = "too_short" if len(str(msg).strip()) < 3 else "garbage_pattern"
@@ -377,122 +381,267 @@ class MessageProcessor:
                 text_for_vector = str(cleaned_message)
 
             vector_metadata = {
-                "original_index": i,
                 "message_length": len(text_for_vector),
                 "processed": True,
             }
+            # Только то, что не зависит от места сообщения в выгрузке: индекс в
+            # файле сдвигается от любой вставки и переписал бы метаданные всей коллекции
+            if isinstance(msg, dict):
+                for key in MessageProcessor.STABLE_METADATA_KEYS:
+                    value = msg.get(key)
+                    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                        vector_metadata[key] = value
 
-            valid_messages.append(cleaned_message)
-            valid_texts.append(text_for_vector)
-            valid_metadatas.append(vector_metadata)
             stats["valid"] += 1
+            yield cleaned_message, text_for_vector, vector_metadata
 
+    @staticmethod
+    def prepare_messages(messages: List[Any]) -> tuple:
+        """Обработка и подготовка всех сообщений (списками)"""
+        stats = MessageProcessor.new_stats()
+        prepared = list(MessageProcessor.iter_prepared(messages, stats))
+        valid_messages = [message for message, _, _ in prepared]
+        valid_texts = [text for _, text, _ in prepared]
+        valid_metadatas = [metadata for _, _, metadata in prepared]
         return valid_messages, valid_texts, valid_metadatas, stats
 
 
-def build_vector_db():
-    """Создает и индексирует ChromaDB базу с LLM-парсингом фактов"""
+class VectorIndexer:
+    """Инкрементальная синхронизация коллекции с корпусом сообщений.
+
+    ID документа - хэш текста, поэтому он не сдвигается при изменении
+    фильтров и порядка. Эмбеддинги считаются только для новых текстов
+    (конвейером index_pipeline.py), удалённые из корпуса документы
+    удаляются, у остальных при необходимости обновляются только метаданные.
+    """
+
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def doc_id(text: str) -> str:
+        """Стабильный ID по содержимому"""
+        return "msg_" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+    @staticmethod
+    def open_collection(client, embedding_function, full: bool = False):
+        """Коллекция для синхронизации; при full или смене модели эмбеддингов - пустая"""
+        try:
+            existing = client.get_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+            model = (existing.metadata or {}).get("embedding_model")
+            if full or model != EMBEDDING_MODEL:
+                client.delete_collection(name=COLLECTION_NAME)
+                reason = "полная пересборка" if full else f"модель эмбеддингов {model} -> {EMBEDDING_MODEL}"
+                logger.info(f"🗑️ Удалена старая коллекция ({reason})")
+        except Exception as e:
+            logger.debug(f"ℹ️ Коллекция не существовала: {e}")
+
+        return client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=embedding_function,
+            metadata={"embedding_model": EMBEDDING_MODEL},
+        )
+
+    @staticmethod
+    def indexed_ids(collection) -> set:
+        """ID всего, что уже есть в коллекции (без текстов и метаданных)"""
+        result = set()
+        while True:
+            page = collection.get(include=[], limit=10000, offset=len(result))
+            if not page["ids"]:
+                return result
+            result.update(page["ids"])
+
+    @staticmethod
+    def _batches(items: List[Any]):
+        for start in range(0, len(items), VectorIndexer.BATCH_SIZE):
+            yield start, items[start:start + VectorIndexer.BATCH_SIZE]
+
+    @staticmethod
+    def _split(collection, batch: List[tuple], indexed: set, stats: Dict[str, int]) -> Iterator[tuple]:
+        """Батч (id, текст, метаданные) -> новые документы и документы со сменившимися метаданными"""
+        new = [item for item in batch if item[0] not in indexed]
+        old = [item for item in batch if item[0] in indexed]
+        if new:
+            stats["added"] += len(new)
+            yield [i for i, _, _ in new], [t for _, t, _ in new], [m for _, _, m in new]
+        if old:
+            current = collection.get(ids=[i for i, _, _ in old], include=["metadatas"])
+            current = dict(zip(current["ids"], current["metadatas"]))
+            changed = [(i, m) for i, _, m in old if current.get(i) != m]
+            stats["changed"] += len(changed)
+            stats["unchanged"] += len(old) - len(changed)
+            # Текст не изменился - эмбеддинг тот же, documents=None: только метаданные
+            if changed:
+                yield [i for i, _ in changed], None, [m for _, m in changed]
+
+    @staticmethod
+    def plan(collection, documents: Iterable[tuple], indexed: set, seen: set,
+             stats: Dict[str, int]) -> Iterator[tuple]:
+        """Поток (текст, метаданные) -> батчи (ids, documents, metadatas) для конвейера"""
+        batch = []
+        for text, metadata in documents:
+            doc_id = VectorIndexer.doc_id(text)
+            if doc_id in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(doc_id)
+            batch.append((doc_id, text, metadata))
+            if len(batch) >= INDEX_BATCH_SIZE:
+                yield from VectorIndexer._split(collection, batch, indexed, stats)
+                batch = []
+        if batch:
+            yield from VectorIndexer._split(collection, batch, indexed, stats)
+
+    @staticmethod
+    def sync(collection, documents: Iterable[tuple], embedding_function) -> Dict[str, int]:
+        """Приводит коллекцию к потоку (текст, метаданные) -> счётчики изменений.
+
+        В памяти - множества ID (коллекции и корпуса) и несколько батчей,
+        сами тексты проходят насквозь.
+        """
+        stats = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "duplicates": 0}
+        indexed = VectorIndexer.indexed_ids(collection)
+        seen = set()
+        batches = VectorIndexer.plan(collection, documents, indexed, seen, stats)
+
+        # Пул процессов окупается только на большом числе новых документов -
+        # решаем по началу потока (просмотр вперёд ограничен)
+        lookahead = []
+        new_docs = 0
+        for batch in batches:
+            lookahead.append(batch)
+            if batch[1] is not None:
+                new_docs += len(batch[0])
+            if new_docs >= INDEX_PARALLEL_MIN_DOCS or len(lookahead) * INDEX_BATCH_SIZE >= 10 * INDEX_PARALLEL_MIN_DOCS:
+                break
+        parallel = new_docs >= INDEX_PARALLEL_MIN_DOCS
+        workers, threads = resolve_workers() if parallel else (0, 0)
+        pipeline = EmbeddingPipeline(
+            workers=workers,
+            threads=threads,
+            cache=getattr(embedding_function, "cache", None),
+            local_embed=embedding_function,
+        )
+
+        def write(ids, documents, metadatas, embeddings):
+            if documents is None:
+                collection.update(ids=ids, metadatas=metadatas)
+            else:
+                collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+        pipeline.run(itertools.chain(lookahead, batches), write)
+
+        removed = [doc_id for doc_id in indexed if doc_id not in seen]
+        for _, batch in VectorIndexer._batches(removed):
+            collection.delete(ids=batch)
+        stats["removed"] = len(removed)
+
+        logger.info(
+            f"🔄 Синхронизация: новых {stats['added']}, удалено {stats['removed']}, "
+            f"метаданные {stats['changed']}, без изменений {stats['unchanged']}, "
+            f"повторов текста {stats['duplicates']}"
+        )
+        return stats
+
+
+def build_vector_db(full: bool = False):
+    """Создает и индексирует ChromaDB базу с LLM-парсингом фактов.
+
+    По умолчанию коллекция обновляется инкрементально (VectorIndexer);
+    full=True (--full) - пересобрать её с нуля. Сообщения читаются потоком
+    (message_stream.py): файл не загружается в память целиком. Первый проход
+    находит повторы (dedup.py), во второй индексируется по одному тексту
+    на группу с числом повторов в метаданных (duplicate_count).
+    """
     logger.info("🔍 Анализирую messages...")
 
-    if not Path(MESSAGES_FILE).exists():
+    messages_path = Path(MESSAGES_FILE)
+    if not messages_path.exists():
         logger.error(f"❌ {MESSAGES_FILE} не найден!")
         logger.info("💡 Совет: Убедись что ты скопировал user_messages.json в data/")
         return False
 
     try:
-        # Загружаем сообщения
-        with open(MESSAGES_FILE, "r", encoding="utf-8") as f:
-            messages = json.load(f)
-
-        if isinstance(messages, dict):
-            messages = [msg for msgs in messages.values() for msg in msgs]
+        processor = MessageProcessor()
 
-        if not messages:
+        # ===== ПРОХОД 1: ПОВТОРЫ И ВЫБОРКА ДЛЯ ФАКТОВ =====
+        # Дедупликатор видит весь корпус; Mistral - только начало переписки
+        dedup = Deduplicator() if DEDUP_ENABLED else None
+        sample_stats = processor.new_stats()
+        prepared = processor.iter_prepared(iter_messages(messages_path), sample_stats)
+        if dedup is None:
+            prepared = itertools.islice(prepared, FACTS_SAMPLE_SIZE)
+        sample = []
+        for _, text, _ in prepared:
+            is_new = dedup.observe(text) if dedup is not None else True
+            if is_new and len(sample) < FACTS_SAMPLE_SIZE:
+                sample.append(text)
+        if not sample_stats["total"]:
             logger.warning("⚠️ Сообщений не найдено в файле")
             return False
-
-        logger.info(f"📝 Найдено {len(messages)} сырых сообщений")
-
-        # Обрабатываем и очищаем сообщения
-        processor = MessageProcessor()
-        cleaned_messages, texts, metadatas, stats = processor.prepare_messages(
-            messages
-        )
-
-        logger.info(f"📊 СТАТИСТИКА ОЧИСТКИ:")
-        logger.info(f" ✅ Валидных сообщений: {stats['valid']}")
-        logger.info(f" 🗑️ Отфильтровано: {stats['invalid']}")
-        if stats["invalid_reasons"]:
-            for reason, count in stats["invalid_reasons"].items():
-                logger.info(f" • {reason}: {count}")
+        if not sample:
+            sample = list(itertools.islice(iter_messages(messages_path), FACTS_SAMPLE_SIZE))
 
         # ===== ИЗВЛЕЧЕНИЕ ФАКТОВ С MISTRAL =====
         logger.info("\n📌 ИЗВЛЕКАЮ ФАКТЫ С ПОМОЩЬЮ MISTRAL 7B...")
         extractor = OllamaFactExtractor()
-        facts = extractor.extract_facts(texts if texts else messages)
+        facts = extractor.extract_facts(sample)
 
         # Сохраняем факты
-        facts_path = Path(MESSAGES_FILE).parent / "facts_advanced.json"
+        facts_path = messages_path.parent / "facts_advanced.json"
         with open(facts_path, "w", encoding="utf-8") as f:
             json.dump(facts, f, ensure_ascii=False, indent=2)
         logger.info(f"\n💾 Факты сохранены в: {facts_path}")
 
-        # Сохраняем очищенные сообщения
-        cleaned_messages_path = Path(MESSAGES_FILE).parent / "cleaned_messages.json"
-        with open(cleaned_messages_path, "w", encoding="utf-8") as f:
-            json.dump(cleaned_messages, f, ensure_ascii=False, indent=2)
-        logger.info(f"💾 Очищенные сообщения сохранены в: {cleaned_messages_path}")
-
-        # Создаем ChromaDB
+        # Создаем или обновляем ChromaDB
         client = chromadb.PersistentClient(path=str(CHROMA_DB_DIR))
 
-        try:
-            client.delete_collection(name="user_messages")
-            logger.info("🗑️ Удалена старая коллекция")
-        except Exception as e:
-            logger.debug(f"ℹ️ Коллекция не существовала: {e}")
-
-        embedding_function = (
-            embedding_functions.SentenceTransformerEmbeddingFunction(
-                model_name="paraphrase-multilingual-MiniLM-L12-v2"
-            )
-        )
-
-        collection = client.create_collection(
-            name="user_messages", embedding_function=embedding_function
-        )
-
-        if texts:
-            logger.info(f"📊 Индексирую {len(texts)} очищенных документов...")
+        # Эмбеддинги уже встречавшихся текстов берутся из кэша на диске
+        embedding_function = cached_embedding_function(EMBEDDING_MODEL)
+
+        collection = VectorIndexer.open_collection(client, embedding_function, full=full)
+
+        # Чтение -> очистка -> (cleaned_messages.json, эмбеддинги -> запись) одним потоком
+        logger.info("📊 Синхронизирую очищенные документы с коллекцией...")
+        stats = processor.new_stats()
+        cleaned_messages_path = messages_path.parent / "cleaned_messages.json"
+        with JsonArrayWriter(cleaned_messages_path) as cleaned_writer:
+            def documents():
+                for message, text, metadata in processor.iter_prepared(iter_messages(messages_path), stats):
+                    if dedup is not None:
+                        count = dedup.keep(text)
+                        if count is None:
+                            continue  # повтор: уже учтён в duplicate_count первого текста
+                        metadata["duplicate_count"] = count - 1
+                    cleaned_writer.write(message)
+                    yield text, metadata
+
+            index_stats = VectorIndexer.sync(collection, documents(), embedding_function)
+        logger.info(f"💾 Очищенные сообщения сохранены в: {cleaned_messages_path}")
 
-            BATCH_SIZE = 1000
-            ids = [f"msg_{i}" for i in range(len(texts))]
-            total_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
+        logger.info(f"📝 Найдено {stats['total']} сырых сообщений")
+        logger.info(f"📊 СТАТИСТИКА ОЧИСТКИ:")
+        logger.info(f" ✅ Валидных сообщений: {stats['valid']}")
+        logger.info(f" 🗑️ Отфильтровано: {stats['invalid']}")
+        if stats["invalid_reasons"]:
+            for reason, count in stats["invalid_reasons"].items():
+                logger.info(f" • {reason}: {count}")
+        if dedup is not None and dedup.total:
             logger.info(
-                f"🔄 Обрабатываю {total_batches} батчей по {BATCH_SIZE} сообщений..."
+                f"🧹 ДЕДУПЛИКАЦИЯ: {dedup.total} -> {dedup.unique} документов "
+                f"(-{(dedup.total - dedup.unique) / dedup.total * 100:.1f}%)"
             )
+            logger.info(f" • точных повторов: {dedup.exact}")
+            logger.info(f" • похожих (LSH, порог Жаккара {dedup.threshold}): {dedup.near}")
+            logger.info(f" • память на группы: {dedup.nbytes / 2 ** 20:.1f} МБ")
 
-            for batch_num in range(total_batches):
-                start_idx = batch_num * BATCH_SIZE
-                end_idx = min((batch_num + 1) * BATCH_SIZE, len(texts))
-                batch_ids = ids[start_idx:end_idx]
-                batch_texts = texts[start_idx:end_idx]
-                batch_metadatas = metadatas[start_idx:end_idx]
-
-                collection.add(
-                    ids=batch_ids,
-                    documents=batch_texts,
-                    metadatas=batch_metadatas,
-                )
-
-                if (batch_num + 1) % 10 == 0 or (batch_num + 1) == total_batches:
-                    logger.info(
-                        f"✅ Батч {batch_num + 1}/{total_batches} обработан ({end_idx - start_idx} сообщений)"
-                    )
-
-        logger.info(f"\n✅ ChromaDB collection создана!")
+        logger.info(f"\n✅ ChromaDB collection обновлена!")
         logger.info(f" 📁 Путь: {CHROMA_DB_DIR}")
-        logger.info(f" 📊 Документов: {len(texts)}")
+        logger.info(f" 📊 Документов: {collection.count()} (новых: {index_stats['added']}, удалено: {index_stats['removed']})")
+        if hasattr(embedding_function, "cache"):
+            logger.info(
+                f" 📦 Кэш эмбеддингов: из кэша {embedding_function.hits}, посчитано {embedding_function.misses}"
+            )
         logger.info(f" 💾 JSON факты: {facts_path}")
         logger.info(f" 💾 JSON сообщения: {cleaned_messages_path}")
         if stats["total"] > 0:
@@ -502,7 +651,7 @@ def build_vector_db():
 
         # Проверяем что база работает
         try:
-            if texts:
+            if stats["valid"]:
                 test_count = collection.count()
                 logger.info(f" ✅ Проверка: в коллекции {test_count} документов")
 
@@ -527,5 +676,5 @@ def build_vector_db():
 
 
 if __name__ == "__main__":
-    success = build_vector_db()
+    success = build_vector_db(full="--full" in sys.argv)
     exit(0 if success else 1)
@@ -26,24 +26,201 @@ TELEGRAM_API_ID = int(os.getenv("TELEGRAM_API_ID", "0"))
 TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH", "")
 TELEGRAM_PHONE = os.getenv("TELEGRAM_PHONE", "")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+# Базовый адрес Bot API (для нагрузочных тестов - fake_telegram_api.py)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
 
 # ========== OLLAMA ==========
-# OLLAMA_API_URL уже установлен выше в зависимости от окружения
+# OLLAMA_API_URL уже установлен выше в зависимости от окружения (переменная окружения важнее)
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", OLLAMA_API_URL)
 OLLAMA_MODEL = "mistral:7b"
+# Сколько запросов Ollama обрабатывает параллельно (OLLAMA_NUM_PARALLEL сервера).
+# Клиент не отправляет больше одновременно - остальные ждут своей очереди
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "1"))
+# Пул серверов: "http://gpu1:11434|2,http://gpu2:11434" (адрес|параллельных запросов,
+# без "|" - OLLAMA_NUM_PARALLEL). Пусто - один сервер OLLAMA_API_URL
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", "")
+# Проверка серверов через /api/tags; после стольких сбоев подряд сервер выводится из ротации
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_UNHEALTHY_AFTER = int(os.getenv("OLLAMA_UNHEALTHY_AFTER", "2"))
+# Сколько Ollama держит модель в памяти после запроса ("30m", "1h", -1 - всегда);
+# передаётся в каждом запросе
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
 # ========== ФАЙЛЫ ДАННЫХ ==========
-MESSAGES_FILE = DATA_DIR / "user_messages.json"
+# Выгрузка переписки: список, словарь списков или JSONL (*.jsonl) - читается потоком
+MESSAGES_FILE = Path(os.getenv("MESSAGES_FILE", str(DATA_DIR / "user_messages.json")))
 FACTS_FILE = DATA_DIR / "facts_advanced.json"
 PROMPT_TEMPLATE_FILE = DATA_DIR / "prompt_template.json"
-DIALOGUE_HISTORY_FILE = DATA_DIR / "dialogue_history.json"
+DIALOGUE_HISTORY_FILE = DATA_DIR / "dialogue_history.jsonl"
 CHROMA_DB_DIR = DATA_DIR / "chroma_db"
+BOT_STATE_FILE = DATA_DIR / "bot_state.json"
+
+# Как часто (сек) проверять, не изменился ли prompt_template.json
+PROMPT_RELOAD_CHECK_INTERVAL = float(os.getenv("PROMPT_RELOAD_CHECK_INTERVAL", "2"))
 
 # ========== НАСТРОЙКИ ИНДЕКСАЦИИ ==========
 EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+COLLECTION_NAME = "user_messages"
 BATCH_SIZE = 500
 MIN_MESSAGE_LENGTH = 3
 MAX_MESSAGE_LENGTH = 5000
 
+# ========== НАСТРОЙКИ БОТА ==========
+# Сколько запросов к LLM бот держит одновременно, отдельно не настраивается:
+# это суммарный лимит серверов Ollama (OLLAMA_NUM_PARALLEL / OLLAMA_BACKENDS),
+# иначе лишние запросы ждали бы внутри Ollama, а не в очереди с приоритетами
+
+# Источник обновлений: "polling" (getUpdates) или "webhook" (локальный HTTP-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный https-адрес, который отдаём Telegram
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Потоковые ответы: плейсхолдер + editMessageText по мере генерации.
+# Telegram допускает ~1 сообщение/правку в секунду на чат - чаще не редактируем
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "false").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Очередь к LLM: сколько сообщений может ждать и как долго, прежде чем
+# бот ответит "занят" вместо ответа с опозданием на минуты
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "100"))
+QUEUE_MAX_AGE = float(os.getenv("QUEUE_MAX_AGE", "120"))
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+
+# Склейка сообщений одного чата: окно тишины, максимум ожидания и сообщений в ходе
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.0"))
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "4.0"))
+COALESCE_MAX_MESSAGES = int(os.getenv("COALESCE_MAX_MESSAGES", "10"))
+
+# Число процессов-шардов (1 - всё в одном процессе)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+# Сколько последних update_id помнить для дедупликации и сколько секунд
+# ждать незавершённые ответы при остановке
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "2000"))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
+# ========== HTTP-КЛИЕНТЫ ==========
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+
+# ========== ЛИМИТЫ TELEGRAM ==========
+# Сообщений в секунду: на бота, в личный чат, в группу (20 в минуту)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+TELEGRAM_MAX_SEND_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_SEND_ATTEMPTS", "5"))
+
+# ========== ПОИСК ПО СООБЩЕНИЯМ (RAG) ==========
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "true").lower() in ("1", "true", "yes")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_BUDGET_MS = float(os.getenv("RETRIEVAL_BUDGET_MS", "150"))
+RETRIEVAL_MAX_CHARS = int(os.getenv("RETRIEVAL_MAX_CHARS", "800"))
+
+# ========== КЭШ ОТВЕТОВ ==========
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Семантический уровень: косинусная близость эмбеддингов вопросов
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+
+# ========== СБОРКА ПРОМПТА ==========
+# Окно контекста (num_ctx) - одно для всех запросов: смена num_ctx заставляет
+# Ollama перезагрузить модель. Бюджет промпта = PROMPT_MAX_CTX - PROMPT_NUM_PREDICT
+PROMPT_MAX_CTX = int(os.getenv("PROMPT_MAX_CTX", "4096"))
+PROMPT_NUM_PREDICT = int(os.getenv("PROMPT_NUM_PREDICT", "300"))
+# Потолки частей промпта в токенах; заполняются по приоритету:
+# вопрос > system prompt > история > найденные сообщения > факты
+PROMPT_QUESTION_TOKENS = int(os.getenv("PROMPT_QUESTION_TOKENS", "300"))
+PROMPT_SYSTEM_TOKENS = int(os.getenv("PROMPT_SYSTEM_TOKENS", "900"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "600"))
+PROMPT_RETRIEVAL_TOKENS = int(os.getenv("PROMPT_RETRIEVAL_TOKENS", "300"))
+PROMPT_FACTS_TOKENS = int(os.getenv("PROMPT_FACTS_TOKENS", "150"))
+# Оценка без /api/tokenize (для кириллицы у Mistral ~2.5 символа на токен);
+# уточняется по ответам tokenize
+PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "2.5"))
+PROMPT_TOKENIZE_TIMEOUT = float(os.getenv("PROMPT_TOKENIZE_TIMEOUT", "2"))
+# Тексты короче этого считаются только оценкой, без запроса к /api/tokenize
+PROMPT_TOKENIZE_MIN_CHARS = int(os.getenv("PROMPT_TOKENIZE_MIN_CHARS", "1000"))
+
+# ========== ИСТОРИЯ ДИАЛОГОВ ==========
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+# Сколько последних реплик чата (вопросы + ответы) и символов передавать модели
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "10"))
+HISTORY_MAX_CHARS = int(os.getenv("HISTORY_MAX_CHARS", "1500"))
+# Сколько чатов держать в памяти; дольше всех молчавшие забываются
+HISTORY_MAX_CHATS = int(os.getenv("HISTORY_MAX_CHATS", "10000"))
+# Журнал переписывается, когда в нём больше строк, чем max(этого, 2 x живых реплик)
+HISTORY_COMPACT_MIN_LINES = int(os.getenv("HISTORY_COMPACT_MIN_LINES", "5000"))
+
+# ========== ПОВТОРЫ И ПРЕДОХРАНИТЕЛЬ OLLAMA ==========
+# Общий бюджет на ответ бота и на один промпт извлечения фактов (сек) -
+# включая все повторы и паузы между ними
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "120"))
+FACTS_DEADLINE = float(os.getenv("FACTS_DEADLINE", "900"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+# После стольких ошибок подряд запросы к Ollama сразу отклоняются на
+# BREAKER_RESET_TIMEOUT сек, затем пропускается один пробный
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# ========== ПЛАНИРОВЩИК ЗАПРОСОВ LLM ==========
+# Очередь к Ollama по классам: ответы в чате, затем фоновые задачи
+# (извлечение фактов, пересборка), затем прогрев модели
+# Какую долю слотов каждого сервера могут занять фоновые задачи (минимум 1 слот);
+# считается по всем процессам вместе (файлы-замки рядом с LLM_ACTIVITY_FILE)
+LLM_BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.5"))
+# Фоновая задача не начинает новый запрос, пока бот (в любом процессе)
+# отвечал в чате за последние LLM_INTERACTIVE_GRACE сек, но ждёт не дольше
+# LLM_BACKGROUND_MAX_DEFER сек
+LLM_INTERACTIVE_GRACE = float(os.getenv("LLM_INTERACTIVE_GRACE", "3"))
+LLM_BACKGROUND_MAX_DEFER = float(os.getenv("LLM_BACKGROUND_MAX_DEFER", "60"))
+LLM_ACTIVITY_FILE = DATA_DIR / "llm_interactive.stamp"
+
+# ========== ПРОГРЕВ МОДЕЛИ ==========
+# При старте бот загружает модель и прогоняет system prompt на каждом
+# сервере, затем раз в WARMUP_CHECK_INTERVAL сек проверяет, не выгрузила ли
+# Ollama модель, и прогревает заново
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_CHECK_INTERVAL = float(os.getenv("WARMUP_CHECK_INTERVAL", "30"))
+# Загрузка модели на CPU может занимать минуты
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "600"))
+
+# ========== КЭШ ЭМБЕДДИНГОВ ==========
+# Эмбеддинги сообщений и вопросов хранятся на диске по хэшу текста
+# (см. embedding_cache.py); при смене модели кэш сбрасывается
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = DATA_DIR / "embedding_cache"
+
+# ========== ИНДЕКСАЦИЯ ==========
+# Эмбеддинги считают процессы-воркеры (у каждого своя копия модели и
+# INDEX_TORCH_THREADS потоков torch), запись в ChromaDB - один поток.
+# 0 - подобрать по числу ядер
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "0"))
+INDEX_TORCH_THREADS = int(os.getenv("INDEX_TORCH_THREADS", "0"))
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))
+# Сколько готовых батчей может ждать записи (дальше воркеры притормаживают)
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "4"))
+# Меньше стольких новых документов - считаем в основном процессе, без пула
+INDEX_PARALLEL_MIN_DOCS = int(os.getenv("INDEX_PARALLEL_MIN_DOCS", "2000"))
+
+# ========== ДЕДУПЛИКАЦИЯ ==========
+# Повторы убираются до эмбеддингов: точные - по нормализованному тексту,
+# почти точные - MinHash/LSH по символьным n-граммам. Порог - оценка
+# сходства Жаккара (1.0 - только точные повторы)
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_SHINGLE_SIZE = int(os.getenv("DEDUP_SHINGLE_SIZE", "3"))
+
 # ========== НАСТРОЙКИ ЛОГИРОВАНИЯ ==========
 DEBUG = True
 LOG_LEVEL = "INFO"
@@ -62,4 +239,6 @@ CHROMA_DB_DIR.mkdir(exist_ok=True)
 print("✅ Config загружен успешно!")
 print(f"   DATA_DIR: {DATA_DIR}")
 print(f"   OLLAMA_API_URL: {OLLAMA_API_URL}")
+if OLLAMA_BACKENDS:
+    print(f"   OLLAMA_BACKENDS: {OLLAMA_BACKENDS}")
 print(f"   OLLAMA_MODEL: {OLLAMA_MODEL}")
\ No newline at end of file
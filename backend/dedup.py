@@ -0,0 +1,230 @@
+# dedup.py - УДАЛЕНИЕ ПОВТОРОВ ПЕРЕД ЭМБЕДДИНГАМИ
+#
+# В выгрузке Telegram много повторов: пересланные сообщения, копипаста,
+# "ахах"/"ахахах". Каждый повтор - лишний эмбеддинг, лишний документ в индексе
+# и занятое место в top-k при поиске. Deduplicator проходит поток сообщений
+# дважды:
+#   1. observe(text) - раскладывает тексты по группам: точные повторы - по
+#      хэшу нормализованного текста, почти точные - MinHash по символьным
+#      n-граммам + LSH: текст, совпавший с первым текстом группы хотя бы в
+#      одной полосе сигнатуры, попадает в эту группу (число полос и строк
+#      подобрано под порог, см. lsh_params);
+#   2. keep(text) - первому тексту группы отдаёт число сообщений в ней,
+#      остальным None.
+#
+# Память. Ни тексты, ни сигнатуры не хранятся - только 64-битные хэши в
+# PackedMap (12 байт на ячейку, заполнение от 1/4 до 1/2):
+#   - на каждый различный нормализованный текст - ячейка точного ключа;
+#   - на каждую группу - по ячейке на полосу, 4 байта счётчика и 1 байт
+#     отметки второго прохода.
+# При настройках по умолчанию (порог 0.9, 64 перестановки -> 3 полосы) это
+# не больше ~200 байт на уникальное сообщение и ~48 байт на повтор,
+# независимо от длины текстов.
+
+import hashlib
+import re
+import zlib
+from array import array
+import numpy as np
+from config import DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE
+
+_NON_WORD = re.compile(r"[\W_]+")
+_MASK64 = (1 << 64) - 1
+_BAND_SALT = 0x9E3779B97F4A7C15
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е, без пунктуации, эмодзи и лишних пробелов"""
+    normalized = _NON_WORD.sub(" ", text.lower().replace("ё", "е")).strip()
+    # Сообщения из одних эмодзи/знаков сравниваем как есть, а не как пустую строку
+    return normalized or text.strip()
+
+
+def lsh_params(threshold, num_perm):
+    """(полос, строк в полосе): меньше всего ложных кандидатов и пропусков вокруг порога"""
+    similarity = np.linspace(0.0, 1.0, 201)
+    below = similarity < threshold
+    best, best_error = (1, num_perm), None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        # Вероятность, что пара со сходством s совпадёт хотя бы в одной полосе
+        candidate = 1 - (1 - similarity ** rows) ** bands
+        error = candidate[below].sum() + (1 - candidate[~below]).sum()
+        if best_error is None or error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+def _as_key(value):
+    """64-битный хэш -> ключ PackedMap (0 занят под пустую ячейку)"""
+    return value or 1
+
+
+class PackedMap:
+    """Словарь uint64 -> int32 на двух numpy-массивах (открытая адресация).
+
+    Ключи - уже равномерные хэши, поэтому ячейка - младшие биты ключа.
+    Ключ 0 обозначает пустую ячейку.
+    """
+
+    def __init__(self, capacity=1 << 10):
+        self._keys = np.zeros(capacity, dtype=np.uint64)
+        self._values = np.zeros(capacity, dtype=np.int32)
+        self._mask = capacity - 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self._keys.nbytes + self._values.nbytes
+
+    def _slot(self, key):
+        keys = self._keys
+        slot = key & self._mask
+        while True:
+            current = keys.item(slot)
+            if current == key or current == 0:
+                return slot
+            slot = (slot + 1) & self._mask
+
+    def get(self, key):
+        slot = self._slot(key)
+        return self._values.item(slot) if self._keys.item(slot) else None
+
+    def set(self, key, value):
+        slot = self._slot(key)
+        if not self._keys.item(slot):
+            self.size += 1
+            self._keys[slot] = key
+        self._values[slot] = value
+        if self.size * 2 > len(self._keys):
+            self._grow()
+
+    def _grow(self):
+        """Вдвое больше ячеек; записи переносятся пачкой, без цикла по ним"""
+        used = np.nonzero(self._keys)[0]
+        keys, values = self._keys[used], self._values[used]
+        self._keys = np.zeros(len(self._keys) * 2, dtype=np.uint64)
+        self._values = np.zeros(len(self._keys), dtype=np.int32)
+        self._mask = len(self._keys) - 1
+        # Линейное пробирование раундами: в каждую свободную ячейку встаёт
+        # один из претендентов, остальные сдвигаются на следующую
+        slots = keys & np.uint64(self._mask)
+        pending = np.arange(len(keys))
+        while len(pending):
+            free = self._keys[slots[pending]] == 0
+            candidates = pending[free]
+            taken, first = np.unique(slots[candidates], return_index=True)
+            winners = candidates[first]
+            self._keys[taken] = keys[winners]
+            self._values[taken] = values[winners]
+            placed = np.zeros(len(keys), dtype=bool)
+            placed[winners] = True
+            pending = pending[~placed[pending]]
+            slots[pending] = (slots[pending] + np.uint64(1)) & np.uint64(self._mask)
+
+
+class Deduplicator:
+    """Группы точных и почти точных повторов в потоке текстов"""
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, shingle_size=DEDUP_SHINGLE_SIZE):
+        """threshold >= 1 - только точные повторы (после нормализации)"""
+        self.threshold = threshold
+        self.shingle_size = max(1, shingle_size)
+        self.near_enabled = threshold < 1.0
+        # Фиксированное зерно: одни и те же группы от запуска к запуску,
+        # иначе инкрементальная индексация гоняла бы документы туда-обратно
+        rng = np.random.RandomState(1)
+        self._a = rng.randint(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._groups = PackedMap()  # хэш нормализованного текста -> номер группы
+        self._bands = PackedMap()   # хэш полосы первого текста группы -> номер группы
+        self._counts = array("I")   # номер группы -> сообщений в ней
+        self._kept = None
+        self.total = 0
+        self.exact = 0
+        self.near = 0
+
+    @property
+    def unique(self):
+        return len(self._counts)
+
+    @property
+    def nbytes(self):
+        """Сколько байт занимает состояние групп"""
+        kept = len(self._kept) if self._kept is not None else 0
+        return self._groups.nbytes + self._bands.nbytes + self._counts.itemsize * len(self._counts) + kept
+
+    @staticmethod
+    def _key(normalized):
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+        return _as_key(int.from_bytes(digest, "little"))
+
+    def signature(self, normalized):
+        """MinHash по множеству символьных n-грамм"""
+        n = self.shingle_size
+        shingles = {normalized[i:i + n] for i in range(max(1, len(normalized) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        # Хэш-функции вида (a*x + b) >> 32 по модулю 2^64, минимум по n-граммам
+        return ((hashes[:, None] * self._a + self._b) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        """По 64-битному хэшу на полосу сигнатуры (свой сдвиг у каждой полосы)"""
+        data = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [
+            _as_key((hash(data[i * width:(i + 1) * width]) + i * _BAND_SALT) & _MASK64)
+            for i in range(self.bands)
+        ]
+
+    def _similar_group(self, band_keys):
+        """Самая ранняя группа, с первым текстом которой совпала хотя бы одна полоса"""
+        groups = [group for group in map(self._bands.get, band_keys) if group is not None]
+        return min(groups) if groups else None
+
+    def observe(self, text):
+        """Проход 1: учитывает текст -> True, если он открыл новую группу"""
+        self.total += 1
+        normalized = normalize(text)
+        key = self._key(normalized)
+        group = self._groups.get(key)
+        if group is not None:
+            self._counts[group] += 1
+            self.exact += 1
+            return False
+
+        band_keys = None
+        if self.near_enabled:
+            band_keys = self._band_keys(self.signature(normalized))
+            group = self._similar_group(band_keys)
+            if group is not None:
+                self._groups.set(key, group)
+                self._counts[group] += 1
+                self.near += 1
+                return False
+
+        group = len(self._counts)
+        self._groups.set(key, group)
+        self._counts.append(1)
+        # Полосы запоминаются только у первого текста группы, поэтому группа
+        # не расползается цепочкой похожих друг на друга текстов
+        for band_key in band_keys or ():
+            self._bands.set(band_key, group)
+        return True
+
+    def keep(self, text):
+        """Проход 2: число сообщений группы для её первого текста, None - для повтора"""
+        if self._kept is None:
+            self._kept = bytearray(len(self._counts))
+        group = self._groups.get(self._key(normalize(text)))
+        if group is None:
+            return 1  # в первом проходе текста не было
+        if self._kept[group]:
+            return None
+        self._kept[group] = 1
+        return self._counts[group]
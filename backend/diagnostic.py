@@ -62,7 +62,7 @@ files_to_check = [
     'data/user_messages.json',
     'data/facts_advanced.json',
     'data/prompt_template.json',
-    'data/dialogue_history.json'
+    'data/dialogue_history.jsonl'
 ]
 
 for file_path in files_to_check:
@@ -0,0 +1,192 @@
+# dispatcher.py - АСИНХРОННАЯ РАЗДАЧА ОБНОВЛЕНИЙ ВОРКЕРАМ
+
+import asyncio
+import logging
+import time
+from config import QUEUE_MAX_DEPTH, QUEUE_MAX_AGE
+from config import COALESCE_WINDOW, COALESCE_MAX_WAIT, COALESCE_MAX_MESSAGES
+from metrics import metrics
+from ollama_client import ollama
+
+logger = logging.getLogger(__name__)
+
+# Команды отвечаются сразу, не дожидаясь LLM
+COMMANDS = ("/start", "/clear")
+
+
+def parse_update(update):
+    """Достаёт (chat_id, username, text) из обновления Telegram"""
+    msg = update.get("message", {})
+    chat_id = msg.get("chat", {}).get("id")
+    username = msg.get("from", {}).get("username", "Unknown")
+    text = msg.get("text", "").strip()
+    return chat_id, username, text
+
+
+class UpdateDispatcher:
+    """Раздаёт обновления по чатам.
+
+    Разные чаты обрабатываются параллельно, сообщения одного chat_id -
+    строго по очереди. Для каждого активного чата живёт одна задача-воркер,
+    которая завершается, как только очередь чата опустела.
+
+    Одновременно к LLM идёт не больше llm_concurrency ходов - по умолчанию
+    столько, сколько слотов у серверов Ollama этого процесса
+    (ollama.router.capacity), чтобы запросы не копились внутри Ollama в
+    обход очереди с приоритетами.
+
+    Между приёмом и LLM стоит ограниченная очередь: не больше max_depth
+    ожидающих сообщений на все чаты и не старше max_age секунд к моменту,
+    когда освободился слот LLM. Всё, что не влезло или устарело, сбрасывается
+    через handle_shed (быстрый ответ "занят").
+
+    Несколько сообщений подряд из одного чата ("привет", "как дела", ...)
+    склеиваются в один вопрос: воркер ждёт coalesce_window секунд тишины
+    (но не дольше coalesce_max_wait) и отвечает на всё разом.
+    """
+
+    def __init__(self, handle_command, handle_message, handle_shed, on_complete=None,
+                 llm_concurrency=None, max_depth=QUEUE_MAX_DEPTH, max_age=QUEUE_MAX_AGE,
+                 coalesce_window=COALESCE_WINDOW, coalesce_max_wait=COALESCE_MAX_WAIT,
+                 coalesce_max_messages=COALESCE_MAX_MESSAGES):
+        self.handle_command = handle_command  # async (chat_id, text)
+        self.handle_message = handle_message  # async (chat_id, text)
+        self.handle_shed = handle_shed        # async (chat_id, text)
+        self.on_complete = on_complete or (lambda update_id: None)  # после отправки ответа
+        self.llm_concurrency = llm_concurrency or ollama.router.capacity
+        self.llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_wait = coalesce_max_wait
+        self.coalesce_max_messages = coalesce_max_messages
+        self.chat_queues = {}
+        self.tasks = set()
+        self.pending = 0
+        self.inflight = 0
+
+    def dispatch(self, update):
+        """Принимает обновление, не блокируя цикл получения"""
+        update_id = update.get("update_id")
+        chat_id, username, text = parse_update(update)
+        if not chat_id or not text:
+            self.on_complete(update_id)
+            return
+
+        logger.info(f"Q [{chat_id}] (@{username}): {text}")
+
+        if text in COMMANDS:
+            self._spawn(self._run_command(update_id, chat_id, text))
+            return
+
+        if self.pending >= self.max_depth:
+            logger.warning(f"⚠️ Очередь заполнена ({self.pending}) - сбрасываю [{chat_id}]")
+            metrics.inc("bot_shed_full_total")
+            self._spawn(self._run_shed(update_id, chat_id, text))
+            return
+
+        queue = self.chat_queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.chat_queues[chat_id] = queue
+            self._spawn(self._chat_worker(chat_id, queue))
+        queue.put_nowait((update_id, text, time.monotonic()))
+
+        self.pending += 1
+        metrics.inc("bot_accepted_total")
+        self._update_gauges()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _update_gauges(self):
+        metrics.set("bot_queue_depth", self.pending - self.inflight)
+        metrics.set("bot_llm_inflight", self.inflight)
+
+    async def _run_command(self, update_id, chat_id, text):
+        try:
+            await self.handle_command(chat_id, text)
+        except Exception as e:
+            logger.error(f"❌ Ошибка команды {text} [{chat_id}]: {e}")
+        self.on_complete(update_id)
+
+    async def _run_shed(self, update_id, chat_id, text):
+        try:
+            await self.handle_shed(chat_id, text)
+        except Exception as e:
+            logger.error(f"❌ Ошибка ответа 'занят' [{chat_id}]: {e}")
+        self.on_complete(update_id)
+
+    async def _chat_worker(self, chat_id, queue):
+        """Последовательно обрабатывает сообщения одного чата пачками"""
+        try:
+            while not queue.empty():
+                batch = [queue.get_nowait()]
+                try:
+                    try:
+                        await self._debounce(queue)
+                        await self._process(chat_id, queue, batch)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки [{chat_id}]: {e}")
+                    # При отмене (остановка по таймауту) сюда не попадаем -
+                    # обновления остаются незавершёнными и переиграются после рестарта
+                    for update_id, _, _ in batch:
+                        self.on_complete(update_id)
+                finally:
+                    self.pending -= len(batch)
+                    self._update_gauges()
+        finally:
+            # Между проверкой empty() и удалением нет await - гонки нет
+            self.chat_queues.pop(chat_id, None)
+
+    async def _debounce(self, queue):
+        """Ждёт, пока человек допишет: окно продлевается, пока приходят сообщения"""
+        if self.coalesce_window <= 0:
+            return
+        started = time.monotonic()
+        while True:
+            size = queue.qsize()
+            await asyncio.sleep(self.coalesce_window)
+            if queue.qsize() == size or time.monotonic() - started >= self.coalesce_max_wait:
+                return
+
+    async def _process(self, chat_id, queue, batch):
+        """Один ход LLM на все накопившиеся сообщения чата.
+
+        Очередь дочитывается уже после получения слота LLM: всё, что
+        пришло, пока чат ждал слот или пока шла прошлая генерация,
+        попадает в этот же ход, а не ждёт отдельного.
+        """
+        await self.llm_slots.acquire()
+        while not queue.empty() and len(batch) < self.coalesce_max_messages:
+            batch.append(queue.get_nowait())
+
+        text = "\n".join(item_text for _, item_text, _ in batch)
+        age = time.monotonic() - min(received_at for _, _, received_at in batch)
+        if age > self.max_age:
+            self.llm_slots.release()
+            logger.warning(f"⚠️ Сообщение ждало {age:.0f} сек - сбрасываю [{chat_id}]")
+            metrics.inc("bot_shed_stale_total", len(batch))
+            await self.handle_shed(chat_id, text)
+            return
+
+        if len(batch) > 1:
+            logger.info(f"🧩 Объединил {len(batch)} сообщений [{chat_id}] в один ход")
+            metrics.inc("bot_coalesced_messages_total", len(batch) - 1)
+        metrics.inc("bot_llm_turns_total")
+
+        self.inflight += 1
+        self._update_gauges()
+        try:
+            await self.handle_message(chat_id, text)
+        finally:
+            self.inflight -= 1
+            self.llm_slots.release()
+
+    async def join(self):
+        """Дожидается завершения всех текущих задач"""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
@@ -0,0 +1,204 @@
+# embedding_cache.py - КЭШ ЭМБЕДДИНГОВ НА ДИСКЕ
+#
+# Эмбеддинг текста считается один раз: при сборке базы и повторных сборках с
+# другими фильтрами. Хранилище - один append-only файл записей
+# фиксированного размера (16 байт хэша текста + вектор float32), открытый
+# через numpy.memmap; индекс хэш -> строка строится при открытии и
+# дочитывается, когда файл вырос (его дописывает сборка). Рядом JSON с
+# моделью и версией sentence-transformers: при их смене кэш сбрасывается.
+#
+# Бот файл только читает (persist=False): вопросы пользователей не
+# повторяются так, как сообщения при пересборке, и дописывать их значило бы
+# растить файл без предела. Последние QUERY_MEMORY_SIZE векторов вопросов
+# держатся в памяти процесса.
+#
+#   embedding_function = cached_embedding_function()   # вместо SentenceTransformerEmbeddingFunction
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from config import EMBEDDING_MODEL, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_DIR
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+# Сколько посчитанных, но не записанных на диск векторов держать в памяти (persist=False)
+QUERY_MEMORY_SIZE = 1000
+
+
+def text_key(text):
+    """Хэш текста - ключ записи"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+def model_version():
+    """Версия библиотеки модели - входит в тег кэша"""
+    try:
+        import sentence_transformers
+        return sentence_transformers.__version__
+    except Exception:
+        return "unknown"
+
+
+class EmbeddingCache:
+    """Матрица эмбеддингов в memmap-файле + индекс хэш -> строка"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, directory=EMBEDDING_CACHE_DIR, version=None):
+        self.tag = f"{model_name}@{version or model_version()}"
+        slug = re.sub(r"[^\w.-]+", "_", model_name)
+        self.path = directory / f"{slug}.emb"
+        self.meta_path = directory / f"{slug}.json"
+        self.dim = None
+        self.rows = 0
+        self.index = {}
+        self._map = None
+        self._lock = threading.Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+        self._load_meta()
+
+    def _load_meta(self):
+        if not self.meta_path.exists():
+            self.path.unlink(missing_ok=True)  # без описания размерность неизвестна
+            return
+        try:
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            meta = {}
+        if meta.get("tag") == self.tag and meta.get("dim"):
+            self.dim = meta["dim"]
+            self._repair_tail()
+            self._refresh()
+            logger.info(f"📦 Кэш эмбеддингов: {self.rows} векторов ({self.tag})")
+        else:
+            logger.info(f"🗑️ Кэш эмбеддингов от другой модели ({meta.get('tag')}), начинаю заново")
+            self.path.unlink(missing_ok=True)
+            self.meta_path.unlink(missing_ok=True)
+
+    @property
+    def dtype(self):
+        return np.dtype([("key", f"V{KEY_SIZE}"), ("vec", "<f4", (self.dim,))])
+
+    def _repair_tail(self):
+        # Недописанная запись после аварийной остановки сдвинула бы все следующие
+        if self.path.exists():
+            size = self.path.stat().st_size
+            extra = size % self.dtype.itemsize
+            if extra:
+                logger.warning(f"⚠️ Кэш эмбеддингов: отрезаю недописанную запись ({extra} байт)")
+                os.truncate(self.path, size - extra)
+
+    def _refresh(self):
+        """Подхватывает записи, дописанные с прошлого раза (в т.ч. другим процессом)"""
+        if self.dim is None or not self.path.exists():
+            return
+        rows = self.path.stat().st_size // self.dtype.itemsize
+        if rows <= self.rows:
+            return
+        self._map = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(rows,))
+        for row, key in enumerate(self._map["key"][self.rows:rows], start=self.rows):
+            self.index.setdefault(bytes(key), row)
+        self.rows = rows
+
+    def lookup(self, keys):
+        """Векторы по ключам (None - нет в кэше)"""
+        with self._lock:
+            if any(key not in self.index for key in keys):
+                self._refresh()
+            rows = [self.index.get(key) for key in keys]
+            return [None if row is None else np.array(self._map["vec"][row]) for row in rows]
+
+    def append(self, keys, vectors):
+        """Дописывает новые векторы одной записью в конец файла"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self.meta_path.write_text(json.dumps({"tag": self.tag, "dim": self.dim}), encoding="utf-8")
+            records = np.empty(len(keys), dtype=self.dtype)
+            records["key"] = [np.void(key) for key in keys]
+            records["vec"] = vectors
+            with open(self.path, "ab") as f:
+                f.write(records.tobytes())
+            self._refresh()
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """Embedding function для ChromaDB: сначала кэш, модель - только для новых текстов.
+
+    persist=False - новые векторы не дописываются в файл, а остаются в
+    ограниченном LRU в памяти (так работает бот).
+    """
+
+    def __init__(self, inner, cache, persist=True, memory_size=QUERY_MEMORY_SIZE):
+        self.inner = inner
+        self.cache = cache
+        self.persist = persist
+        self.memory_size = memory_size
+        self.recent = OrderedDict()
+        self._recent_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, keys):
+        vectors = self.cache.lookup(keys)
+        if not self.persist:
+            with self._recent_lock:
+                for i, key in enumerate(keys):
+                    if vectors[i] is None and key in self.recent:
+                        self.recent.move_to_end(key)
+                        vectors[i] = self.recent[key]
+        return vectors
+
+    def _remember(self, keys, vectors):
+        if self.persist:
+            self.cache.append(keys, vectors)
+            return
+        with self._recent_lock:
+            for key, vector in zip(keys, vectors):
+                self.recent[key] = vector
+                self.recent.move_to_end(key)
+            while len(self.recent) > self.memory_size:
+                self.recent.popitem(last=False)
+
+    def __call__(self, input):
+        keys = [text_key(text) for text in input]
+        vectors = self._lookup(keys)
+
+        missing = {}
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+        hits = len(keys) - sum(len(positions) for positions in missing.values())
+        self.hits += hits
+        self.misses += len(missing)
+        metrics.inc("embedding_cache_hits_total", hits)
+        metrics.inc("embedding_cache_misses_total", len(missing))
+
+        if missing:
+            new_keys = list(missing)
+            computed = np.asarray(self.inner([input[missing[key][0]] for key in new_keys]), dtype=np.float32)
+            self._remember(new_keys, computed)
+            for key, vector in zip(new_keys, computed):
+                for i in missing[key]:
+                    vectors[i] = vector
+        return [vector.tolist() for vector in vectors]
+
+
+def cached_embedding_function(model_name=EMBEDDING_MODEL, persist=True):
+    """SentenceTransformerEmbeddingFunction, обёрнутая кэшем (если он включён).
+
+    persist=False - кэш на диске только читается (бот).
+    """
+    from chromadb.utils import embedding_functions
+
+    inner = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+    if not EMBEDDING_CACHE_ENABLED:
+        return inner
+    return CachedEmbeddingFunction(inner, EmbeddingCache(model_name), persist=persist)
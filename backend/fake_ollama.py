@@ -0,0 +1,219 @@
+# fake_ollama.py - ЛОКАЛЬНЫЕ ПОДДЕЛЬНЫЕ СЕРВЕРЫ OLLAMA ДЛЯ ТЕСТОВ
+#
+# Поднимает один или несколько серверов с API как у Ollama: /api/chat,
+# /api/generate (с потоком и без), /api/embeddings, /api/tags, /api/ps,
+# /api/tokenize. Имитирует ограничение параллельности (num_parallel),
+# загрузку модели при первом запросе и выгрузку после keep_alive.
+#   python fake_ollama.py --ports 11501 11502 --latency 1.0
+#   OLLAMA_BACKENDS=http://127.0.0.1:11501,http://127.0.0.1:11502 python 3_telegram_bot.py
+# POST /_state {"healthy": false} - сервер начинает отвечать 503 (проверка
+# вывода из ротации), GET /_stats - счётчики запросов.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEEP_ALIVE = 300  # как у Ollama: 5 минут
+
+
+def parse_keep_alive(value):
+    """keep_alive Ollama: секунды, "5m"/"1h"/"30s" или отрицательное (навсегда)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value).strip())
+    if not match:
+        return None
+    number = float(match.group(1))
+    if number < 0:
+        return float("inf")
+    return number * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+class FakeOllama:
+    """Состояние одного поддельного сервера"""
+
+    def __init__(self, name="fake", latency=0.5, load_time=2.0, num_parallel=1,
+                 keep_alive=DEFAULT_KEEP_ALIVE, tokenize=True):
+        self.name = name
+        self.latency = latency        # средняя длительность генерации, сек
+        self.load_time = load_time    # загрузка модели при холодном старте, сек
+        self.keep_alive = keep_alive  # сколько держать модель после запроса по умолчанию
+        self.tokenize = tokenize      # поддерживать ли /api/tokenize
+        self.healthy = True
+        self.slots = asyncio.Semaphore(num_parallel)
+        self.loaded = {}              # model -> момент, когда выгрузить
+        self.active = 0
+        self.max_active = 0
+        self.calls = {}
+        self.cold_loads = 0
+
+    def _expire(self):
+        now = time.monotonic()
+        for model in [m for m, until in self.loaded.items() if until <= now]:
+            del self.loaded[model]
+
+    def _touch(self, model, keep_alive):
+        seconds = parse_keep_alive(keep_alive)
+        self.loaded[model] = time.monotonic() + (self.keep_alive if seconds is None else seconds)
+        if seconds == 0:
+            del self.loaded[model]
+
+    async def run(self, body, make_text):
+        """Очередь за слотом, загрузка модели, генерация -> (text, stats)"""
+        model = body.get("model", "mistral:7b")
+        async with self.slots:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                self._expire()
+                load_duration = 0.0
+                if model not in self.loaded:
+                    self.cold_loads += 1
+                    load_duration = self.load_time
+                    await asyncio.sleep(self.load_time)
+                text = make_text()
+                if text:
+                    await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency > 0 else 0)
+                self._touch(model, body.get("keep_alive"))
+            finally:
+                self.active -= 1
+        return text, {
+            "model": model,
+            "done": True,
+            "load_duration": int(load_duration * 1e9),
+            "prompt_eval_count": len(json.dumps(body, ensure_ascii=False)) // 3,
+            "eval_count": len(text) // 3,
+        }
+
+    def answer(self, prompt):
+        return f"Это {self.name}. Ты спросил: {prompt[-40:]}" if prompt else ""
+
+
+def create_app(fake):
+    """FastAPI-приложение одного поддельного сервера"""
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def health_gate(request: Request, call_next):
+        path = request.url.path
+        if path.startswith("/api/"):
+            fake.calls[path] = fake.calls.get(path, 0) + 1
+            if not fake.healthy:
+                return JSONResponse(status_code=503, content={"error": "server unavailable"})
+        return await call_next(request)
+
+    def respond(body, text, stats, wrap):
+        """Ответ целиком или NDJSON по словам; wrap(часть) -> поля чанка"""
+        if body.get("stream", True):
+            async def chunks():
+                for word in re.findall(r"\S+\s*", text):
+                    yield json.dumps({**wrap(word), "done": False}, ensure_ascii=False) + "\n"
+                    await asyncio.sleep(0.01)
+                yield json.dumps(stats) + "\n"
+            return StreamingResponse(chunks(), media_type="application/x-ndjson")
+        return {**wrap(text), **stats}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        question = messages[-1]["content"] if messages else ""
+        text, stats = await fake.run(body, lambda: fake.answer(question))
+        return respond(body, text, stats, lambda part: {"message": {"role": "assistant", "content": part}})
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        # Пустой prompt - только загрузить модель (так делает прогрев)
+        text, stats = await fake.run(body, lambda: fake.answer(body.get("prompt", "")))
+        return respond(body, text, stats, lambda part: {"response": part})
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        digest = hashlib.sha256(body.get("prompt", "").encode("utf-8")).digest()
+        return {"embedding": [b / 255 for b in digest]}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "mistral:7b"}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        fake._expire()
+        return {"models": [{"name": model, "model": model} for model in fake.loaded]}
+
+    @app.post("/api/tokenize")
+    async def tokenize(request: Request):
+        if not fake.tokenize:
+            return JSONResponse(status_code=404, content={"error": "not found"})
+        body = await request.json()
+        return {"tokens": list(range(len(body.get("content", "")) // 3 + 1))}
+
+    @app.post("/_state")
+    async def set_state(request: Request):
+        """{"healthy": false, "latency": 2.0}"""
+        body = await request.json()
+        fake.healthy = body.get("healthy", fake.healthy)
+        fake.latency = body.get("latency", fake.latency)
+        if body.get("unload"):
+            fake.loaded.clear()
+        return {"ok": True}
+
+    @app.get("/_stats")
+    async def stats():
+        return {
+            "name": fake.name,
+            "calls": fake.calls,
+            "max_active": fake.max_active,
+            "cold_loads": fake.cold_loads,
+            "loaded": list(fake.loaded),
+        }
+
+    return app
+
+
+async def serve(fake, host="127.0.0.1", port=11501):
+    """Запускает сервер в текущем event loop (возвращает uvicorn.Server и задачу)"""
+    server = uvicorn.Server(uvicorn.Config(create_app(fake), host=host, port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    logger.info(f"🧪 Fake Ollama {fake.name}: http://{host}:{port}")
+    return server, task
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Поддельные серверы Ollama")
+    parser.add_argument("--ports", type=int, nargs="+", default=[11501])
+    parser.add_argument("--latency", type=float, default=0.5, help="средняя длительность ответа, сек")
+    parser.add_argument("--load-time", type=float, default=2.0, help="холодная загрузка модели, сек")
+    parser.add_argument("--num-parallel", type=int, default=1, help="OLLAMA_NUM_PARALLEL сервера")
+    parser.add_argument("--keep-alive", type=float, default=DEFAULT_KEEP_ALIVE, help="выгрузка модели после простоя, сек")
+    parser.add_argument("--no-tokenize", action="store_true", help="без /api/tokenize (как старые версии)")
+    args = parser.parse_args()
+
+    async def main():
+        tasks = []
+        for port in args.ports:
+            fake = FakeOllama(f"ollama-{port}", args.latency, args.load_time, args.num_parallel,
+                              args.keep_alive, not args.no_tokenize)
+            _, task = await serve(fake, port=port)
+            tasks.append(task)
+        print("OLLAMA_BACKENDS=" + ",".join(f"http://127.0.0.1:{p}|{args.num_parallel}" for p in args.ports))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+# fake_telegram_api.py - ЛОКАЛЬНАЯ ПОДМЕНА TELEGRAM BOT API ДЛЯ НАГРУЗОЧНЫХ ТЕСТОВ
+#
+# Поддерживает getUpdates (long polling), sendMessage, editMessageText,
+# sendChatAction, setWebhook/deleteWebhook. Умеет отвечать 429 с retry_after
+# и добавлять задержку. Бот подключается так:
+#   TELEGRAM_API_BASE=http://127.0.0.1:8081 python 3_telegram_bot.py
+# Обновления подаёт load_test.py (или POST /_inject со списком текстов).
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+class FakeTelegramAPI:
+    """Состояние поддельного Bot API: очередь обновлений и журнал исходящих"""
+
+    def __init__(self, error_rate=0.0, retry_after=1, latency=0.0):
+        self.error_rate = error_rate    # доля исходящих вызовов, получающих 429
+        self.retry_after = retry_after  # retry_after в ответе 429
+        self.latency = latency          # средняя задержка ответа, сек
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.pending = {}               # chat_id -> [время подачи обновления]
+        self.latencies = []
+        self.calls = {}
+        self.injected_429 = 0
+
+    def inject(self, chat_id, text, username="loadtest"):
+        """Кладёт входящее сообщение в очередь getUpdates"""
+        update = {
+            "update_id": self.next_update_id,
+            "message": {
+                "message_id": self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "username": username},
+                "text": text,
+            },
+        }
+        self.next_update_id += 1
+        self.next_message_id += 1
+        self.updates.append(update)
+        self.pending.setdefault(chat_id, []).append(time.monotonic())
+        self.new_updates.set()
+        return update
+
+    async def get_updates(self, offset=None, timeout=0):
+        """Long polling как у Telegram: offset подтверждает предыдущие обновления"""
+        if offset is not None:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout > 0:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates[:100])
+
+    def record_reply(self, method, chat_id):
+        """Первый ответ в чат закрывает все ожидающие обновления этого чата"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method != "sendMessage":
+            return
+        now = time.monotonic()
+        for injected_at in self.pending.pop(chat_id, []):
+            self.latencies.append(now - injected_at)
+
+    def next_message(self, chat_id, text):
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+        self.next_message_id += 1
+        return message
+
+
+async def read_params(request):
+    """Параметры Bot API: query, form или JSON"""
+    params = dict(request.query_params)
+    content_type = request.headers.get("content-type", "")
+    if "application/json" in content_type:
+        params.update(await request.json())
+    elif "form" in content_type:
+        params.update(dict(await request.form()))
+    return params
+
+
+def create_app(api):
+    """FastAPI-приложение, обслуживающее /bot<token>/<method>"""
+    app = FastAPI()
+
+    @app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+    async def bot_method(token: str, method: str, request: Request):
+        params = await read_params(request)
+
+        if method == "getUpdates":
+            offset = params.get("offset")
+            updates = await api.get_updates(
+                int(offset) if offset is not None else None,
+                float(params.get("timeout", 0)),
+            )
+            return {"ok": True, "result": updates}
+
+        if method in ("setWebhook", "deleteWebhook"):
+            return {"ok": True, "result": True}
+
+        if api.latency > 0:
+            await asyncio.sleep(random.expovariate(1 / api.latency))
+
+        if method in ("sendMessage", "editMessageText", "sendChatAction") and random.random() < api.error_rate:
+            api.injected_429 += 1
+            return JSONResponse(status_code=429, content={
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {api.retry_after}",
+                "parameters": {"retry_after": api.retry_after},
+            })
+
+        chat_id = int(params.get("chat_id", 0))
+        api.record_reply(method, chat_id)
+
+        if method == "sendMessage":
+            return {"ok": True, "result": api.next_message(chat_id, params.get("text", ""))}
+        if method == "editMessageText":
+            return {"ok": True, "result": {"message_id": int(params.get("message_id", 0)), "text": params.get("text", "")}}
+        if method == "sendChatAction":
+            return {"ok": True, "result": True}
+
+        return JSONResponse(status_code=404, content={"ok": False, "error_code": 404, "description": "Not Found"})
+
+    @app.post("/_inject")
+    async def inject(request: Request):
+        """Ручная подача: {"chat_id": 1, "texts": ["привет", ...]}"""
+        body = await request.json()
+        for text in body.get("texts", []):
+            api.inject(int(body.get("chat_id", 1)), text)
+        return {"ok": True}
+
+    return app
+
+
+async def serve(api, host="127.0.0.1", port=8081):
+    """Запускает сервер в текущем event loop (возвращает uvicorn.Server и задачу)"""
+    server = uvicorn.Server(uvicorn.Config(create_app(api), host=host, port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    logger.info(f"🧪 Fake Bot API: http://{host}:{port}")
+    return server, task
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Поддельный Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля вызовов с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка ответа, сек")
+    args = parser.parse_args()
+
+    async def main():
+        api = FakeTelegramAPI(args.error_rate, args.retry_after, args.latency)
+        server, task = await serve(api, port=args.port)
+        await task
+        print(json.dumps(api.calls, ensure_ascii=False))
+
+    asyncio.run(main())
@@ -0,0 +1,222 @@
+# history_store.py - ИСТОРИЯ ДИАЛОГОВ ПО ЧАТАМ
+#
+# В памяти - кольцевой буфер на чат: не больше HISTORY_MAX_MESSAGES сообщений
+# и HISTORY_MAX_CHARS символов, старые реплики вытесняются; чатов - не больше
+# HISTORY_MAX_CHATS, давно молчавшие забываются первыми. На диске -
+# append-only журнал data/dialogue_history.jsonl, по строке на реплику или
+# очистку чата. Когда журнал разрастается относительно живых данных, он один
+# раз переписывается из памяти (компакция).
+#
+# Event loop бота диск не трогает: память меняется сразу, а строки журнала и
+# компакция (снимок живых реплик) уходят в очередь одного потока записи.
+# Журнал читается при старте через load() в отдельном потоке.
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+from config import (
+    DIALOGUE_HISTORY_FILE, HISTORY_ENABLED, HISTORY_MAX_MESSAGES, HISTORY_MAX_CHARS,
+    HISTORY_MAX_CHATS, HISTORY_COMPACT_MIN_LINES,
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def shard_history_path(shard, num_shards, base=DIALOGUE_HISTORY_FILE):
+    """Свой журнал у каждого процесса-шарда (чат всегда попадает в один шард)"""
+    if num_shards <= 1:
+        return base
+    return base.with_name(f"{base.stem}.shard{shard}of{num_shards}{base.suffix}")
+
+
+class HistoryStore:
+    """Кольцевые буферы реплик + журнал с компакцией в потоке записи"""
+
+    def __init__(self, path=DIALOGUE_HISTORY_FILE, max_messages=HISTORY_MAX_MESSAGES,
+                 max_chars=HISTORY_MAX_CHARS, compact_min_lines=HISTORY_COMPACT_MIN_LINES,
+                 max_chats=HISTORY_MAX_CHATS):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.compact_min_lines = compact_min_lines
+        self.max_chats = max_chats
+        self.chats = OrderedDict()  # chat_id -> deque[(role, content)], недавние в конце
+        self.chars = {}             # chat_id -> суммарная длина реплик
+        self.live = 0               # реплик в памяти
+        self.log_lines = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = None
+
+    def load(self):
+        """Читает журнал и запускает поток записи (при старте бота - через asyncio.to_thread)"""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            bad = 0
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        bad += 1  # недописанная строка после аварийной остановки
+                        continue
+                    self.log_lines += 1
+                    if record.get("clear"):
+                        self._drop(record["chat_id"])
+                    else:
+                        self._push(record["chat_id"], record["role"], record["content"])
+            logger.info(f"📂 История: {len(self.chats)} чатов, {self.log_lines} строк журнала" +
+                        (f", пропущено битых: {bad}" if bad else ""))
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, args=(self.path, self._queue), name="history-writer", daemon=True,
+        )
+        self._writer.start()
+        self._maybe_compact()
+
+    def _clip(self, content):
+        # Пара "вопрос + ответ" всегда помещается в бюджет
+        return content[:self.max_chars // 2]
+
+    def _push(self, chat_id, role, content):
+        content = self._clip(content)
+        buffer = self.chats.get(chat_id)
+        if buffer is None:
+            buffer = self.chats[chat_id] = deque()
+            self.chars[chat_id] = 0
+            while len(self.chats) > self.max_chats:
+                self._drop(next(iter(self.chats)))  # дольше всех молчавший чат
+        else:
+            self.chats.move_to_end(chat_id)
+        buffer.append((role, content))
+        self.chars[chat_id] += len(content)
+        self.live += 1
+        # Вытесняем старое; история не должна начинаться с ответа бота
+        while buffer and (
+            len(buffer) > self.max_messages
+            or self.chars[chat_id] > self.max_chars
+            or buffer[0][0] == "assistant"
+        ):
+            _, old = buffer.popleft()
+            self.chars[chat_id] -= len(old)
+            self.live -= 1
+        if not buffer:
+            self._drop(chat_id)
+
+    def _drop(self, chat_id):
+        buffer = self.chats.pop(chat_id, None)
+        if buffer:
+            self.live -= len(buffer)
+        self.chars.pop(chat_id, None)
+
+    def _write(self, record):
+        self._queue.put(("append", json.dumps(record, ensure_ascii=False) + "\n"))
+        self.log_lines += 1
+
+    def _maybe_compact(self):
+        if self.log_lines > max(self.compact_min_lines, 2 * self.live):
+            # Снимок живых реплик берётся под замком, на диск его пишет поток записи
+            lines = [
+                json.dumps({"chat_id": chat_id, "role": role, "content": content}, ensure_ascii=False) + "\n"
+                for chat_id, buffer in self.chats.items()
+                for role, content in buffer
+            ]
+            logger.info(f"🗜️ Сжимаю журнал истории: {self.log_lines} -> {len(lines)} строк")
+            self.log_lines = len(lines)
+            self._queue.put(("compact", lines))
+
+    @staticmethod
+    def _write_loop(path, tasks):
+        """Поток записи: дописывает строки и переписывает журнал при компакции"""
+        log = open(path, "a", encoding="utf-8")
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                kind, payload = task
+                try:
+                    if kind == "append":
+                        log.write(payload)
+                        log.flush()
+                    else:
+                        tmp_path = path.with_suffix(path.suffix + ".tmp")
+                        with open(tmp_path, "w", encoding="utf-8") as f:
+                            f.writelines(payload)
+                            f.flush()
+                            os.fsync(f.fileno())
+                        log.close()
+                        os.replace(tmp_path, path)
+                        log = open(path, "a", encoding="utf-8")
+                        metrics.inc("history_compactions_total")
+                except OSError as e:
+                    metrics.inc("history_write_errors_total")
+                    logger.error(f"❌ Не удалось записать журнал истории {path}: {e}")
+        finally:
+            log.close()
+
+    def messages(self, chat_id):
+        """История чата в формате messages для /api/chat (старые первыми)"""
+        if not HISTORY_ENABLED or chat_id is None:
+            return []
+        with self._lock:
+            self._ensure_loaded()
+            return [{"role": role, "content": content} for role, content in self.chats.get(chat_id, ())]
+
+    def context_key(self, chat_id):
+        """Короткий хэш последней реплики бота; None - диалог только начинается"""
+        for message in reversed(self.messages(chat_id)):
+            if message["role"] == "assistant":
+                return hashlib.sha1(message["content"].encode("utf-8")).hexdigest()[:12]
+        return None
+
+    def add_turn(self, chat_id, question, answer):
+        """Запоминает вопрос и ответ (на диск - в потоке записи)"""
+        if not HISTORY_ENABLED:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            for role, content in (("user", question), ("assistant", answer)):
+                self._push(chat_id, role, content)
+                self._write({"chat_id": chat_id, "role": role, "content": self._clip(content)})
+            metrics.set("history_chats", len(self.chats))
+            self._maybe_compact()
+
+    def clear(self, chat_id):
+        """Забывает историю чата (/clear)"""
+        with self._lock:
+            self._ensure_loaded()
+            if chat_id in self.chats:
+                self._drop(chat_id)
+                self._write({"chat_id": chat_id, "clear": True})
+                self._maybe_compact()
+
+    def close(self):
+        """Дописывает очередь на диск и останавливает поток записи"""
+        with self._lock:
+            if self._writer:
+                self._queue.put(None)
+                self._writer.join()
+                self._writer = None
+                self._queue = None
+            self._loaded = False
+            self.chats.clear()
+            self.chars.clear()
+            self.live = 0
+            self.log_lines = 0
+
+
+history_store = HistoryStore()
@@ -0,0 +1,57 @@
+# http_clients.py - ОБЩИЕ HTTP-КЛИЕНТЫ С ПУЛОМ СОЕДИНЕНИЙ
+#
+# Вместо нового соединения (TCP + TLS) на каждый вызов все модули берут
+# отсюда долгоживущие клиенты с keep-alive:
+#   get_async_client(TELEGRAM), get_async_client(OLLAMA) - httpx.AsyncClient
+# Таймауты подключения и чтения настраиваются отдельно для каждого API.
+
+import asyncio
+import logging
+import httpx
+from config import (
+    HTTP_POOL_SIZE,
+    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT,
+    OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM = "telegram"
+OLLAMA = "ollama"
+
+# (connect, read) по умолчанию для каждого API
+_TIMEOUTS = {
+    TELEGRAM: (TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT),
+    OLLAMA: (OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT),
+}
+
+_async_clients = {}
+
+
+def get_async_timeout(name, read=None):
+    """Таймаут httpx для API; read можно переопределить для вызова"""
+    connect, default_read = _TIMEOUTS[name]
+    return httpx.Timeout(read if read is not None else default_read, connect=connect)
+
+
+def get_async_client(name):
+    """Асинхронный клиент с пулом соединений (один на процесс и event loop)"""
+    key = (name, id(asyncio.get_running_loop()))
+    client = _async_clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=get_async_timeout(name),
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE,
+            ),
+        )
+        _async_clients[key] = client
+    return client
+
+
+async def close_async_clients():
+    """Закрывает асинхронные клиенты текущего event loop"""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _async_clients if k[1] == loop_id]:
+        await _async_clients.pop(key).aclose()
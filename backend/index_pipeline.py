@@ -0,0 +1,204 @@
+# index_pipeline.py - КОНВЕЙЕР ИНДЕКСАЦИИ: ЭМБЕДДИНГИ ПАРАЛЛЕЛЬНО, ЗАПИСЬ ОТДЕЛЬНО
+#
+# Раньше collection.add() считал эмбеддинги внутри ChromaDB и тут же писал,
+# так что во время записи простаивали ядра, а во время расчёта - диск.
+# Теперь:
+#   батчи -> пул процессов (эмбеддинги) -> очередь INDEX_QUEUE_SIZE -> поток записи
+# Воркер загружает модель один раз и работает с INDEX_TORCH_THREADS потоками
+# torch. Запись - один поток, collection.add(embeddings=...) с готовыми
+# векторами. Уже посчитанные векторы берутся из кэша эмбеддингов и в пул не
+# идут. Скорость каждого этапа (документов в секунду) пишется в лог.
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import (
+    EMBEDDING_MODEL, INDEX_WORKERS, INDEX_TORCH_THREADS, INDEX_QUEUE_SIZE,
+)
+from embedding_cache import text_key
+
+logger = logging.getLogger(__name__)
+
+# Модель в процессе-воркере
+_model = None
+
+
+def _init_worker(model_name, threads):
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(model_name)
+
+
+def _embed(texts):
+    """Эмбеддинги батча в воркере -> (векторы, секунды)"""
+    started = time.perf_counter()
+    vectors = _model.encode(list(texts), convert_to_numpy=True)
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - started
+
+
+def resolve_workers(workers=INDEX_WORKERS, threads=INDEX_TORCH_THREADS):
+    """(воркеров, потоков torch на воркер) с учётом числа ядер"""
+    cpus = os.cpu_count() or 1
+    if workers <= 0:
+        workers = max(1, min(4, cpus // 2))
+    if threads <= 0:
+        threads = max(1, cpus // workers)
+    return workers, threads
+
+
+class StageStats:
+    """Документы и занятое время одного этапа"""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = 0
+        self.seconds = 0.0
+
+    def add(self, docs, seconds):
+        self.docs += docs
+        self.seconds += seconds
+
+    @property
+    def rate(self):
+        return self.docs / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        if not self.seconds:
+            return f"{self.name}: {self.docs} док."
+        return f"{self.name}: {self.docs} док. за {self.seconds:.1f} сек ({self.rate:.0f} док/сек)"
+
+
+class EmbeddingPipeline:
+    """Батчи (ids, documents, metadatas) -> эмбеддинги -> write(ids, documents, metadatas, embeddings)
+
+    Батч с documents=None - только метаданные: считать нечего, он идёт
+    прямо в запись (embeddings=None).
+    """
+
+    def __init__(self, workers=0, threads=INDEX_TORCH_THREADS, model_name=EMBEDDING_MODEL,
+                 queue_size=INDEX_QUEUE_SIZE, cache=None, local_embed=None, total=None):
+        """workers=0 - считать в основном процессе функцией local_embed; total - для прогресса"""
+        self.workers = workers
+        self.threads = threads
+        self.model_name = model_name
+        self.queue_size = max(1, queue_size)
+        self.cache = cache
+        self.local_embed = local_embed
+        self.total = total
+        self.cached = StageStats("кэш")
+        self.embedded = StageStats("эмбеддинги")
+        self.written = StageStats("запись")
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._error = None
+
+    def _writer(self, write):
+        batches = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # дочитываем очередь, чтобы основной поток не завис на put
+            ids, documents, metadatas, embeddings = item
+            started = time.perf_counter()
+            try:
+                write(ids, documents, metadatas, embeddings)
+            except BaseException as e:
+                self._error = e
+                continue
+            if documents is None:
+                continue
+            self.written.add(len(ids), time.perf_counter() - started)
+            batches += 1
+            if batches % 10 == 0:
+                logger.info(f"✅ Записано {self.written.docs}" + (f"/{self.total}" if self.total else "") + " документов")
+
+    def _put(self, item):
+        self._queue.put(item)
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self, pool, batch):
+        """Векторы из кэша + задача пулу на недостающие"""
+        ids, documents, metadatas = batch
+        if documents is None:
+            return batch, [], [], [], None
+        keys = [text_key(text) for text in documents]
+        vectors = self.cache.lookup(keys) if self.cache else [None] * len(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.cached.add(len(keys) - len(missing), 0.0)
+        future = pool.submit(_embed, [documents[i] for i in missing]) if missing else None
+        return batch, keys, vectors, missing, future
+
+    def _finish(self, item):
+        (ids, documents, metadatas), keys, vectors, missing, future = item
+        if future is not None:
+            computed, seconds = future.result()
+            self.embedded.add(len(missing), seconds)
+            if self.cache:
+                self.cache.append([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        embeddings = None if documents is None else [vector.tolist() for vector in vectors]
+        self._put((ids, documents, metadatas, embeddings))
+
+    def run(self, batches, write):
+        """Прогоняет все батчи; возвращает, когда всё записано"""
+        started = time.perf_counter()
+        writer = threading.Thread(target=self._writer, args=(write,), name="index-writer", daemon=True)
+        writer.start()
+        try:
+            if self.workers <= 0:
+                for ids, documents, metadatas in batches:
+                    if documents is None:
+                        self._put((ids, None, metadatas, None))
+                        continue
+                    t = time.perf_counter()
+                    embeddings = self.local_embed(documents)
+                    self.embedded.add(len(ids), time.perf_counter() - t)
+                    self._put((ids, documents, metadatas, embeddings))
+            else:
+                pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.threads),
+                )
+                with pool:
+                    # Держим в работе не больше queue_size батчей сверх числа воркеров
+                    pending = deque()
+                    for batch in batches:
+                        pending.append(self._submit(pool, batch))
+                        while len(pending) >= self.workers + self.queue_size:
+                            self._finish(pending.popleft())
+                    while pending:
+                        self._finish(pending.popleft())
+        finally:
+            self._queue.put(None)
+            writer.join()
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - started
+        total = self.written.docs
+        logger.info(
+            f"⏱️ Индексация: {total} док. за {elapsed:.1f} сек ({total / elapsed if elapsed else 0:.0f} док/сек), "
+            f"воркеров: {self.workers or 'в основном процессе'}"
+        )
+        for stage in (self.cached, self.embedded, self.written):
+            if stage.docs:
+                logger.info(f"   {stage}")
+        if self.workers > 1 and self.embedded.seconds:
+            # Время эмбеддингов суммировано по воркерам
+            logger.info(f"   эмбеддинги с учётом параллельности: {self.embedded.rate * self.workers:.0f} док/сек")
+        return elapsed
+
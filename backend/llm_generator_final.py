@@ -1,139 +1,143 @@
-import requests
-import json
+import asyncio
 import logging
 import time
-from config import OLLAMA_API_URL, OLLAMA_MODEL, PROMPT_TEMPLATE_FILE
+from contextlib import aclosing
+import httpx
+from config import LLM_DEADLINE, PROMPT_NUM_PREDICT
+from history_store import history_store
+from ollama_client import ollama
+from retry_policy import RetryPolicy, RetryableError, CircuitOpenError, DeadlineExceeded, ollama_breaker
+from prompt_assembler import prompt_assembler
+from prompt_assets import prompt_assets
+from retriever import retriever
 
 logger = logging.getLogger(__name__)
 
 # НАСТРОЙКИ
-TIMEOUT = 300  # 5 минут (увеличено для больших промптов)
-MAX_RETRIES = 3  # Количество попыток при ошибках
+TIMEOUT = 300  # потолок одной попытки; весь ответ ограничен LLM_DEADLINE
+CHAT_OPTIONS = {
+    "temperature": 0.7,
+    "num_predict": PROMPT_NUM_PREDICT,
+    "top_p": 0.85
+}
+MIN_ANSWER_LENGTH = 6  # короче (после очистки) - не ответ, а обрывок или мусор
+
+llm_retry = RetryPolicy("llm", deadline=LLM_DEADLINE, attempt_timeout=TIMEOUT, breaker=ollama_breaker)
 
 def load_prompt_template():
-    """Загружает prompt_template.json из config"""
-    try:
-        path = PROMPT_TEMPLATE_FILE
-        if not path.exists():
-            logger.error(f"❌ {path} не найден!")
-            return None
-        
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    """Текущий system_prompt из prompt_template.json (кэшируется в памяти)"""
+    asset = prompt_assets.get()
+    return asset.system_prompt if asset else None
+
+async def build_prompt(question, chat_id=None):
+    """messages для /api/chat в пределах бюджета токенов (см. prompt_assembler.py)"""
+    asset = prompt_assets.get()
+    if not asset:
+        return None
+    
+    # Эмбеддинг вопроса считается в потоке, чтобы не блокировать event loop
+    documents = await asyncio.to_thread(retriever.retrieve, question)
+    return await prompt_assembler.assemble(
+        asset.system_prompt,
+        question,
+        history=history_store.messages(chat_id),
+        documents=documents,
+        profile=asset.data.get("user_profile"),
+    )
+
+def chat_options(prompt):
+    """CHAT_OPTIONS + окно контекста (одно на процесс, см. prompt_assembler.py)"""
+    return {**CHAT_OPTIONS, "num_ctx": prompt.num_ctx}
+
+async def generate_answer_simple(question, chat_id=None):
+    """Генерация ответа с повторами в пределах LLM_DEADLINE; None - не получилось"""
+    prompt = await build_prompt(question, chat_id)
+    if not prompt:
+        return None
+    
+    logger.info(f"📤 Отправляю запрос к Ollama...")
+    logger.info(f"   Вопрос: {question[:50]}...")
+    
+    async def attempt(timeout):
+        started = time.perf_counter()
+        # Используем /api/chat для лучшей поддержки диалогов
+        result = await ollama.chat(
+            prompt.messages,
+            options=chat_options(prompt),
+            timeout=timeout
+        )
+        logger.info(f"📥 Получен ответ (LLM {time.perf_counter() - started:.1f} сек)")
         
-        system_prompt = data.get('system_prompt', '').strip()
-        if not system_prompt:
-            logger.error("❌ system_prompt пустой!")
-            return None
+        answer = result.get("message", {}).get("content", "").strip()
+        if not answer:
+            raise RetryableError("пустой ответ от LLM")
         
-        logger.info(f"✅ Загружен промт ({len(system_prompt)} символов)")
-        return system_prompt
+        logger.info(f"✅ Ответ ({len(answer)} символов): {answer[:100]}...")
         
+        # Простая очистка
+        answer = clean_answer(answer)
+        if len(answer) < MIN_ANSWER_LENGTH:
+            raise RetryableError(f"слишком короткий ответ после очистки: {answer!r}")
+        return answer
+    
+    try:
+        return await llm_retry.run(attempt)
+    except CircuitOpenError as e:
+        logger.error(f"⚡ {e}")
+    except DeadlineExceeded as e:
+        logger.error(f"⏱️ {e}")
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ Ошибка HTTP {e.response.status_code}")
+        logger.error(f"Текст ответа: {e.response.text[:200]}")
     except Exception as e:
-        logger.error(f"❌ Ошибка загрузки промта: {e}")
-        return None
+        logger.error(f"❌ Ошибка: {type(e).__name__}: {e}")
+    return None
 
-def generate_answer_simple(question, chat_id=None):
-    """Простая версия генерации ответа"""
-    system_prompt = load_prompt_template()
-    if not system_prompt:
-        return None
+async def stream_answer_simple(question, chat_id=None):
+    """Потоковая генерация: отдаёт очищенный текст ответа по мере прихода токенов.
     
-    # Обрезаем промт если слишком длинный
-    if len(system_prompt) > 2000:
-        system_prompt = system_prompt[:2000]
-        logger.info(f"📝 Обрезан промт до 2000 символов")
+    clean_answer() применяется к накопленному тексту; как только фильтр начал
+    обрезать ответ, дальше он уже не изменится, поэтому генерацию прекращаем
+    (закрытие соединения останавливает её и в Ollama). Текст короче
+    MIN_ANSWER_LENGTH не отдаётся; если весь ответ такой - RetryableError.
+    Ошибки пробрасываются вызывающему.
+    """
+    prompt = await build_prompt(question, chat_id)
+    if not prompt:
+        return
     
-    logger.info(f"📤 Отправляю запрос к Ollama...")
-    logger.info(f"   URL: {OLLAMA_API_URL}/api/chat")
-    logger.info(f"   Вопрос: {question[:50]}...")
+    logger.info(f"📤 Потоковый запрос к Ollama: {question[:50]}...")
     
-    # Используем /api/chat для лучшей поддержки диалогов
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.post(
-                f"{OLLAMA_API_URL}/api/chat",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": question
-                        }
-                    ],
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "num_predict": 300,
-                        "top_p": 0.85
-                    }
-                },
-                timeout=TIMEOUT
-            )
-            
-            logger.info(f"📥 Получен ответ: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                answer = result.get("message", {}).get("content", "").strip()
-                
-                if not answer:
-                    logger.warning("⚠️ Пустой ответ от LLM")
-                    if attempt < MAX_RETRIES - 1:
-                        wait_time = (attempt + 1) * 2
-                        logger.warning(f"🔄 Повторная попытка через {wait_time} сек...")
-                        time.sleep(wait_time)
-                        continue
-                    return None
-                
-                logger.info(f"✅ Ответ ({len(answer)} символов): {answer[:100]}...")
-                
-                # Простая очистка
-                answer = clean_answer(answer)
-                return answer
-                
-            elif response.status_code == 500:
-                wait_time = (attempt + 1) * 3
-                logger.warning(f"⚠️ Ошибка 500 от Ollama (попытка {attempt + 1}/{MAX_RETRIES}). Жду {wait_time} сек...")
-                if attempt < MAX_RETRIES - 1:
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    logger.error(f"❌ Ошибка HTTP 500 после всех попыток")
-                    return None
-            else:
-                logger.error(f"❌ Ошибка HTTP {response.status_code}")
-                logger.error(f"Текст ответа: {response.text[:200]}")
-                return None
-                
-        except requests.exceptions.Timeout:
-            wait_time = (attempt + 1) * 5
-            logger.warning(f"⏱️ Таймаут при вызове Ollama (попытка {attempt + 1}/{MAX_RETRIES}). Жду {wait_time} сек...")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(wait_time)
-                continue
-            else:
-                logger.error(f"❌ Таймаут ({TIMEOUT} секунд) после всех попыток")
-                return None
+    # Повторять поток после показанного текста нельзя, но предохранитель общий:
+    # пока Ollama лежит, сразу падаем в запасной путь вызывающего
+    ollama_breaker.check()
+    raw = ""
+    answer = ""
+    stream = ollama.chat_stream(
+        prompt.messages,
+        options=chat_options(prompt),
+        timeout=min(TIMEOUT, LLM_DEADLINE)
+    )
+    try:
+        async with aclosing(stream):
+            async for chunk in stream:
+                raw += chunk.get("message", {}).get("content", "")
+                answer = clean_answer(raw)
+                if len(answer) >= MIN_ANSWER_LENGTH:
+                    yield answer
                 
-        except requests.exceptions.ConnectionError:
-            logger.error("❌ Не могу подключиться к Ollama")
-            return None
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка: {e}")
-            if attempt < MAX_RETRIES - 1:
-                wait_time = (attempt + 1) * 2
-                logger.warning(f"🔄 Повторная попытка через {wait_time} сек...")
-                time.sleep(wait_time)
-                continue
-            return None
+                if answer and len(answer) < len(raw.strip()):
+                    logger.info("✂️ Фильтр обрезал ответ - останавливаю генерацию")
+                    break
+    except Exception as e:
+        ollama_breaker.record(e)
+        raise
+    ollama_breaker.record()
     
-    return None
+    if len(answer) < MIN_ANSWER_LENGTH:
+        # Ничего не показано - вызывающий уйдёт на обычный путь с повторами
+        raise RetryableError(f"слишком короткий потоковый ответ после очистки: {answer!r}")
+    logger.info(f"✅ Потоковый ответ ({len(raw)} символов)")
 
 def clean_answer(answer):
     """Очистка ответа"""
@@ -183,30 +187,38 @@ def clean_answer(answer):
     
     return answer
 
-def get_answer(question, chat_id=None):
+async def get_answer(question, chat_id=None):
     """Главная функция для бота"""
     logger.info(f"\n{'='*60}")
     logger.info(f"👤 Вопрос: {question}")
     logger.info(f"{'='*60}")
     
-    # Попробуем 2 раза
-    for attempt in range(2):
-        logger.info(f"🔄 Попытка {attempt + 1}/2")
-        
-        answer = generate_answer_simple(question, chat_id)
-        
-        if answer and len(answer) > 5:
-            logger.info(f"✅ Успех! Ответ: {answer[:80]}...")
-            return answer
-        
-        logger.warning(f"⚠️ Попытка {attempt + 1} не удалась")
+    answer = await generate_answer_simple(question, chat_id)
+    if answer:
+        logger.info(f"✅ Успех! Ответ: {answer[:80]}...")
+        return answer
     
-    logger.error("❌ Не удалось получить ответ после 2 попыток")
+    logger.error("❌ Не удалось получить ответ")
     return "Хм, не знаю что ответить..."
 
 def clear_history(chat_id):
-    """Заглушка для очистки истории"""
-    pass
+    """Очистка истории диалога чата"""
+    history_store.clear(chat_id)
+
+class AnswerGenerator:
+    """Состояние генератора в одном объекте (используется diagnostic.py)"""
+    
+    clean_answer = staticmethod(clean_answer)
+    
+    @property
+    def collection(self):
+        return retriever.collection
+    
+    @property
+    def prompt_template(self):
+        return load_prompt_template()
+
+generator = AnswerGenerator()
 
 # Тест
 if __name__ == "__main__":
@@ -214,7 +226,7 @@ if __name__ == "__main__":
     print("🔧 Тест генератора ответов...")
     
     test_question = "Привет! Как дела?"
-    answer = get_answer(test_question)
+    answer = asyncio.run(get_answer(test_question))
     
     print(f"\n📝 Вопрос: {test_question}")
     print(f"💬 Ответ: {answer}")
\ No newline at end of file
@@ -0,0 +1,158 @@
+# llm_scheduler.py - ОЧЕРЕДЬ ЗАПРОСОВ К LLM ПО ПРИОРИТЕТАМ
+#
+# Классы запросов (меньше - важнее):
+#   INTERACTIVE - ответ пользователю в чате
+#   BACKGROUND  - извлечение фактов, пересборка базы
+#   WARMUP      - прогрев модели
+# Освободившийся слот сервера достаётся первому ожидающему старшего класса.
+# Фоновые классы занимают не больше LLM_BACKGROUND_SHARE слотов сервера,
+# остальные всегда свободны для чата. Начатый запрос не прерывается -
+# вытеснение происходит на границе запросов.
+#
+# Пересборка базы идёт в отдельном процессе, поэтому бот ещё и оставляет
+# отметку в LLM_ACTIVITY_FILE: пока она свежая, фоновая задача не начинает
+# новый запрос (но ждёт не дольше LLM_BACKGROUND_MAX_DEFER). Отметка
+# проверяется и в момент выдачи слота - перед каждым фоновым запросом.
+# Доля фоновых слотов соблюдается для всех процессов вместе: каждый фоновый
+# запрос держит flock на одном из файлов-слотов рядом с отметкой.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+from config import (
+    LLM_BACKGROUND_SHARE, LLM_INTERACTIVE_GRACE, LLM_BACKGROUND_MAX_DEFER, LLM_ACTIVITY_FILE,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: доля соблюдается только внутри процесса
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BACKGROUND, WARMUP = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", WARMUP: "warmup"}
+
+
+def split_slots(total, parts, part):
+    """Доля part из parts в бюджете total: доли всех частей в сумме дают ровно total"""
+    return total // parts + (1 if part < total % parts else 0)
+
+
+def background_limit(max_inflight, share=LLM_BACKGROUND_SHARE):
+    """Сколько слотов сервера могут занять фоновые запросы"""
+    return max(1, int(max_inflight * share))
+
+
+class ActivityBeacon:
+    """Отметка "бот отвечает в чате" - mtime файла, видна всем процессам"""
+
+    def __init__(self, path=LLM_ACTIVITY_FILE, grace=LLM_INTERACTIVE_GRACE):
+        self.path = path
+        self.grace = grace
+        self._touched = 0.0
+
+    def touch(self):
+        now = time.time()
+        if now - self._touched < 1:
+            return
+        self._touched = now
+        try:
+            self.path.touch()
+        except OSError as e:
+            logger.debug(f"Не удалось обновить {self.path}: {e}")
+
+    def busy(self):
+        try:
+            return time.time() - self.path.stat().st_mtime < self.grace
+        except OSError:
+            return False
+
+    async def wait_idle(self, max_wait=LLM_BACKGROUND_MAX_DEFER, poll=0.5):
+        """Ждёт, пока чат затихнет -> сколько секунд ждали"""
+        started = time.monotonic()
+        while self.busy() and time.monotonic() - started < max_wait:
+            await asyncio.sleep(poll)
+        return time.monotonic() - started
+
+
+class BackgroundSlots:
+    """Фоновые слоты сервера, общие для всех процессов.
+
+    Слот - файл <сервер>.<n>.lock рядом с отметкой активности, занятый
+    flock; при падении процесса замок снимает ОС.
+    """
+
+    def __init__(self, directory=LLM_ACTIVITY_FILE.parent, share=LLM_BACKGROUND_SHARE):
+        self.directory = directory
+        self.share = share
+
+    def acquire(self, url, max_inflight):
+        """Занимает свободный слот -> дескриптор (None - все заняты)"""
+        if fcntl is None:
+            return True
+        slug = re.sub(r"[^\w.-]+", "_", url)
+        for n in range(background_limit(max_inflight, self.share)):
+            try:
+                f = open(self.directory / f"llm_background.{slug}.{n}.lock", "a")
+            except OSError as e:
+                logger.debug(f"Не удалось открыть файл фонового слота: {e}")
+                return True
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                f.close()
+        return None
+
+    @staticmethod
+    def release(handle):
+        if handle is not True:
+            handle.close()
+
+
+class WaitQueue:
+    """Ожидающие слота запросы: сначала старший класс, внутри класса - по порядку"""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return sum(1 for *_, future in self._heap if not future.done())
+
+    def push(self, priority, model, backend=None):
+        """backend - нужен слот именно этого сервера (прогрев)"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), model, backend, future))
+        return future
+
+    def dispatch(self, grant):
+        """Раздаёт слоты по очереди; grant(model, priority, backend) -> занятый сервер или None"""
+        skipped = []
+        while self._heap:
+            priority, _, model, pinned, future = self._heap[0]
+            if future.done():  # ожидание отменено
+                heapq.heappop(self._heap)
+                continue
+            backend = grant(model, priority, pinned)
+            if backend is None:
+                if pinned is None:
+                    # Младшим классам слотов тем более не хватит
+                    break
+                # Занят только свой сервер - остальные могут пройти
+                skipped.append(heapq.heappop(self._heap))
+                continue
+            heapq.heappop(self._heap)
+            future.set_result(backend)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+
+    def fail_all(self, exc):
+        while self._heap:
+            *_, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_exception(exc)
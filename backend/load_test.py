@@ -0,0 +1,121 @@
+# load_test.py - НАГРУЗОЧНЫЙ ТЕСТ БОТА НА ПОДДЕЛЬНОМ BOT API
+#
+# 1. python load_test.py --rate 5 --duration 60 --chats 50
+# 2. В другом терминале: TELEGRAM_API_BASE=http://127.0.0.1:8081 python 3_telegram_bot.py
+#
+# Тест подаёт обновления с заданной частотой (синтетические или из
+# записанного файла), ждёт ответов и печатает перцентили задержки и
+# пропускную способность. Задержка - от подачи обновления до первого
+# sendMessage в этот чат (при потоковых ответах - до плейсхолдера).
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from pathlib import Path
+from fake_telegram_api import FakeTelegramAPI, serve
+
+logger = logging.getLogger(__name__)
+
+SYNTHETIC_TEXTS = [
+    "привет",
+    "как дела?",
+    "что делаешь",
+    "чем занимаешься на выходных?",
+    "какую музыку слушаешь",
+    "во что играешь сейчас?",
+    "расскажи о себе",
+    "ахах",
+]
+
+
+def load_replay(path):
+    """Читает записанные обновления (JSON-список или JSONL) -> [(chat_id, text)]"""
+    raw = Path(path).read_text(encoding="utf-8").strip()
+    if raw.startswith("["):
+        updates = json.loads(raw)
+    else:
+        updates = [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    events = []
+    for update in updates:
+        msg = update.get("message", {})
+        chat_id = msg.get("chat", {}).get("id")
+        text = msg.get("text")
+        if chat_id and text:
+            events.append((chat_id, text))
+    return events
+
+
+def synthetic_events(count, chats):
+    return [(random.randint(1, chats), random.choice(SYNTHETIC_TEXTS)) for _ in range(count)]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(args):
+    api = FakeTelegramAPI(args.error_rate, args.retry_after, args.latency)
+    server, server_task = await serve(api, port=args.port)
+
+    if args.replay:
+        events = load_replay(args.replay)
+    else:
+        events = synthetic_events(int(args.rate * args.duration), args.chats)
+
+    logger.info(f"🚀 Подаю {len(events)} обновлений с частотой {args.rate}/сек")
+    started = time.monotonic()
+    for i, (chat_id, text) in enumerate(events):
+        # Пуассоновский поток со средней частотой rate
+        await asyncio.sleep(random.expovariate(args.rate))
+        api.inject(chat_id, text)
+        if (i + 1) % 100 == 0:
+            logger.info(f"   подано {i + 1}/{len(events)}, отвечено {len(api.latencies)}")
+    injected_for = time.monotonic() - started
+
+    logger.info(f"⏳ Жду ответы до {args.drain} сек...")
+    deadline = time.monotonic() + args.drain
+    while any(api.pending.values()) and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    elapsed = time.monotonic() - started
+
+    server.should_exit = True
+    await server_task
+
+    latencies = api.latencies
+    unanswered = sum(len(v) for v in api.pending.values())
+    print("\n" + "=" * 60)
+    print("📊 РЕЗУЛЬТАТЫ НАГРУЗОЧНОГО ТЕСТА")
+    print("=" * 60)
+    print(f"Подано обновлений:   {len(events)} за {injected_for:.1f} сек")
+    print(f"Получили ответ:      {len(latencies)}")
+    print(f"Без ответа:          {unanswered}")
+    print(f"Пропускная способн.: {len(latencies) / elapsed:.2f} ответов/сек")
+    print(f"Задержка p50:        {percentile(latencies, 50):.2f} сек")
+    print(f"Задержка p90:        {percentile(latencies, 90):.2f} сек")
+    print(f"Задержка p99:        {percentile(latencies, 99):.2f} сек")
+    print(f"Задержка max:        {max(latencies, default=0):.2f} сек")
+    print(f"Вызовы API:          {json.dumps(api.calls, ensure_ascii=False)}")
+    print(f"Выдано 429:          {api.injected_429}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=2.0, help="обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность подачи, сек")
+    parser.add_argument("--chats", type=int, default=20, help="число синтетических чатов")
+    parser.add_argument("--replay", help="файл с записанными обновлениями (JSON или JSONL)")
+    parser.add_argument("--drain", type=float, default=120.0, help="сколько ждать ответов после подачи")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля вызовов с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="средняя задержка Bot API, сек")
+    asyncio.run(run_load(parser.parse_args()))
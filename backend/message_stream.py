@@ -0,0 +1,152 @@
+# message_stream.py - ПОТОКОВОЕ ЧТЕНИЕ И ЗАПИСЬ БОЛЬШИХ JSON
+#
+# Выгрузка переписки за несколько лет не должна целиком оказываться в
+# памяти. iter_messages() отдаёт сообщения по одному из файла любого вида:
+#   [msg, msg, ...]                    - список
+#   {"чат": [msg, ...], ...}           - словарь списков (ключи отбрасываются)
+#   msg\nmsg\n...  (*.jsonl)           - по сообщению в строке
+# Файл читается кусками по CHUNK_SIZE, элементы разбираются
+# json.JSONDecoder.raw_decode, так что в памяти держится только текущий
+# кусок. JsonArrayWriter - обратная операция: пишет JSON-массив по элементу.
+
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20  # 1 МБ текста за одно чтение
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_SCALAR_END = re.compile(r"[,\]}\s]")
+
+
+class _Reader:
+    """Буфер над файлом: подчитывает данные, пока их не хватит на один JSON-элемент"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Следующий непробельный символ ("" - конец файла)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"ожидался {char!r}, встретился {self.peek()!r}")
+        self.pos += 1
+
+    def value(self):
+        """Очередное JSON-значение целиком"""
+        if self.peek() not in '[{"':
+            # Число/литерал на границе куска прочиталось бы не полностью - дочитываем до разделителя
+            while not _SCALAR_END.search(self.buffer, self.pos) and self._fill():
+                pass
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Элемент не влез в буфер - дочитываем; в конце файла это ошибка
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Элементы массива, на начале которого стоит буфер"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"ожидалась ',' или ']', встретился {char!r}")
+
+
+def iter_messages(path):
+    """Сообщения из файла по одному (список, словарь списков или JSONL)"""
+    with open(path, "r", encoding="utf-8") as f:
+        if str(path).endswith(".jsonl"):
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"⚠️ {path}:{line_no}: битая строка пропущена ({e})")
+            return
+
+        reader = _Reader(f)
+        first = reader.peek()
+        if first == "[":
+            yield from reader.items()
+        elif first == "{":
+            reader.expect("{")
+            if reader.peek() == "}":
+                return
+            while True:
+                reader.value()  # имя чата
+                reader.expect(":")
+                if reader.peek() == "[":
+                    yield from reader.items()
+                else:
+                    reader.value()  # не список сообщений - пропускаем
+                char = reader.peek()
+                reader.pos += 1
+                if char == "}":
+                    return
+                if char != ",":
+                    raise ValueError(f"ожидалась ',' или '}}', встретился {char!r}")
+        elif first:
+            raise ValueError(f"{path}: ожидался список или словарь, встретился {first!r}")
+
+
+class JsonArrayWriter:
+    """Пишет JSON-массив по одному элементу (with JsonArrayWriter(path) as w: w.write(x))"""
+
+    def __init__(self, path, indent=2):
+        self.path = path
+        self.indent = indent
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, "w", encoding="utf-8")
+        self._f.write("[")
+        return self
+
+    def write(self, item):
+        text = json.dumps(item, ensure_ascii=False, indent=self.indent)
+        pad = " " * (self.indent or 0)
+        self._f.write(("," if self.count else "") + "\n" + pad + text.replace("\n", "\n" + pad))
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self._f.write("\n]\n" if self.count else "]\n")
+        self._f.close()
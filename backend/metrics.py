@@ -0,0 +1,95 @@
+# metrics.py - ПРОСТЫЕ МЕТРИКИ ПРОЦЕССА (счётчики и gauge)
+#
+# Модули пишут в общий реестр metrics, бот периодически логирует снимок,
+# а webhook-сервер отдаёт его на GET /metrics в текстовом формате Prometheus.
+# В многопроцессном режиме шарды присылают свои снимки в основной процесс
+# (merge): счётчики складываются, gauge выводятся с меткой shard.
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Потокобезопасный реестр счётчиков и gauge"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._shards = {}    # шард -> (счётчики, gauge) из последнего снимка
+        self._retired = {}   # счётчики перезапущенных шардов, чтобы суммы не убывали
+
+    def inc(self, name, value=1):
+        """Увеличивает счётчик"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """Устанавливает текущее значение gauge"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def export(self):
+        """(счётчики, gauge) этого процесса - шард отправляет их в основной"""
+        with self._lock:
+            return dict(self._counters), dict(self._gauges)
+
+    def merge(self, shard, counters, gauges):
+        """Запоминает последний снимок процесса-шарда"""
+        with self._lock:
+            self._shards[shard] = (counters, gauges)
+
+    def retire(self, shard):
+        """Шард перезапущен: его счётчики остаются в суммах, gauge убираются"""
+        with self._lock:
+            counters, _ = self._shards.pop(shard, ({}, {}))
+            for name, value in counters.items():
+                self._retired[name] = self._retired.get(name, 0) + value
+
+    def _combined(self):
+        """Счётчики - суммы по процессам; gauge - {(имя, метка): значение}"""
+        counters = dict(self._counters)
+        gauges = {(name, ""): value for name, value in self._gauges.items()}
+        for source in [self._retired] + [c for c, _ in self._shards.values()]:
+            for name, value in source.items():
+                counters[name] = counters.get(name, 0) + value
+        for shard, (_, shard_gauges) in self._shards.items():
+            for name, value in shard_gauges.items():
+                gauges[(name, f'shard="{shard}"')] = value
+        return counters, gauges
+
+    def snapshot(self):
+        """Копия всех значений: {имя: значение}"""
+        with self._lock:
+            counters, gauges = self._combined()
+        values = dict(counters)
+        for (name, label), value in gauges.items():
+            values[f"{name}{{{label}}}" if label else name] = value
+        return values
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        with self._lock:
+            counters, gauges = self._combined()
+        lines = []
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        typed = set()
+        for (name, label), value in sorted(gauges.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def log_snapshot(self):
+        """Пишет снимок метрик в лог одной строкой"""
+        values = self.snapshot()
+        if values:
+            logger.info("📈 " + ", ".join(f"{k}={v}" for k, v in sorted(values.items())))
+
+
+metrics = Metrics()
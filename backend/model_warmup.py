@@ -0,0 +1,133 @@
+# model_warmup.py - ПРОГРЕВ МОДЕЛИ И УДЕРЖАНИЕ В ПАМЯТИ
+#
+# Первый вопрос после старта (или после того, как Ollama выгрузила модель
+# по keep_alive) платит за загрузку модели целиком. Поэтому на каждом
+# сервере пула:
+#   1. модель загружается пустым запросом /api/generate с тем же num_ctx,
+#      что у обычных запросов (другой num_ctx - повторная загрузка),
+#   2. промпт той же структуры, что у ответа (build_prompt: system prompt,
+#      факты, блок найденных сообщений), прогоняется через /api/chat с
+#      num_predict=1. Ollama держит его префикс в кэше, и следующие запросы
+#      не считают заново system prompt, факты и заголовок блока примеров -
+#      сами найденные сообщения у каждого вопроса свои.
+# Дальше раз в WARMUP_CHECK_INTERVAL сек сервер прогревается снова, если
+# /api/ps показал, что модель выгружена, сервер вернулся в ротацию или
+# поменялся промт. Запросы прогрева идут с низшим приоритетом (WARMUP).
+
+import asyncio
+import logging
+import time
+from config import PROMPT_MAX_CTX, WARMUP_CHECK_INTERVAL, WARMUP_TIMEOUT
+from llm_generator_final import chat_options
+from llm_scheduler import WARMUP
+from metrics import metrics
+from ollama_client import ollama
+from prompt_assembler import prompt_assembler
+from prompt_assets import prompt_assets
+
+logger = logging.getLogger(__name__)
+
+# Вопрос и "найденное сообщение" для прогона префикса (ответ не нужен)
+WARMUP_QUESTION = "Привет"
+WARMUP_DOCUMENT = "..."
+
+
+class ModelWarmup:
+    """Следит, чтобы модель была загружена и прогрета на всех серверах"""
+
+    def __init__(self, client=ollama, interval=WARMUP_CHECK_INTERVAL):
+        self.client = client
+        self.interval = interval
+        self.warmed = {}        # url -> версия промта, с которой прогрет сервер
+        self.was_healthy = {}   # url -> состояние на прошлой проверке
+        self.cold_start = None  # длительность первого прогрева, сек
+
+    def _reason(self, backend, version):
+        """Почему сервер надо прогреть (None - не надо)"""
+        healthy_before = self.was_healthy.get(backend.url, True)
+        self.was_healthy[backend.url] = backend.healthy
+        if not backend.healthy:
+            return None
+        if backend.url not in self.warmed:
+            return "старт"
+        if not healthy_before:
+            return "сервер вернулся в ротацию"
+        if self.client.model not in backend.loaded:
+            return "модель выгружена"
+        if self.warmed[backend.url] != version:
+            return "новый промт"
+        return None
+
+    async def _warm(self, backend, prompt):
+        """Загрузка модели и prefill -> (загрузка, prefill) в секундах"""
+        # Пустой prompt только загружает модель и продлевает keep_alive
+        loaded = await self.client.generate(
+            "", options={"num_ctx": PROMPT_MAX_CTX}, timeout=WARMUP_TIMEOUT, priority=WARMUP, backend=backend,
+        )
+        load = loaded.get("load_duration", 0) / 1e9
+        if not prompt:
+            return load, 0.0
+        started = time.perf_counter()
+        await self.client.chat(
+            prompt.messages,
+            options={**chat_options(prompt), "num_predict": 1},
+            timeout=WARMUP_TIMEOUT,
+            priority=WARMUP,
+            backend=backend,
+        )
+        return load, time.perf_counter() - started
+
+    async def warm(self, backend, reason):
+        """Прогревает один сервер; False - не получилось (повторим на следующей проверке)"""
+        asset = prompt_assets.get()
+        started = time.perf_counter()
+        try:
+            prompt = None
+            if asset:
+                prompt = await prompt_assembler.assemble(
+                    asset.system_prompt,
+                    WARMUP_QUESTION,
+                    documents=[WARMUP_DOCUMENT],
+                    profile=asset.data.get("user_profile"),
+                )
+            load, prefill = await asyncio.wait_for(self._warm(backend, prompt), WARMUP_TIMEOUT)
+        except Exception as e:
+            metrics.inc("ollama_warmup_errors_total")
+            logger.warning(f"⚠️ Прогрев {backend.url} не удался: {type(e).__name__}: {e}")
+            return False
+
+        total = time.perf_counter() - started
+        self.warmed[backend.url] = asset.version if asset else None
+        metrics.inc("ollama_warmups_total")
+        metrics.set(f"ollama_backend{backend.index}_warmup_ms", round(total * 1000))
+        # В кэше остаётся общий для всех вопросов префикс: system prompt и факты
+        prefix = prompt.tokens["system"] + prompt.tokens["facts"] if prompt else 0
+        metrics.set(f"ollama_backend{backend.index}_warm_prefix_tokens", prefix)
+        logger.info(
+            f"🔥 {backend.url}: модель прогрета ({reason}) за {total:.1f} сек - "
+            f"загрузка {load:.1f} сек, prefill {prefill:.1f} сек (общий префикс ~{prefix} токенов)"
+        )
+        return True
+
+    async def check(self):
+        """Прогревает все серверы, которым это нужно -> сколько прогрето"""
+        version = prompt_assets.version
+        pending = [(b, reason) for b in self.client.router.backends if (reason := self._reason(b, version))]
+        results = await asyncio.gather(*(self.warm(b, reason) for b, reason in pending))
+        return sum(results)
+
+    async def run(self):
+        """Прогрев при старте (с замером холодного старта), затем периодическая проверка"""
+        started = time.perf_counter()
+        # Свежие /api/ps: уже загруженную модель не грузим заново
+        await self.client.router.check_health()
+        if await self.check():
+            self.cold_start = time.perf_counter() - started
+            metrics.set("ollama_cold_start_ms", round(self.cold_start * 1000))
+            logger.info(f"🔥 Холодный старт модели {self.client.model}: {self.cold_start:.1f} сек")
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+
+model_warmup = ModelWarmup()
@@ -0,0 +1,195 @@
+# ollama_client.py - АСИНХРОННЫЙ КЛИЕНТ OLLAMA С ОГРАНИЧЕНИЕМ ПАРАЛЛЕЛЬНОСТИ
+#
+# Все обращения к Ollama (бот, извлечение фактов) идут через этот модуль:
+#   await ollama.chat(messages)                 -> ответ /api/chat
+#   async for chunk in ollama.chat_stream(...)  -> NDJSON-чанки по мере генерации
+#   await ollama.generate(prompt) / embeddings(text) / tags() / tokenize(text)
+# Одновременно на сервер уходит не больше его лимита запросов (по умолчанию
+# OLLAMA_NUM_PARALLEL): сервер всё равно обрабатывает столько же, а лишние
+# запросы ждут здесь, а не в его очереди с риском таймаута. Масштабирование -
+# поднять OLLAMA_NUM_PARALLEL или добавить сервер в OLLAMA_BACKENDS
+# (см. ollama_router.py). Фоновые задачи передают priority=BACKGROUND и
+# пропускают ответы в чате вперёд (см. llm_scheduler.py). В каждый запрос
+# генерации добавляется keep_alive (OLLAMA_KEEP_ALIVE), чтобы модель не
+# выгружалась между сообщениями; прогрев - model_warmup.py.
+
+import json
+import logging
+import time
+from config import OLLAMA_MODEL, OLLAMA_KEEP_ALIVE
+from http_clients import OLLAMA, get_async_client, get_async_timeout
+from llm_scheduler import INTERACTIVE, PRIORITY_NAMES
+from metrics import metrics
+from ollama_router import OllamaRouter
+
+logger = logging.getLogger(__name__)
+
+# load_duration длиннее этого (сек) - запрос застал модель выгруженной
+COLD_LOAD_THRESHOLD = 1.0
+
+
+class OllamaError(Exception):
+    """Ollama вернула {"error": ...} вместо ответа"""
+
+
+class OllamaClient:
+    """Тонкая обёртка над HTTP API Ollama; сервер и слот выдаёт OllamaRouter"""
+
+    def __init__(self, router=None, model=OLLAMA_MODEL, keep_alive=OLLAMA_KEEP_ALIVE):
+        self.router = router or OllamaRouter()
+        self.model = model
+        self.keep_alive = keep_alive
+        self.inflight = 0
+
+    async def _acquire(self, path, model, priority, backend=None):
+        started = time.perf_counter()
+        backend = await self.router.acquire(model, priority, backend)
+        waited_ms = (time.perf_counter() - started) * 1000
+        self.inflight += 1
+        metrics.inc("ollama_requests_total")
+        metrics.inc("ollama_slot_wait_ms_total", round(waited_ms))
+        metrics.inc(f"ollama_slot_wait_ms_{PRIORITY_NAMES[priority]}_total", round(waited_ms))
+        metrics.set("ollama_inflight", self.inflight)
+        if waited_ms > 1000:
+            logger.info(f"⏳ {path}: ждал свободного слота Ollama {waited_ms / 1000:.1f} сек")
+        logger.debug(f"➡️ {path} -> {backend.url}")
+        return backend
+
+    async def _release(self, backend, exc, model, priority):
+        self.inflight -= 1
+        metrics.set("ollama_inflight", self.inflight)
+        await self.router.release(backend, exc, model, priority)
+
+    @staticmethod
+    def _check(data):
+        if isinstance(data, dict) and data.get("error"):
+            raise OllamaError(data["error"])
+        return data
+
+    @staticmethod
+    def _observe(backend, data):
+        """Замечает холодную загрузку модели по load_duration (наносекунды)"""
+        load = data.get("load_duration", 0) / 1e9 if isinstance(data, dict) else 0
+        if load >= COLD_LOAD_THRESHOLD:
+            metrics.inc("ollama_cold_loads_total")
+            logger.info(f"🧊 {backend.url}: модель загружалась {load:.1f} сек")
+
+    async def _request(self, method, path, payload=None, timeout=None, limited=True,
+                       priority=INTERACTIVE, backend=None):
+        # Лёгкие служебные запросы (tokenize, tags) не ждут слота генерации
+        model = (payload or {}).get("model")
+        backend = await self._acquire(path, model, priority, backend) if limited else self.router.pick()
+        error = None
+        try:
+            response = await get_async_client(OLLAMA).request(
+                method,
+                f"{backend.url}{path}",
+                json=payload,
+                timeout=get_async_timeout(OLLAMA, read=timeout),
+            )
+            response.raise_for_status()
+            data = self._check(response.json())
+            self._observe(backend, data)
+            return data
+        except BaseException as e:
+            error = e
+            if isinstance(e, Exception):
+                metrics.inc("ollama_errors_total")
+            raise
+        finally:
+            if limited:
+                await self._release(backend, error, model, priority)
+
+    async def _stream(self, path, payload, timeout=None, priority=INTERACTIVE, backend=None):
+        """NDJSON-поток; слот занят, пока поток читается.
+
+        Если вызывающий прекратил чтение раньше, соединение закрывается -
+        Ollama при этом останавливает генерацию.
+        """
+        model = payload.get("model")
+        backend = await self._acquire(path, model, priority, backend)
+        error = None
+        try:
+            async with get_async_client(OLLAMA).stream(
+                "POST",
+                f"{backend.url}{path}",
+                json=payload,
+                timeout=get_async_timeout(OLLAMA, read=timeout),
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = self._check(json.loads(line))
+                    if chunk.get("done"):
+                        self._observe(backend, chunk)
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+        except Exception as e:
+            error = e
+            metrics.inc("ollama_errors_total")
+            raise
+        finally:
+            await self._release(backend, error, model, priority)
+
+    def _payload(self, model, stream, options, extra):
+        payload = {"model": model or self.model, "stream": stream}
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+        return payload
+
+    async def chat(self, messages, model=None, options=None, timeout=None,
+                   priority=INTERACTIVE, backend=None, **extra):
+        """POST /api/chat без потока -> полный ответ (message.content)"""
+        payload = self._payload(model, False, options, extra)
+        payload["messages"] = messages
+        return await self._request("POST", "/api/chat", payload, timeout, priority=priority, backend=backend)
+
+    def chat_stream(self, messages, model=None, options=None, timeout=None,
+                    priority=INTERACTIVE, backend=None, **extra):
+        """POST /api/chat с потоком -> асинхронный итератор чанков"""
+        payload = self._payload(model, True, options, extra)
+        payload["messages"] = messages
+        return self._stream("/api/chat", payload, timeout, priority, backend)
+
+    async def generate(self, prompt, model=None, options=None, timeout=None,
+                       priority=INTERACTIVE, backend=None, **extra):
+        """POST /api/generate без потока -> полный ответ (response)"""
+        payload = self._payload(model, False, options, extra)
+        payload["prompt"] = prompt
+        return await self._request("POST", "/api/generate", payload, timeout, priority=priority, backend=backend)
+
+    def generate_stream(self, prompt, model=None, options=None, timeout=None,
+                        priority=INTERACTIVE, backend=None, **extra):
+        """POST /api/generate с потоком -> асинхронный итератор чанков"""
+        payload = self._payload(model, True, options, extra)
+        payload["prompt"] = prompt
+        return self._stream("/api/generate", payload, timeout, priority, backend)
+
+    async def embeddings(self, prompt, model=None, timeout=None, priority=INTERACTIVE):
+        """POST /api/embeddings -> вектор"""
+        payload = {"model": model or self.model, "prompt": prompt}
+        data = await self._request("POST", "/api/embeddings", payload, timeout, priority=priority)
+        return data.get("embedding", [])
+
+    async def tags(self, timeout=None):
+        """GET /api/tags -> список установленных моделей"""
+        data = await self._request("GET", "/api/tags", timeout=timeout, limited=False)
+        return data.get("models", [])
+
+    async def close(self):
+        """Останавливает фоновые проверки серверов в текущем event loop"""
+        await self.router.close()
+
+    async def tokenize(self, text, model=None, timeout=None):
+        """POST /api/tokenize -> список токенов (есть не во всех версиях Ollama)"""
+        payload = {"model": model or self.model, "content": text}
+        data = await self._request("POST", "/api/tokenize", payload, timeout, limited=False)
+        return data.get("tokens", [])
+
+
+ollama = OllamaClient()
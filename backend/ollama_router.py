@@ -0,0 +1,289 @@
+# ollama_router.py - ПУЛ СЕРВЕРОВ OLLAMA С БАЛАНСИРОВКОЙ
+#
+# Серверы задаются в OLLAMA_BACKENDS (по умолчанию - один OLLAMA_API_URL).
+# У каждого свой лимит одновременных запросов. Запрос получает сервер, где:
+#   1. модель уже загружена в память (не платим за загрузку),
+#   2. меньше всего запросов в работе относительно лимита.
+# Если свободных слотов нет, запрос ждёт первый освободившийся.
+# Сервер, ответивший OLLAMA_UNHEALTHY_AFTER ошибками подряд, выводится из
+# ротации: новые запросы на него не идут, начатые доделываются. Фоновая
+# проверка раз в OLLAMA_HEALTH_INTERVAL опрашивает /api/tags и /api/ps и
+# возвращает сервер, как только он снова отвечает.
+# Порядок выдачи слотов ожидающим - по классам приоритета (llm_scheduler.py).
+# Фоновый запрос занимает ещё и общий для процессов фоновый слот сервера и
+# перед отправкой заново сверяется с отметкой активности чата.
+
+import asyncio
+import logging
+import random
+import time
+import httpx
+from config import (
+    OLLAMA_API_URL, OLLAMA_NUM_PARALLEL, OLLAMA_BACKENDS,
+    OLLAMA_HEALTH_INTERVAL, OLLAMA_UNHEALTHY_AFTER, LLM_BACKGROUND_MAX_DEFER,
+)
+from http_clients import OLLAMA, get_async_client, get_async_timeout
+from llm_scheduler import INTERACTIVE, ActivityBeacon, BackgroundSlots, WaitQueue, background_limit, split_slots
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Таймаут чтения для проверок здоровья, сек
+HEALTH_TIMEOUT = 5
+# Как часто ожидающий фоновый запрос перепроверяет слоты других процессов, сек
+BACKGROUND_POLL = 0.5
+
+
+class NoHealthyBackend(httpx.TransportError):
+    """Все серверы Ollama выведены из ротации"""
+
+
+def parse_backends(spec=OLLAMA_BACKENDS, default_url=OLLAMA_API_URL, default_limit=OLLAMA_NUM_PARALLEL):
+    """"url|limit,url" -> [(url, limit)]"""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, limit = item.partition("|")
+        backends.append((url.strip().rstrip("/"), int(limit) if limit else default_limit))
+    return backends or [(default_url.rstrip("/"), default_limit)]
+
+
+def is_backend_failure(exc):
+    """Ошибка сервера или сети (а не наша: 4xx, отмена)"""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return False
+
+
+class Backend:
+    """Один сервер Ollama и его текущее состояние"""
+
+    def __init__(self, index, url, max_inflight):
+        self.index = index
+        self.url = url
+        self.base_limit = max(1, max_inflight)
+        self.max_inflight = self.base_limit
+        self.inflight = 0
+        self.background = 0   # из них фоновых (BACKGROUND, WARMUP)
+        self.slot_handles = []  # занятые этим процессом общие фоновые слоты
+        self.healthy = True
+        self.failures = 0
+        self.models = set()   # установленные модели (/api/tags)
+        self.loaded = set()   # загруженные в память (/api/ps)
+
+    @property
+    def load(self):
+        # У шарда может не быть своей доли на этом сервере
+        return self.inflight / self.max_inflight if self.max_inflight else float("inf")
+
+    def has_slot(self, priority=INTERACTIVE):
+        if self.inflight >= self.max_inflight:
+            return False
+        return priority == INTERACTIVE or self.background < background_limit(self.max_inflight)
+
+    def __repr__(self):
+        state = "ok" if self.healthy else "down"
+        return f"{self.url} [{state}, {self.inflight}/{self.max_inflight}]"
+
+
+class OllamaRouter:
+    """Выбор сервера для запроса, учёт слотов и проверки здоровья"""
+
+    def __init__(self, backends=None, health_interval=OLLAMA_HEALTH_INTERVAL, unhealthy_after=OLLAMA_UNHEALTHY_AFTER):
+        self.backends = [Backend(i, url, limit) for i, (url, limit) in enumerate(backends or parse_backends())]
+        self.health_interval = health_interval
+        self.unhealthy_after = unhealthy_after
+        self.beacon = ActivityBeacon()
+        self.background_slots = BackgroundSlots()
+        self._queues = {}
+        self._health_tasks = {}
+
+    @property
+    def capacity(self):
+        """Суммарный лимит одновременных запросов по всем серверам"""
+        return sum(b.max_inflight for b in self.backends)
+
+    def share(self, shard, num_shards):
+        """Оставляет процессу-шарду его долю лимитов серверов.
+
+        Доли всех шардов на сервере в сумме равны его лимиту. Остаток от
+        деления раздаётся по кругу со сдвигом от сервера к серверу, так что
+        суммарные доли шардов отличаются не больше чем на 1 и при
+        num_shards <= capacity у каждого шарда есть хотя бы один слот.
+        """
+        offset = 0
+        for backend in self.backends:
+            backend.max_inflight = split_slots(backend.base_limit, num_shards, (shard - offset) % num_shards)
+            offset += backend.base_limit
+
+    def _queue(self):
+        # Futures привязаны к event loop
+        key = id(asyncio.get_running_loop())
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = WaitQueue()
+        return queue
+
+    def _candidates(self, model, priority=INTERACTIVE, only=None):
+        """Серверы со свободным слотом, лучший - первый"""
+        candidates = [b for b in ([only] if only else self.backends) if b.healthy and b.has_slot(priority)]
+        return sorted(candidates, key=lambda b: (model not in b.loaded, b.load, random.random()))
+
+    def _grant(self, model, priority, only=None):
+        for backend in self._candidates(model, priority, only):
+            if priority != INTERACTIVE:
+                # Фоновые слоты сервера делят все процессы (бот, пересборка базы)
+                handle = self.background_slots.acquire(backend.url, backend.base_limit)
+                if handle is None:
+                    continue
+                backend.slot_handles.append(handle)
+                backend.background += 1
+            backend.inflight += 1
+            self._publish(backend)
+            return backend
+        return None
+
+    def _free(self, backend, priority):
+        """Возвращает слот без учёта результата запроса"""
+        backend.inflight -= 1
+        if priority != INTERACTIVE:
+            backend.background -= 1
+            self.background_slots.release(backend.slot_handles.pop())
+
+    def _dispatch(self):
+        queue = self._queue()
+        if not any(b.healthy for b in self.backends):
+            queue.fail_all(NoHealthyBackend("все серверы Ollama недоступны"))
+            return
+        queue.dispatch(self._grant)
+        metrics.set("ollama_queue_waiting", len(queue))
+
+    def pick(self):
+        """Сервер для лёгкого запроса без слота (tokenize, tags)"""
+        healthy = [b for b in self.backends if b.healthy] or self.backends
+        return min(healthy, key=lambda b: b.load)
+
+    async def acquire(self, model=None, priority=INTERACTIVE, backend=None):
+        """Ждёт свободный слот на лучшем (или заданном) сервере в порядке приоритета и занимает его"""
+        self._ensure_health_task()
+        if priority == INTERACTIVE:
+            self.beacon.touch()
+            return await self._wait_slot(model, priority, backend)
+
+        # Фоновый запрос уступает чату на границе запросов: отметка
+        # проверяется до очереди и ещё раз, когда слот уже выдан - пока
+        # запрос стоял в очереди, чат мог ожить
+        started = time.monotonic()
+        deferred = 0.0
+        while True:
+            remaining = max(0.0, LLM_BACKGROUND_MAX_DEFER - (time.monotonic() - started))
+            deferred += await self.beacon.wait_idle(max_wait=remaining)
+            granted = await self._wait_slot(model, priority, backend)
+            if not self.beacon.busy() or time.monotonic() - started >= LLM_BACKGROUND_MAX_DEFER:
+                break
+            self._free(granted, priority)
+            self._dispatch()
+        if deferred >= 1:
+            metrics.inc("llm_background_deferred_total")
+            logger.info(f"⏸️ Фоновый запрос ждал, пока бот отвечает в чате: {deferred:.1f} сек")
+        return granted
+
+    async def _wait_slot(self, model, priority, backend):
+        if backend is not None and not backend.healthy:
+            raise NoHealthyBackend(f"сервер {backend.url} выведен из ротации")
+
+        future = self._queue().push(priority, model, backend)
+        self._dispatch()
+        try:
+            if priority == INTERACTIVE:
+                return await future
+            # Фоновый слот может освободить другой процесс - об этом
+            # здесь не узнать, поэтому очередь периодически перепроверяется
+            while not future.done():
+                await asyncio.wait({future}, timeout=BACKGROUND_POLL)
+                if not future.done():
+                    self._dispatch()
+            return future.result()
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            # Слот успели выдать, но ожидающий уже отменён - возвращаем его
+            elif not future.cancelled() and future.exception() is None:
+                self._free(future.result(), priority)
+                self._dispatch()
+            raise
+
+    async def release(self, backend, exc=None, model=None, priority=INTERACTIVE):
+        """Освобождает слот и учитывает результат запроса"""
+        self._free(backend, priority)
+        if priority == INTERACTIVE:
+            self.beacon.touch()
+        if exc is None:
+            backend.failures = 0
+            if model:
+                backend.loaded.add(model)
+        elif is_backend_failure(exc):
+            backend.failures += 1
+            if backend.healthy and backend.failures >= self.unhealthy_after:
+                backend.healthy = False
+                metrics.inc("ollama_backend_drained_total")
+                logger.warning(f"🚫 Ollama {backend.url}: {backend.failures} ошибок подряд, вывожу из ротации ({exc})")
+        self._publish(backend)
+        self._dispatch()
+
+    def _publish(self, backend):
+        metrics.set(f"ollama_backend{backend.index}_inflight", backend.inflight)
+        metrics.set(f"ollama_backend{backend.index}_healthy", int(backend.healthy))
+
+    async def _check(self, backend):
+        client = get_async_client(OLLAMA)
+        timeout = get_async_timeout(OLLAMA, read=HEALTH_TIMEOUT)
+        try:
+            tags = await client.get(f"{backend.url}/api/tags", timeout=timeout)
+            tags.raise_for_status()
+            backend.models = {m.get("name") for m in tags.json().get("models", [])}
+            # /api/ps есть не во всех версиях; без него судим по успешным ответам
+            ps = await client.get(f"{backend.url}/api/ps", timeout=timeout)
+            if ps.status_code == 200:
+                backend.loaded = {m.get("name") for m in ps.json().get("models", [])}
+        except Exception as e:
+            if backend.healthy:
+                logger.warning(f"🚫 Ollama {backend.url} не отвечает на проверку: {e}")
+                metrics.inc("ollama_backend_drained_total")
+            backend.healthy = False
+            self._publish(backend)
+            return
+
+        if not backend.healthy:
+            logger.info(f"✅ Ollama {backend.url} снова в ротации")
+        backend.healthy = True
+        backend.failures = 0
+        self._publish(backend)
+
+    async def check_health(self):
+        """Один проход проверки всех серверов"""
+        await asyncio.gather(*(self._check(b) for b in self.backends))
+        self._dispatch()
+
+    async def _health_loop(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+    def _ensure_health_task(self):
+        loop = asyncio.get_running_loop()
+        task = self._health_tasks.get(id(loop))
+        if task is None or task.done():
+            self._health_tasks[id(loop)] = loop.create_task(self._health_loop())
+
+    async def close(self):
+        """Останавливает фоновую проверку текущего event loop"""
+        task = self._health_tasks.pop(id(asyncio.get_running_loop()), None)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._queues.pop(id(asyncio.get_running_loop()), None)
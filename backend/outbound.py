@@ -0,0 +1,167 @@
+# outbound.py - ИСХОДЯЩИЕ ВЫЗОВЫ TELEGRAM С ОГРАНИЧЕНИЕМ СКОРОСТИ
+#
+# Лимиты Telegram Bot API: ~30 сообщений в секунду на бота, ~1 в секунду
+# в личный чат и ~20 в минуту в группу. Ответ 429 содержит
+# parameters.retry_after - столько секунд чат нужно не трогать.
+# У каждого чата своя очередь и своя задача-отправитель, поэтому
+# притормозивший чат не задерживает отправку в остальные.
+
+import asyncio
+import logging
+import time
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_MAX_SEND_ATTEMPTS
+from http_clients import TELEGRAM, get_async_client
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько простаивающих чатов держать, прежде чем чистить их состояние
+MAX_IDLE_CHATS = 10000
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        """Ждёт и забирает один токен"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatOutbox:
+    """Очередь и лимиты одного чата"""
+
+    def __init__(self, chat_id):
+        rate = TELEGRAM_GROUP_RATE if int(chat_id) < 0 else TELEGRAM_CHAT_RATE
+        self.bucket = TokenBucket(rate)
+        self.queue = asyncio.Queue()
+        self.blocked_until = 0.0
+        self.worker = None
+
+
+class TelegramMethods:
+    """Методы Bot API поверх call(method, chat_id, params)"""
+
+    async def call(self, method, chat_id, params):
+        raise NotImplementedError
+
+    async def send_message(self, chat_id, text):
+        """Отправляет сообщение, возвращает его message_id (или None)"""
+        if len(text) > 4096:
+            text = text[:4090] + "..."
+        result = await self.call("sendMessage", chat_id, {"chat_id": chat_id, "text": text})
+        return result.get("message_id") if isinstance(result, dict) else None
+
+    async def edit_message(self, chat_id, message_id, text):
+        """Заменяет текст ранее отправленного сообщения"""
+        if len(text) > 4096:
+            text = text[:4090] + "..."
+        params = {"chat_id": chat_id, "message_id": message_id, "text": text}
+        return await self.call("editMessageText", chat_id, params)
+
+
+class OutboundSender(TelegramMethods):
+    """Отправляет вызовы Bot API через глобальный и початовые лимиты"""
+
+    def __init__(self, api_url):
+        self.api_url = api_url
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, capacity=TELEGRAM_GLOBAL_RATE)
+        self.chats = {}
+
+    async def send_chat_action(self, chat_id, action="typing"):
+        """Статус "печатает..." - без початового лимита и без повторов"""
+        await self.global_bucket.acquire()
+        try:
+            await get_async_client(TELEGRAM).post(
+                f"{self.api_url}/sendChatAction", data={"chat_id": chat_id, "action": action}
+            )
+        except Exception as e:
+            logger.debug(f"sendChatAction [{chat_id}]: {e}")
+
+    async def call(self, method, chat_id, params):
+        """Ставит вызов в очередь чата и ждёт результат (result из ответа или None)"""
+        outbox = self._get_outbox(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        outbox.queue.put_nowait((method, params, future))
+        if outbox.worker is None:
+            outbox.worker = asyncio.create_task(self._chat_worker(chat_id, outbox))
+        return await future
+
+    def _get_outbox(self, chat_id):
+        outbox = self.chats.get(chat_id)
+        if outbox is None:
+            if len(self.chats) >= MAX_IDLE_CHATS:
+                self._prune_idle()
+            outbox = ChatOutbox(chat_id)
+            self.chats[chat_id] = outbox
+        return outbox
+
+    def _prune_idle(self):
+        """Удаляет чаты без работы, лимит которых уже полностью восстановился"""
+        for chat_id, outbox in list(self.chats.items()):
+            if outbox.worker is None and outbox.bucket.is_full() and time.monotonic() >= outbox.blocked_until:
+                del self.chats[chat_id]
+
+    async def _chat_worker(self, chat_id, outbox):
+        try:
+            while not outbox.queue.empty():
+                method, params, future = outbox.queue.get_nowait()
+                try:
+                    result = await self._send_with_limits(method, chat_id, outbox, params)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка {method} [{chat_id}]: {e}")
+                    result = None
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            outbox.worker = None
+
+    async def _send_with_limits(self, method, chat_id, outbox, params):
+        for attempt in range(TELEGRAM_MAX_SEND_ATTEMPTS):
+            delay = outbox.blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await outbox.bucket.acquire()
+            await self.global_bucket.acquire()
+
+            resp = await get_async_client(TELEGRAM).post(f"{self.api_url}/{method}", data=params)
+            metrics.inc("telegram_requests_total")
+            data = resp.json()
+
+            if resp.status_code == 429:
+                retry_after = data.get("parameters", {}).get("retry_after", 1)
+                outbox.blocked_until = time.monotonic() + retry_after
+                metrics.inc("telegram_429_total")
+                logger.warning(
+                    f"⏳ 429 от Telegram [{chat_id}]: жду {retry_after} сек "
+                    f"(попытка {attempt + 1}/{TELEGRAM_MAX_SEND_ATTEMPTS})"
+                )
+                continue
+
+            if not data.get("ok"):
+                # Например "message is not modified" при одинаковой правке
+                logger.debug(f"{method} [{chat_id}]: {data.get('description')}")
+                return None
+            return data.get("result")
+
+        logger.error(f"❌ {method} [{chat_id}]: не отправлено после {TELEGRAM_MAX_SEND_ATTEMPTS} попыток")
+        return None
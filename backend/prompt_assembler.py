@@ -0,0 +1,236 @@
+# prompt_assembler.py - СБОРКА ПРОМПТА ПО БЮДЖЕТУ ТОКЕНОВ
+#
+# На CPU время до первого токена почти линейно зависит от длины промпта,
+# поэтому каждая часть получает приоритет и потолок в токенах, а не
+# обрезается по символам вслепую:
+#   1. вопрос              PROMPT_QUESTION_TOKENS
+#   2. system prompt       PROMPT_SYSTEM_TOKENS   (режется по границе строки)
+#   3. история диалога     PROMPT_HISTORY_TOKENS  (старые реплики отбрасываются)
+#   4. найденные сообщения PROMPT_RETRIEVAL_TOKENS (менее похожие отбрасываются)
+#   5. факты из профиля    PROMPT_FACTS_TOKENS    (то, что уже есть в промте, не дублируется)
+# Части заполняются по порядку, пока не кончится окно PROMPT_MAX_CTX минус
+# место под ответ. В system-сообщении стабильные части идут первыми
+# (system prompt, факты, затем найденные сообщения): Ollama переиспользует
+# кэш общего префикса, прогретый model_warmup.py. Само окно (num_ctx) одно на процесс - PROMPT_MAX_CTX:
+# при смене num_ctx Ollama перезагружает модель и теряет прогретый префикс,
+# поэтому бюджет ограничивает только содержимое промпта.
+#
+# Короткие тексты (реплики, документы, строки фактов, вопрос) считаются
+# оценкой по числу символов на токен - HTTP-запрос на каждый обошёлся бы
+# дороже ошибки оценки. /api/tokenize спрашивается только для длинных
+# (от PROMPT_TOKENIZE_MIN_CHARS, обычно system prompt): ответы уточняют
+# оценку и кэшируются. Если сервер не умеет tokenize (404), больше не спрашиваем.
+
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+import httpx
+from config import (
+    PROMPT_MAX_CTX, PROMPT_NUM_PREDICT,
+    PROMPT_QUESTION_TOKENS, PROMPT_SYSTEM_TOKENS, PROMPT_HISTORY_TOKENS,
+    PROMPT_RETRIEVAL_TOKENS, PROMPT_FACTS_TOKENS,
+    PROMPT_CHARS_PER_TOKEN, PROMPT_TOKENIZE_TIMEOUT, PROMPT_TOKENIZE_MIN_CHARS,
+)
+from metrics import metrics
+from ollama_client import ollama
+from retriever import format_context
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены шаблона чата на каждое сообщение ([INST] и т.п.)
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """Число токенов текста: оценка, для длинных текстов - /api/tokenize с кэшем"""
+
+    def __init__(self, client=ollama, chars_per_token=PROMPT_CHARS_PER_TOKEN, cache_size=4096,
+                 remote_min_chars=PROMPT_TOKENIZE_MIN_CHARS):
+        self.client = client
+        self.chars_per_token = chars_per_token
+        self.cache_size = cache_size
+        self.remote_min_chars = remote_min_chars
+        self.cache = OrderedDict()
+        self.remote = None      # None - ещё не знаем, умеет ли сервер tokenize; False - не умеет
+        self._probing = False   # первый запрос к tokenize ещё в пути
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def estimate(self, text):
+        """Без сети: из кэша или по среднему числу символов на токен"""
+        cached = self.cache.get(self._key(text))
+        if cached is not None:
+            return cached
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+    async def count(self, text):
+        if not text:
+            return 0
+        key = self._key(text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            metrics.inc("prompt_token_cache_hits_total")
+            return cached
+        if self.remote is False or self._probing or len(text) < self.remote_min_chars:
+            return self.estimate(text)
+
+        # Пока не ясно, есть ли tokenize, запрос к нему идёт один
+        self._probing = self.remote is None
+        try:
+            tokens = len(await self.client.tokenize(text, timeout=PROMPT_TOKENIZE_TIMEOUT))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (404, 405, 501):
+                self.remote = False
+                logger.info("ℹ️ Ollama не поддерживает /api/tokenize - считаю токены по оценке")
+            return self.estimate(text)
+        except Exception as e:
+            logger.debug(f"tokenize недоступен: {e}")
+            return self.estimate(text)
+        finally:
+            self._probing = False
+        self.remote = True
+
+        if len(text) >= 50 and tokens:
+            # Скользящее среднее: оценка подстраивается под реальный токенизатор
+            self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * (len(text) / tokens)
+        self.cache[key] = tokens
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return tokens
+
+    async def count_many(self, texts):
+        # По очереди: короткие считаются без сети, длинные не идут в tokenize залпом
+        return [await self.count(text) for text in texts]
+
+
+class AssembledPrompt:
+    """Готовый массив messages, размер по частям и num_ctx"""
+
+    __slots__ = ("messages", "tokens", "num_ctx")
+
+    def __init__(self, messages, tokens, num_ctx):
+        self.messages = messages
+        self.tokens = tokens
+        self.num_ctx = num_ctx
+
+    @property
+    def total(self):
+        return sum(self.tokens.values())
+
+
+def render_profile(profile, system_prompt):
+    """Строки "ключ: значение" из user_profile, которых ещё нет в system prompt"""
+    lines = []
+    for section, values in (profile or {}).items():
+        if not isinstance(values, dict):
+            continue
+        for key, value in values.items():
+            if isinstance(value, list):
+                value = ", ".join(str(v) for v in value if v)
+            if not value or value in ("Unknown", "unknown") or value is True:
+                continue
+            value = str(value)
+            if value.lower() in system_prompt.lower():
+                continue
+            lines.append(f"- {section}.{key}: {value}")
+    return lines
+
+
+class PromptAssembler:
+    """Собирает messages для /api/chat в пределах окна контекста"""
+
+    def __init__(self, counter=None, max_ctx=PROMPT_MAX_CTX, num_predict=PROMPT_NUM_PREDICT):
+        self.counter = counter or TokenCounter()
+        self.max_ctx = max_ctx
+        self.num_predict = num_predict
+
+    async def fit_text(self, text, max_tokens):
+        """Текст, укороченный до max_tokens по границе строки/предложения -> (text, tokens)"""
+        tokens = await self.counter.count(text)
+        for _ in range(4):
+            if tokens <= max_tokens:
+                return text, tokens
+            chars = int(len(text) * max_tokens / tokens * 0.95)
+            cut = text[:chars]
+            boundary = max(cut.rfind("\n"), cut.rfind(". "))
+            if boundary > chars * 0.7:
+                cut = cut[:boundary + 1]
+            text = cut.rstrip()
+            tokens = await self.counter.count(text)
+        return text, tokens
+
+    async def _take_items(self, items, budget):
+        """Первые элементы списка, сколько влезает в budget -> (items, tokens)"""
+        counts = await self.counter.count_many(items)
+        taken, used = [], 0
+        for item, count in zip(items, counts):
+            if used + count + MESSAGE_OVERHEAD > budget:
+                break
+            taken.append(item)
+            used += count + MESSAGE_OVERHEAD
+        return taken, used
+
+    async def assemble(self, system_prompt, question, history=(), documents=(), profile=None):
+        remaining = self.max_ctx - self.num_predict
+        tokens = {}
+        trimmed = []
+
+        question, tokens["question"] = await self.fit_text(question, min(PROMPT_QUESTION_TOKENS, remaining))
+        remaining -= tokens["question"] + MESSAGE_OVERHEAD
+
+        original = system_prompt
+        system_prompt, tokens["system"] = await self.fit_text(system_prompt, min(PROMPT_SYSTEM_TOKENS, remaining))
+        if system_prompt != original:
+            trimmed.append("system")
+        remaining -= tokens["system"] + MESSAGE_OVERHEAD
+
+        # История: от свежих реплик к старым, начинаем всегда с вопроса пользователя
+        newest_first = list(reversed(history))
+        kept, tokens["history"] = await self._take_items(
+            [m["content"] for m in newest_first], min(PROMPT_HISTORY_TOKENS, remaining)
+        )
+        kept_history = list(reversed(newest_first[:len(kept)]))
+        while kept_history and kept_history[0]["role"] != "user":
+            kept_history.pop(0)
+        if len(kept_history) < len(history):
+            trimmed.append("history")
+        remaining -= tokens["history"]
+
+        docs, _ = await self._take_items(list(documents), min(PROMPT_RETRIEVAL_TOKENS, remaining))
+        if len(docs) < len(documents):
+            trimmed.append("retrieval")
+        retrieval_block = format_context(docs, max_chars=10 ** 6)
+        tokens["retrieval"] = await self.counter.count(retrieval_block)
+        remaining -= tokens["retrieval"]
+
+        facts = render_profile(profile, system_prompt)
+        facts_kept, _ = await self._take_items(facts, min(PROMPT_FACTS_TOKENS, remaining))
+        if len(facts_kept) < len(facts):
+            trimmed.append("facts")
+        facts_block = "\n\nФакты о тебе:\n" + "\n".join(facts_kept) if facts_kept else ""
+        tokens["facts"] = await self.counter.count(facts_block)
+
+        messages = [
+            {"role": "system", "content": system_prompt + facts_block + retrieval_block},
+            *kept_history,
+            {"role": "user", "content": question},
+        ]
+        prompt = AssembledPrompt(messages, tokens, self.max_ctx)
+
+        metrics.inc("prompt_tokens_total", prompt.total)
+        metrics.inc("prompt_requests_total")
+        if trimmed:
+            metrics.inc("prompt_trimmed_total")
+        logger.info(
+            "🧮 Промпт: " + ", ".join(f"{k} {v}" for k, v in tokens.items()) +
+            f" = {prompt.total} токенов, num_ctx {prompt.num_ctx}" +
+            (f" (урезано: {', '.join(trimmed)})" if trimmed else "")
+        )
+        return prompt
+
+
+prompt_assembler = PromptAssembler()
@@ -0,0 +1,95 @@
+# prompt_assets.py - ПРОМТ В ПАМЯТИ С ГОРЯЧЕЙ ПЕРЕЗАГРУЗКОЙ
+#
+# prompt_template.json читается один раз и перечитывается только когда файл
+# изменился (проверка stat не чаще раза в PROMPT_RELOAD_CHECK_INTERVAL сек).
+# Новый промт подменяется целиком одной операцией присваивания, поэтому
+# читатели видят либо старую, либо новую версию. version - хэш содержимого,
+# по нему сбрасываются кэши, зависящие от промта.
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from config import PROMPT_TEMPLATE_FILE, PROMPT_RELOAD_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class PromptAsset:
+    """Неизменяемый снимок загруженного промта"""
+
+    __slots__ = ("system_prompt", "data", "version")
+
+    def __init__(self, system_prompt, data, version):
+        self.system_prompt = system_prompt
+        self.data = data
+        self.version = version
+
+
+class PromptAssetManager:
+    """Держит текущий PromptAsset и подменяет его при изменении файла"""
+
+    def __init__(self, path=PROMPT_TEMPLATE_FILE, check_interval=PROMPT_RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._asset = None
+        self._stat_key = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """Версия текущего промта (None, если промт не загружен)"""
+        asset = self.get()
+        return asset.version if asset else None
+
+    def get(self):
+        """Текущий промт; при необходимости проверяет файл и перечитывает его"""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self._check()
+        return self._asset
+
+    def _check(self):
+        with self._lock:
+            if time.monotonic() - self._last_check < self.check_interval:
+                return  # другой поток только что проверил
+            self._last_check = time.monotonic()
+
+            try:
+                stat = self.path.stat()
+            except FileNotFoundError:
+                if self._stat_key is not None or self._asset is None:
+                    logger.error(f"❌ {self.path} не найден!")
+                self._stat_key = None
+                return
+
+            stat_key = (stat.st_mtime_ns, stat.st_size)
+            if stat_key == self._stat_key:
+                return
+
+            asset = self._load()
+            if asset is not None:
+                self._stat_key = stat_key
+                self._asset = asset  # атомарная подмена
+
+    def _load(self):
+        try:
+            raw = self.path.read_bytes()
+            data = json.loads(raw.decode("utf-8"))
+        except Exception as e:
+            # Например, файл перезаписывается прямо сейчас - оставляем старую версию
+            logger.error(f"❌ Ошибка загрузки промта: {e}")
+            return None
+
+        system_prompt = data.get('system_prompt', '').strip()
+        if not system_prompt:
+            logger.error("❌ system_prompt пустой!")
+            return None
+
+        version = hashlib.sha1(raw).hexdigest()[:12]
+        logger.info(f"✅ Загружен промт ({len(system_prompt)} символов, версия {version})")
+        return PromptAsset(system_prompt, data, version)
+
+
+prompt_assets = PromptAssetManager()
@@ -0,0 +1,197 @@
+# response_cache.py - КЭШ ОТВЕТОВ С ОБЪЕДИНЕНИЕМ ОДИНАКОВЫХ ЗАПРОСОВ
+#
+# Уровни поиска:
+#   1. точное совпадение нормализованного текста ("Привет!!" == "привет")
+#   2. (опционально) близость эмбеддингов выше RESPONSE_CACHE_SIMILARITY
+# Записи вытесняются по LRU и TTL, ключ включает версию промта, так что
+# после правки prompt_template.json старые ответы не используются, и
+# контекст диалога (см. HistoryStore.context_key) - на "а ты?" ответ
+# зависит от того, что бот сказал перед этим.
+# Одинаковые вопросы, пришедшие одновременно, ждут одну генерацию.
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from config import (
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_SEMANTIC, RESPONSE_CACHE_SIMILARITY,
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ответы-заглушки не кэшируем
+UNCACHEABLE_ANSWERS = ("Хм, не знаю что ответить...",)
+
+
+class PartialAnswer(str):
+    """Ответ, оборванный посреди потока: пользователь его уже видит,
+    но в кэш и в историю диалога он не попадает"""
+
+
+def is_complete(answer):
+    """Можно ли запомнить ответ (в кэше и в истории)"""
+    return bool(answer) and answer not in UNCACHEABLE_ANSWERS and not isinstance(answer, PartialAnswer)
+
+
+def normalize_question(text):
+    """Нижний регистр, ё→е, без пунктуации и эмодзи, одиночные пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class CacheEntry:
+    __slots__ = ("answer", "created_at", "cost", "embedding")
+
+    def __init__(self, answer, cost, embedding=None):
+        self.answer = answer
+        self.created_at = time.monotonic()
+        self.cost = cost            # сколько секунд LLM стоил этот ответ
+        self.embedding = embedding  # нормированный вектор для семантического поиска
+
+
+class ResponseCache:
+    """LRU/TTL кэш ответов + singleflight для одновременных одинаковых вопросов"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 semantic=RESPONSE_CACHE_SEMANTIC, threshold=RESPONSE_CACHE_SIMILARITY,
+                 embed=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self.embed = embed  # texts -> list[vector]; None - семантический уровень выключен
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_exact(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _embed(self, normalized):
+        import numpy as np
+
+        vector = np.asarray(self.embed([normalized])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _get_semantic(self, scope, embedding):
+        import numpy as np
+
+        now = time.monotonic()
+        candidates = [
+            (key, entry) for key, entry in self.entries.items()
+            if key[:2] == scope and entry.embedding is not None and now - entry.created_at <= self.ttl
+        ]
+        if not candidates:
+            return None
+        scores = np.stack([entry.embedding for _, entry in candidates]) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        key, entry = candidates[best]
+        self.entries.move_to_end(key)
+        logger.info(f"🧠 Семантическое совпадение с '{key[2]}' ({scores[best]:.2f})")
+        return entry
+
+    def _store(self, key, answer, cost, embedding):
+        self.entries[key] = CacheEntry(answer, cost, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _record(self, hit, entry=None):
+        if hit:
+            self.hits += 1
+            metrics.inc("cache_hits_total")
+            metrics.inc("cache_saved_llm_seconds_total", round(entry.cost, 2))
+        else:
+            self.misses += 1
+            metrics.inc("cache_misses_total")
+        metrics.set("cache_hit_rate", round(self.hits / (self.hits + self.misses), 3))
+        metrics.set("cache_entries", len(self.entries))
+
+    async def get_or_generate(self, question, version, generate, context=None):
+        """Ответ из кэша или через generate() (корутина -> str).
+
+        Возвращает (answer, source): source = "cache" | "shared" | "generated".
+        "shared" - ответ сгенерирован другим одновременным запросом.
+        """
+        if not RESPONSE_CACHE_ENABLED:
+            return await generate(), "generated"
+
+        normalized = normalize_question(question)
+        key = (version, context, normalized)
+
+        entry = self._get_exact(key)
+        embedding = None
+        if entry is None and self.semantic and self.embed is not None and normalized:
+            try:
+                embedding = await asyncio.to_thread(self._embed, normalized)
+                entry = self._get_semantic(key[:2], embedding)
+                if entry is not None:
+                    metrics.inc("cache_semantic_hits_total")
+            except Exception as e:
+                logger.warning(f"⚠️ Семантический кэш недоступен: {e}")
+        if entry is not None:
+            self._record(True, entry)
+            logger.info(f"💾 Ответ из кэша: '{normalized}'")
+            return entry.answer, "cache"
+
+        flight = self.inflight.get(key)
+        if flight is not None:
+            metrics.inc("cache_singleflight_shared_total")
+            try:
+                answer = await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise  # отменили нас самих
+                # Ведущий запрос отменён - генерируем сами
+                return await generate(), "generated"
+            if isinstance(answer, PartialAnswer):
+                # У ведущего оборвался поток - обрывок не раздаём
+                return await generate(), "generated"
+            return answer, "shared"
+
+        self._record(False)
+        flight = asyncio.get_running_loop().create_future()
+        self.inflight[key] = flight
+        started = time.monotonic()
+        try:
+            answer = await generate()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # не логировать "exception was never retrieved"
+            raise
+        finally:
+            self.inflight.pop(key, None)
+
+        flight.set_result(answer)
+        if is_complete(answer):
+            self._store(key, answer, time.monotonic() - started, embedding)
+        return answer, "generated"
+
+
+def _embed_with_retriever(texts):
+    from retriever import retriever
+
+    if retriever.collection is None:
+        raise RuntimeError("модель эмбеддингов не загружена")
+    return retriever.embedding_function(texts)
+
+
+response_cache = ResponseCache(embed=_embed_with_retriever)
@@ -0,0 +1,127 @@
+# retriever.py - ПОИСК ПОХОЖИХ СООБЩЕНИЙ ПОЛЬЗОВАТЕЛЯ В CHROMADB
+#
+# Коллекция user_messages (её строит build_vector_db_fixed.py) открывается
+# один раз на процесс, модель эмбеддингов остаётся в памяти. На каждый вопрос
+# берутся top-k собственных сообщений пользователя - как образец стиля и
+# источник фактов. Время каждого этапа пишется в лог и метрики; если поиск
+# вышел за RETRIEVAL_BUDGET_MS, это видно по retrieval_over_budget_total.
+
+import logging
+import threading
+import time
+from config import (
+    CHROMA_DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL,
+    RETRIEVAL_ENABLED, RETRIEVAL_TOP_K, RETRIEVAL_BUDGET_MS, RETRIEVAL_MAX_CHARS,
+)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд повторить попытку открыть коллекцию после ошибки
+REOPEN_INTERVAL = 60
+
+
+class MessageRetriever:
+    """Ленивая, но однократная инициализация клиента, коллекции и модели"""
+
+    def __init__(self, db_dir=CHROMA_DB_DIR, collection_name=COLLECTION_NAME, top_k=RETRIEVAL_TOP_K):
+        self.db_dir = db_dir
+        self.collection_name = collection_name
+        self.top_k = top_k
+        self.embedding_function = None
+        self._collection = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def collection(self):
+        """Коллекция ChromaDB или None, если базы нет"""
+        if self._collection is None:
+            self._open()
+        return self._collection
+
+    def _open(self):
+        with self._lock:
+            if self._collection is not None:
+                return
+            if self._failed_at and time.monotonic() - self._failed_at < REOPEN_INTERVAL:
+                return
+            try:
+                import chromadb
+                from embedding_cache import cached_embedding_function
+
+                started = time.perf_counter()
+                client = chromadb.PersistentClient(path=str(self.db_dir))
+                # Кэш с диска только читается: вопросы в файл не дописываются,
+                # недавние держатся в памяти (см. embedding_cache.py)
+                self.embedding_function = cached_embedding_function(EMBEDDING_MODEL, persist=False)
+                self._collection = client.get_collection(
+                    name=self.collection_name, embedding_function=self.embedding_function
+                )
+                logger.info(
+                    f"✅ ChromaDB: коллекция {self.collection_name} открыта "
+                    f"({self._collection.count()} документов, {time.perf_counter() - started:.1f} сек)"
+                )
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                logger.warning(f"⚠️ ChromaDB недоступна, отвечаю без контекста: {e}")
+
+    def warmup(self):
+        """Открывает коллекцию и прогоняет модель, чтобы первый вопрос не ждал загрузки"""
+        if RETRIEVAL_ENABLED and self.collection is not None:
+            self.embedding_function(["прогрев"])
+
+    def retrieve(self, question, top_k=None):
+        """Похожие сообщения пользователя (список строк, самые близкие первыми)"""
+        if not RETRIEVAL_ENABLED:
+            return []
+        collection = self.collection
+        if collection is None:
+            return []
+
+        try:
+            started = time.perf_counter()
+            query_embedding = self.embedding_function([question])
+            embedded = time.perf_counter()
+            results = collection.query(
+                query_embeddings=query_embedding,
+                n_results=top_k or self.top_k,
+                include=["documents"],
+            )
+            finished = time.perf_counter()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка поиска в ChromaDB: {e}")
+            metrics.inc("retrieval_errors_total")
+            return []
+
+        embed_ms = (embedded - started) * 1000
+        query_ms = (finished - embedded) * 1000
+        total_ms = embed_ms + query_ms
+        metrics.inc("retrieval_requests_total")
+        metrics.inc("retrieval_embed_ms_total", round(embed_ms))
+        metrics.inc("retrieval_query_ms_total", round(query_ms))
+        if total_ms > RETRIEVAL_BUDGET_MS:
+            metrics.inc("retrieval_over_budget_total")
+            logger.warning(f"⚠️ Поиск {total_ms:.0f} мс > бюджета {RETRIEVAL_BUDGET_MS} мс")
+
+        documents = results.get("documents", [[]])[0]
+        logger.info(f"🔎 Поиск: {len(documents)} сообщений (эмбеддинг {embed_ms:.0f} мс, поиск {query_ms:.0f} мс)")
+        return documents
+
+
+def format_context(documents, max_chars=RETRIEVAL_MAX_CHARS):
+    """Блок для system prompt с примерами сообщений пользователя"""
+    lines = []
+    used = 0
+    for doc in documents:
+        line = f"- {doc.strip()}"
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+    if not lines:
+        return ""
+    return "\n\nТвои реальные сообщения на похожие темы (пиши в том же стиле, опирайся на факты из них):\n" + "\n".join(lines)
+
+
+retriever = MessageRetriever()
@@ -0,0 +1,190 @@
+# retry_policy.py - ПОВТОРЫ С ОБЩИМ ДЕДЛАЙНОМ И ПРЕДОХРАНИТЕЛЬ
+#
+# Раньше каждый вызов Ollama повторялся во вложенных циклах со своими
+# паузами, и один неудачный вопрос мог висеть полчаса. Теперь:
+#   - у запроса один дедлайн на все попытки вместе с паузами;
+#   - паузы растут экспоненциально со случайным разбросом (full jitter),
+#     чтобы повторы разных запросов не приходили в Ollama одной волной;
+#   - повторяются только временные ошибки (таймаут, обрыв, 5xx, пустой ответ);
+#   - после BREAKER_FAILURE_THRESHOLD сбоев подряд предохранитель размыкается
+#     и запросы сразу получают CircuitOpenError, пока Ollama не ответит снова.
+
+import asyncio
+import logging
+import random
+import time
+import httpx
+from config import (
+    LLM_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT,
+)
+from metrics import metrics
+from ollama_client import OllamaError
+
+logger = logging.getLogger(__name__)
+
+# Коды, при которых сервер может ответить нормально со следующей попытки
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """Ответ получен, но непригоден (например, пустой) - стоит повторить"""
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель разомкнут - запрос не отправлялся"""
+
+
+class DeadlineExceeded(Exception):
+    """Дедлайн запроса исчерпан раньше, чем получен ответ"""
+
+
+def is_retryable(exc):
+    """Есть ли смысл повторять запрос после такой ошибки"""
+    if isinstance(exc, (RetryableError, OllamaError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUSES
+    return False
+
+
+def is_server_failure(exc):
+    """Говорит ли ошибка о том, что Ollama недоступна или перегружена"""
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """closed -> (N сбоев подряд) -> open -> (reset_timeout) -> half-open -> closed/open"""
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        """Бросает CircuitOpenError, если запрос отправлять нельзя"""
+        state = self.state
+        if state == "closed":
+            return
+        now = time.monotonic()
+        if state == "half_open":
+            # Один пробный запрос; если он пропал без результата - через reset_timeout следующий
+            if self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout:
+                self.trial_started_at = now
+                logger.info(f"🔌 {self.name}: пробный запрос после паузы")
+                return
+        metrics.inc(f"{self.name}_circuit_rejected_total")
+        raise CircuitOpenError(f"{self.name} недоступна (предохранитель разомкнут)")
+
+    def record(self, exc=None):
+        """Учитывает результат запроса, прошедшего через check()"""
+        if exc is not None and is_server_failure(exc):
+            self._failure()
+        else:
+            self._success()
+
+    def _success(self):
+        if self.opened_at is not None:
+            logger.info(f"✅ {self.name}: снова отвечает, предохранитель замкнут")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        metrics.set(f"{self.name}_circuit_open", 0)
+
+    def _failure(self):
+        self.failures += 1
+        self.trial_started_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.error(f"⚡ {self.name}: {self.failures} сбоев подряд, предохранитель разомкнут на {self.reset_timeout:.0f} сек")
+                metrics.inc(f"{self.name}_circuit_trips_total")
+            self.opened_at = time.monotonic()
+            metrics.set(f"{self.name}_circuit_open", 1)
+
+
+class RetryPolicy:
+    """Выполняет attempt(timeout) с повторами в пределах общего дедлайна"""
+
+    def __init__(self, name, deadline, attempt_timeout=None, max_attempts=LLM_MAX_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, breaker=None):
+        self.name = name
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout or deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+
+    def backoff(self, attempt):
+        """Пауза после attempt-й неудачной попытки (full jitter)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, attempt, deadline=None):
+        """attempt - корутина-функция timeout -> результат.
+
+        timeout - сколько секунд осталось на эту попытку; его стоит передать
+        в HTTP-запрос. Бросает последнюю ошибку, CircuitOpenError или
+        DeadlineExceeded.
+        """
+        started = time.monotonic()
+        expires = started + (deadline or self.deadline)
+
+        for number in range(self.max_attempts):
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.breaker:
+                self.breaker.check()
+
+            try:
+                result = await asyncio.wait_for(
+                    attempt(min(self.attempt_timeout, remaining)), timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                # Дедлайн запроса, а не сбой Ollama - предохранитель не трогаем
+                if self.breaker:
+                    self.breaker.trial_started_at = None
+                break
+            except Exception as e:
+                if self.breaker:
+                    self.breaker.record(e)
+                if not is_retryable(e) or number == self.max_attempts - 1:
+                    metrics.inc(f"{self.name}_failed_total")
+                    raise
+                delay = self.backoff(number)
+                if time.monotonic() + delay >= expires:
+                    metrics.inc(f"{self.name}_failed_total")
+                    raise
+                metrics.inc(f"{self.name}_retries_total")
+                logger.warning(
+                    f"🔄 {self.name}: попытка {number + 1}/{self.max_attempts} не удалась "
+                    f"({type(e).__name__}: {e}), повтор через {delay:.1f} сек"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            if self.breaker:
+                self.breaker.record()
+            return result
+
+        metrics.inc(f"{self.name}_deadline_exceeded_total")
+        raise DeadlineExceeded(f"{self.name}: нет ответа за {time.monotonic() - started:.0f} сек")
+
+
+# Один предохранитель на процесс: все вызовы Ollama видят её общее состояние
+ollama_breaker = CircuitBreaker("ollama")
@@ -0,0 +1,286 @@
+# sharding.py - МНОГОПРОЦЕССНЫЙ РЕЖИМ БОТА
+#
+# Основной процесс принимает обновления и раскладывает их по N процессам-
+# шардам по chat_id, поэтому всё состояние чата (очередь, история, склейка
+# сообщений) живёт ровно в одном процессе. Ответы шарды не отправляют сами:
+# вызовы Bot API возвращаются в основной процесс и идут через его единый
+# OutboundSender, так что лимиты Telegram соблюдаются на весь бот.
+#
+#   основной процесс ──in_queue[i]──▶ шард i
+#   шард i ──out_queue──▶ основной процесс ("call" / "action" / "complete")
+#   основной процесс ──resp_queue[i]──▶ шард i (результат "call")
+#   шард i ──out_queue──▶ основной процесс ("metrics" - снимок метрик шарда)
+#
+# Бюджет LLM (слоты серверов Ollama) делится между шардами
+# так, что в сумме не превышает настроенного; шардов больше, чем слотов,
+# запустить нельзя. Упавший шард основной процесс перезапускает и отдаёт ему
+# заново все обновления, которые тот не успел завершить.
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from config import DEBUG, QUEUE_MAX_DEPTH
+from metrics import metrics
+from outbound import TelegramMethods
+
+logger = logging.getLogger(__name__)
+
+# Как часто шард отправляет снимок метрик и основной процесс проверяет шарды, сек
+METRICS_PUSH_INTERVAL = 5
+SHARD_CHECK_INTERVAL = 1
+# Упавший сразу после запуска шард перезапускается не чаще, чем раз в столько секунд
+SHARD_RESTART_DELAY = 10
+
+
+def shard_for(chat_id, num_shards):
+    """Номер шарда для чата (стабилен между процессами и перезапусками)"""
+    return abs(int(chat_id)) % num_shards
+
+
+class RemoteSender(TelegramMethods):
+    """Отправитель внутри шарда: пересылает вызовы в основной процесс"""
+
+    def __init__(self, shard, out_queue, resp_queue):
+        self.shard = shard
+        self.out_queue = out_queue
+        self.resp_queue = resp_queue
+        self.futures = {}
+        self.ids = itertools.count()
+        self.loop = None
+
+    def start(self):
+        """Запускает поток, который разбирает ответы основного процесса"""
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_responses, daemon=True).start()
+
+    def _read_responses(self):
+        while True:
+            item = self.resp_queue.get()
+            if item is None:
+                return
+            request_id, result = item
+            self.loop.call_soon_threadsafe(self._resolve, request_id, result)
+
+    def _resolve(self, request_id, result):
+        future = self.futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def call(self, method, chat_id, params):
+        request_id = next(self.ids)
+        future = self.loop.create_future()
+        self.futures[request_id] = future
+        self.out_queue.put(("call", self.shard, request_id, method, chat_id, params))
+        return await future
+
+    async def send_chat_action(self, chat_id, action="typing"):
+        self.out_queue.put(("action", chat_id, action))
+
+
+def shard_worker_main(shard, num_shards, in_queue, out_queue, resp_queue):
+    """Точка входа процесса-шарда"""
+    logging.basicConfig(
+        level=logging.DEBUG if DEBUG else logging.INFO,
+        format=f'%(asctime)s - shard{shard} - %(levelname)s - %(message)s',
+    )
+    # CTRL+C получает вся группа процессов, а остановкой управляет основной
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_shard(shard, num_shards, in_queue, out_queue, resp_queue))
+
+
+async def _run_shard(shard, num_shards, in_queue, out_queue, resp_queue):
+    from bot_handlers import ChatHandlers
+    from dispatcher import UpdateDispatcher
+    from history_store import history_store, shard_history_path
+    from http_clients import close_async_clients
+    from ollama_client import ollama
+    from retriever import retriever
+
+    sender = RemoteSender(shard, out_queue, resp_queue)
+    sender.start()
+    handlers = ChatHandlers(sender)
+    # Общий бюджет LLM и очереди делится между шардами: доли в сумме - ровно лимит,
+    # диспетчер шарда берёт свою долю из ollama.router.capacity
+    ollama.router.share(shard, num_shards)
+    history_store.path = shard_history_path(shard, num_shards)
+    await asyncio.to_thread(history_store.load)
+    dispatcher = UpdateDispatcher(
+        handlers.handle_command, handlers.handle_message, handlers.handle_shed,
+        on_complete=lambda update_id: out_queue.put(("complete", update_id)),
+        max_depth=max(1, QUEUE_MAX_DEPTH // num_shards),
+    )
+    logger.info(f"🧩 Шард {shard}/{num_shards} запущен (слотов Ollama: {ollama.router.capacity})")
+    warmup = asyncio.create_task(asyncio.to_thread(retriever.warmup))
+    push = asyncio.create_task(_push_metrics(shard, out_queue))
+
+    while True:
+        update = await asyncio.to_thread(in_queue.get)
+        if update is None:
+            break
+        dispatcher.dispatch(update)
+
+    await dispatcher.join()
+    push.cancel()
+    out_queue.put(("metrics", shard, *metrics.export()))
+    await asyncio.gather(warmup, return_exceptions=True)
+    await ollama.close()
+    await close_async_clients()
+    history_store.close()
+    logger.info(f"🧩 Шард {shard} остановлен")
+
+
+async def _push_metrics(shard, out_queue):
+    """Периодически отправляет снимок метрик шарда в основной процесс"""
+    while True:
+        await asyncio.sleep(METRICS_PUSH_INTERVAL)
+        out_queue.put(("metrics", shard, *metrics.export()))
+
+
+class ShardRouter:
+    """Замена UpdateDispatcher для основного процесса: dispatch() / join()"""
+
+    def __init__(self, num_shards, sender, on_complete=None, slots=None):
+        """slots - сколько запросов к LLM можно держать всем шардам вместе"""
+        if slots is not None and num_shards > slots:
+            raise ValueError(
+                f"❌ Шардов ({num_shards}) больше, чем слотов LLM ({slots}): "
+                f"лишним шардам не достанется ни одного слота"
+            )
+        self.num_shards = num_shards
+        self.sender = sender
+        self.on_complete = on_complete or (lambda update_id: None)
+        self.ctx = multiprocessing.get_context("spawn")
+        self.in_queues = [None] * num_shards
+        self.resp_queues = [None] * num_shards
+        self.processes = [None] * num_shards
+        self.started_at = [0.0] * num_shards
+        self.out_queue = self.ctx.Queue()
+        self.unfinished = {}  # update_id -> (шард, обновление)
+        self.tasks = set()
+        self.loop = None
+        self.reader = None
+        self.watcher = None
+        self.stopping = False
+
+    def start(self):
+        """Запускает шарды, поток чтения их исходящих вызовов и наблюдение за ними"""
+        self.loop = asyncio.get_running_loop()
+        for shard in range(self.num_shards):
+            self._start_shard(shard)
+        self.reader = threading.Thread(target=self._read_outbound, daemon=True)
+        self.reader.start()
+        self.watcher = asyncio.create_task(self._watch())
+        logger.info(f"🧩 Запущено шардов: {self.num_shards}")
+
+    def _start_shard(self, shard):
+        # Очереди каждый раз новые: в старых могли остаться обновления,
+        # которые упавший процесс не успел прочитать, и ответы на его вызовы
+        self.in_queues[shard] = self.ctx.Queue()
+        self.resp_queues[shard] = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=shard_worker_main,
+            args=(shard, self.num_shards, self.in_queues[shard], self.out_queue, self.resp_queues[shard]),
+            name=f"bot-shard-{shard}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = time.monotonic()
+
+    async def _watch(self):
+        """Перезапускает упавшие шарды и отдаёт им незавершённые обновления"""
+        while not self.stopping:
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+            for shard, process in enumerate(self.processes):
+                if self.stopping or process.is_alive():
+                    continue
+                if time.monotonic() - self.started_at[shard] < SHARD_RESTART_DELAY:
+                    continue
+                self._restart_shard(shard, process.exitcode)
+
+    def _restart_shard(self, shard, exitcode):
+        replay = sorted(
+            (update for owner, update in self.unfinished.values() if owner == shard),
+            key=lambda update: update.get("update_id", 0),
+        )
+        logger.error(f"💥 Шард {shard} завершился (код {exitcode}) - перезапускаю, "
+                     f"незавершённых обновлений: {len(replay)}")
+        metrics.inc("bot_shard_restarts_total")
+        metrics.retire(shard)
+        for queue in (self.in_queues[shard], self.resp_queues[shard]):
+            queue.cancel_join_thread()
+            queue.close()
+        self._start_shard(shard)
+        for update in replay:
+            self.in_queues[shard].put(update)
+
+    def dispatch(self, update):
+        chat_id = update.get("message", {}).get("chat", {}).get("id")
+        if not chat_id:
+            self.on_complete(update.get("update_id"))
+            return
+        shard = shard_for(chat_id, self.num_shards)
+        self.unfinished[update.get("update_id")] = (shard, update)
+        self.in_queues[shard].put(update)
+
+    def _read_outbound(self):
+        while True:
+            item = self.out_queue.get()
+            if item is None:
+                return
+            self.loop.call_soon_threadsafe(self._handle_outbound, item)
+
+    def _handle_outbound(self, item):
+        kind = item[0]
+        if kind == "complete":
+            self.unfinished.pop(item[1], None)
+            self.on_complete(item[1])
+        elif kind == "action":
+            self._spawn(self.sender.send_chat_action(item[1], item[2]))
+        elif kind == "call":
+            # Ответ уходит в очередь того процесса, который спрашивал, даже если шард уже перезапущен
+            self._spawn(self._forward_call(self.resp_queues[item[1]], *item[1:]))
+        elif kind == "metrics":
+            metrics.merge(*item[1:])
+
+    async def _forward_call(self, resp_queue, shard, request_id, method, chat_id, params):
+        try:
+            result = await self.sender.call(method, chat_id, params)
+        except Exception as e:
+            logger.error(f"❌ Ошибка {method} от шарда {shard}: {e}")
+            result = None
+        resp_queue.put((request_id, result))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def join(self):
+        """Просит шарды доделать очередь и дожидается их; при отмене - убивает"""
+        self.stopping = True
+        if self.watcher is not None:
+            self.watcher.cancel()
+        for queue in self.in_queues:
+            queue.put(None)
+        try:
+            for process in self.processes:
+                while process.is_alive():
+                    await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            for process in self.processes:
+                process.terminate()
+            raise
+
+        # Дочитываем всё, что шарды успели прислать, прежде чем сохранять офсет
+        self.out_queue.put(None)
+        await asyncio.to_thread(self.reader.join)
+        await asyncio.sleep(0)
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+        for queue in self.resp_queues:
+            queue.put(None)
@@ -0,0 +1,13 @@
+# conftest.py - ОБЩЕЕ ДЛЯ ТЕСТОВ
+#
+# config.py при импорте требует токены и читает .env, а модули лежат в
+# backend/ плоско - поэтому переменные окружения и путь задаются до импорта.
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
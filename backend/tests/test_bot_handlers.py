@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+
+import bot_handlers
+from bot_handlers import ChatHandlers
+from history_store import HistoryStore
+from response_cache import ResponseCache
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        return len(self.sent)
+
+    async def edit_message(self, chat_id, message_id, text):
+        self.edits.append((chat_id, message_id, text))
+
+    async def send_chat_action(self, chat_id):
+        pass
+
+
+class FakeAssets:
+    version = 1
+
+
+def setup_handlers(monkeypatch, tmp_path, chunks, fail=True):
+    async def stream(question, chat_id=None):
+        for chunk in chunks:
+            yield chunk
+        if fail:
+            raise httpx.ReadError("обрыв соединения")
+
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    history = HistoryStore(path=tmp_path / "history.jsonl", max_messages=10, max_chars=1000,
+                           compact_min_lines=100, max_chats=10)
+    monkeypatch.setattr(bot_handlers, "STREAM_REPLIES", True)
+    monkeypatch.setattr(bot_handlers, "STREAM_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(bot_handlers, "stream_answer_simple", stream)
+    monkeypatch.setattr(bot_handlers, "response_cache", cache)
+    monkeypatch.setattr(bot_handlers, "history_store", history)
+    monkeypatch.setattr(bot_handlers, "prompt_assets", FakeAssets())
+    sender = FakeSender()
+    return ChatHandlers(sender), sender, cache, history
+
+
+def test_interrupted_stream_is_not_cached_or_remembered(monkeypatch, tmp_path):
+    handlers, sender, cache, history = setup_handlers(monkeypatch, tmp_path, ["Начало", "Начало отв"])
+
+    asyncio.run(handlers.handle_message(1, "расскажи историю"))
+    history.close()
+
+    # Обрывок остаётся в чате, но не запоминается
+    assert sender.edits[-1] == (1, 1, "Начало отв")
+    assert cache.entries == {}
+    assert history.messages(1) == []
+
+
+def test_complete_stream_is_cached_and_remembered(monkeypatch, tmp_path):
+    handlers, sender, cache, history = setup_handlers(monkeypatch, tmp_path, ["Полный", "Полный ответ"], fail=False)
+
+    asyncio.run(handlers.handle_message(1, "расскажи историю"))
+    history.close()
+
+    assert sender.edits[-1] == (1, 1, "Полный ответ")
+    assert len(cache.entries) == 1
+    assert history.messages(1)[-1] == {"role": "assistant", "content": "Полный ответ"}
@@ -0,0 +1,83 @@
+import random
+
+from dedup import Deduplicator, PackedMap, normalize, lsh_params
+
+LONG = "завтра в десять утра встречаемся у входа в парк, не забудь взять зонт и термос с чаем"
+
+
+def run(dedup, texts):
+    for text in texts:
+        dedup.observe(text)
+    return [dedup.keep(text) for text in texts]
+
+
+def test_normalize_ignores_case_punctuation_and_yo():
+    assert normalize("Всё ОК!!!  ") == normalize("все ок")
+    assert normalize("😂😂") == "😂😂"  # одни эмодзи не сливаются в пустую строку
+    assert normalize("😂") != normalize("👍")
+
+
+def test_exact_duplicates_after_normalization():
+    dedup = Deduplicator(threshold=1.0)
+    kept = run(dedup, ["Привет!", "привет", "ПРИВЕТ...", "пока"])
+    assert kept == [3, None, None, 1]
+    assert (dedup.total, dedup.unique, dedup.exact, dedup.near) == (4, 2, 2, 0)
+
+
+def test_near_duplicates_join_the_first_group():
+    dedup = Deduplicator(threshold=0.7, num_perm=128)
+    variant = LONG.replace("зонт", "зонтик")
+    other = "сегодня вечером смотрим футбол у меня дома, приходи к восьми"
+    kept = run(dedup, [LONG, variant, other, LONG])
+    assert kept == [3, None, 1, None]
+    assert (dedup.unique, dedup.exact, dedup.near) == (2, 1, 1)
+
+
+def test_exact_only_mode_keeps_near_duplicates():
+    dedup = Deduplicator(threshold=1.0)
+    kept = run(dedup, [LONG, LONG.replace("зонт", "зонтик")])
+    assert kept == [1, 1]
+
+
+def test_groups_are_stable_between_runs():
+    texts = [LONG, LONG + "!", LONG.replace("парк", "сквер"), "что-то совсем другое"]
+    first = run(Deduplicator(threshold=0.7), texts)
+    second = run(Deduplicator(threshold=0.7), texts)
+    assert first == second
+
+
+def test_unseen_text_is_kept():
+    dedup = Deduplicator()
+    dedup.observe("привет")
+    assert dedup.keep("не было в первом проходе") == 1
+
+
+def test_lsh_params_fit_signature():
+    bands, rows = lsh_params(0.9, 64)
+    assert bands * rows <= 64
+    # Высокий порог - длинные полосы, низкий - короткие
+    assert rows >= lsh_params(0.5, 64)[1]
+
+
+def test_packed_map_keeps_entries_when_growing():
+    table = PackedMap(capacity=8)
+    rng = random.Random(1)
+    keys = [rng.getrandbits(64) | 1 for _ in range(5000)]
+    keys += [keys[0] + 8, keys[0] + 16]  # одна и та же исходная ячейка
+    for value, key in enumerate(keys):
+        table.set(key, value)
+    assert len(table) == len(keys)
+    assert all(table.get(key) == value for value, key in enumerate(keys))
+    assert table.get(2) is None
+    assert table.nbytes <= 4 * 12 * len(keys)
+
+
+def test_memory_per_unique_text_is_bounded():
+    dedup = Deduplicator(threshold=0.9, num_perm=64)
+    texts = [f"сообщение номер {i}: {'текст ' * (i % 50)}" for i in range(20000)]
+    for text in texts:
+        dedup.observe(text)
+    for text in texts:
+        dedup.keep(text)
+    # Длина текстов на память не влияет: ячейки хэшей + счётчик + отметка
+    assert dedup.nbytes / dedup.unique <= 200
@@ -0,0 +1,189 @@
+import asyncio
+
+from dispatcher import UpdateDispatcher
+
+
+def update(update_id, chat_id, text):
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"username": "u"}, "text": text}}
+
+
+class Recorder:
+    """Обработчики диспетчера, которые записывают вызовы"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.answered = []
+        self.shed = []
+        self.commands = []
+        self.completed = []
+
+    async def handle_message(self, chat_id, text):
+        await asyncio.sleep(self.delays.get(text, 0))
+        self.answered.append((chat_id, text))
+
+    async def handle_shed(self, chat_id, text):
+        self.shed.append((chat_id, text))
+
+    async def handle_command(self, chat_id, text):
+        self.commands.append((chat_id, text))
+
+    def dispatcher(self, **kwargs):
+        options = {"llm_concurrency": 4, "max_depth": 100, "max_age": 60,
+                   "coalesce_window": 0, "coalesce_max_wait": 0, "coalesce_max_messages": 1}
+        options.update(kwargs)
+        return UpdateDispatcher(self.handle_command, self.handle_message, self.handle_shed,
+                                on_complete=self.completed.append, **options)
+
+
+def test_messages_of_one_chat_are_answered_in_order():
+    recorder = Recorder(delays={"a1": 0.05})
+
+    async def main():
+        dispatcher = recorder.dispatcher()
+        dispatcher.dispatch(update(1, 10, "a1"))
+        dispatcher.dispatch(update(2, 10, "a2"))
+        dispatcher.dispatch(update(3, 20, "b1"))
+        dispatcher.dispatch(update(4, 10, "a3"))
+        await dispatcher.join()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    chat_10 = [text for chat_id, text in recorder.answered if chat_id == 10]
+    assert chat_10 == ["a1", "a2", "a3"]
+    # Медленный ответ в чате 10 не задерживает чат 20
+    assert recorder.answered[0] == (20, "b1")
+    assert sorted(recorder.completed) == [1, 2, 3, 4]
+    assert dispatcher.chat_queues == {}
+    assert dispatcher.pending == 0
+
+
+def test_commands_and_empty_updates_skip_the_queue():
+    recorder = Recorder()
+
+    async def main():
+        dispatcher = recorder.dispatcher()
+        dispatcher.dispatch(update(1, 10, "/start"))
+        dispatcher.dispatch({"update_id": 2, "edited_message": {}})
+        await dispatcher.join()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert recorder.commands == [(10, "/start")]
+    assert recorder.answered == []
+    assert sorted(recorder.completed) == [1, 2]
+    assert dispatcher.pending == 0
+
+
+def test_full_queue_sheds_new_messages():
+    recorder = Recorder()
+
+    async def main():
+        dispatcher = recorder.dispatcher(max_depth=2)
+        for i, chat_id in enumerate((10, 20, 30), start=1):
+            dispatcher.dispatch(update(i, chat_id, f"m{i}"))
+        await dispatcher.join()
+
+    asyncio.run(main())
+    assert recorder.shed == [(30, "m3")]
+    assert sorted(recorder.answered) == [(10, "m1"), (20, "m2")]
+    assert sorted(recorder.completed) == [1, 2, 3]
+
+
+def test_message_that_waited_too_long_for_llm_is_shed():
+    recorder = Recorder(delays={"slow": 0.1})
+
+    async def main():
+        dispatcher = recorder.dispatcher(llm_concurrency=1, max_age=0.05)
+        dispatcher.dispatch(update(1, 10, "slow"))
+        dispatcher.dispatch(update(2, 20, "late"))
+        await dispatcher.join()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert recorder.answered == [(10, "slow")]
+    assert recorder.shed == [(20, "late")]
+    assert sorted(recorder.completed) == [1, 2]
+    assert dispatcher.pending == 0
+
+
+def test_burst_from_one_chat_is_one_llm_turn():
+    recorder = Recorder()
+
+    async def main():
+        dispatcher = recorder.dispatcher(coalesce_window=0.05, coalesce_max_wait=1, coalesce_max_messages=10)
+        dispatcher.dispatch(update(1, 10, "привет"))
+        await asyncio.sleep(0.02)
+        dispatcher.dispatch(update(2, 10, "как дела?"))
+        dispatcher.dispatch(update(3, 20, "другой чат"))
+        await dispatcher.join()
+
+    asyncio.run(main())
+    assert sorted(recorder.answered) == [(10, "привет\nкак дела?"), (20, "другой чат")]
+    assert sorted(recorder.completed) == [1, 2, 3]
+
+
+def test_coalescing_respects_max_messages():
+    recorder = Recorder()
+
+    async def main():
+        dispatcher = recorder.dispatcher(coalesce_window=0.01, coalesce_max_wait=1, coalesce_max_messages=2)
+        for i in range(1, 6):
+            dispatcher.dispatch(update(i, 10, f"m{i}"))
+        await dispatcher.join()
+
+    asyncio.run(main())
+    assert recorder.answered == [(10, "m1\nm2"), (10, "m3\nm4"), (10, "m5")]
+    assert sorted(recorder.completed) == [1, 2, 3, 4, 5]
+
+
+def test_llm_concurrency_follows_ollama_capacity(monkeypatch):
+    import dispatcher as dispatcher_module
+    from ollama_router import OllamaRouter
+
+    router = OllamaRouter([("http://ollama-a", 3), ("http://ollama-b", 2)])
+    monkeypatch.setattr(dispatcher_module.ollama, "router", router)
+    recorder = Recorder()
+
+    def build():
+        return UpdateDispatcher(recorder.handle_command, recorder.handle_message, recorder.handle_shed)
+
+    assert build().llm_concurrency == 5
+    router.share(0, 2)  # шард получает свою долю слотов серверов
+    assert build().llm_concurrency == router.capacity == 3
+
+
+def test_messages_during_generation_wait_for_the_next_turn():
+    recorder = Recorder(delays={"вопрос": 0.1})
+
+    async def main():
+        dispatcher = recorder.dispatcher(coalesce_max_messages=10)
+        dispatcher.dispatch(update(1, 10, "вопрос"))
+        await asyncio.sleep(0.03)
+        # Ответ на "вопрос" уже генерируется - в него эти сообщения не попадают
+        dispatcher.dispatch(update(2, 10, "ой, ещё"))
+        dispatcher.dispatch(update(3, 10, "и вот это"))
+        await asyncio.sleep(0.03)
+        assert recorder.completed == []
+        await dispatcher.join()
+
+    asyncio.run(main())
+    assert recorder.answered == [(10, "вопрос"), (10, "ой, ещё\nи вот это")]
+    assert recorder.completed == [1, 2, 3]
+
+
+def test_messages_while_waiting_for_llm_slot_join_the_turn():
+    recorder = Recorder(delays={"другой чат": 0.1})
+
+    async def main():
+        dispatcher = recorder.dispatcher(llm_concurrency=1, coalesce_max_messages=10)
+        dispatcher.dispatch(update(1, 20, "другой чат"))
+        await asyncio.sleep(0.01)
+        dispatcher.dispatch(update(2, 10, "привет"))
+        await asyncio.sleep(0.03)
+        # Чат 10 ещё ждёт слот LLM, генерация не началась - сообщение присоединяется
+        dispatcher.dispatch(update(3, 10, "как дела?"))
+        await dispatcher.join()
+
+    asyncio.run(main())
+    assert recorder.answered == [(20, "другой чат"), (10, "привет\nкак дела?")]
+    assert sorted(recorder.completed) == [1, 2, 3]
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, CachedEmbeddingFunction, text_key
+
+
+def vectors(n, dim=4, start=0):
+    return np.arange(start, start + n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def test_vectors_survive_reopen(tmp_path):
+    cache = EmbeddingCache("test-model", tmp_path, version="1")
+    keys = [text_key("привет"), text_key("пока")]
+    cache.append(keys, vectors(2))
+
+    reopened = EmbeddingCache("test-model", tmp_path, version="1")
+    found = reopened.lookup(keys + [text_key("нет в кэше")])
+    assert np.array_equal(found[0], vectors(2)[0])
+    assert np.array_equal(found[1], vectors(2)[1])
+    assert found[2] is None
+
+
+def test_torn_tail_is_cut_on_open(tmp_path):
+    cache = EmbeddingCache("test-model", tmp_path, version="1")
+    keys = [text_key("a"), text_key("b")]
+    cache.append(keys, vectors(2))
+    record_size = cache.dtype.itemsize
+    # Аварийная остановка посреди записи третьего вектора
+    with open(cache.path, "ab") as f:
+        f.write(text_key("c") + b"\x00" * 5)
+
+    repaired = EmbeddingCache("test-model", tmp_path, version="1")
+    assert os.path.getsize(repaired.path) == 2 * record_size
+    assert repaired.rows == 2
+    assert np.array_equal(repaired.lookup([keys[1]])[0], vectors(2)[1])
+
+    # Следующая запись встаёт на границу записи, а не после обрывка
+    repaired.append([text_key("c")], vectors(1, start=100))
+    again = EmbeddingCache("test-model", tmp_path, version="1")
+    assert again.rows == 3
+    assert np.array_equal(again.lookup([text_key("c")])[0], vectors(1, start=100)[0])
+
+
+def test_other_model_version_resets_cache(tmp_path):
+    cache = EmbeddingCache("test-model", tmp_path, version="1")
+    cache.append([text_key("a")], vectors(1))
+
+    upgraded = EmbeddingCache("test-model", tmp_path, version="2")
+    assert upgraded.rows == 0
+    assert upgraded.lookup([text_key("a")]) == [None]
+    assert not upgraded.path.exists()
+
+
+def test_appends_from_another_instance_are_picked_up(tmp_path):
+    writer = EmbeddingCache("test-model", tmp_path, version="1")
+    writer.append([text_key("a")], vectors(1))
+    reader = EmbeddingCache("test-model", tmp_path, version="1")
+    writer.append([text_key("b")], vectors(1, start=100))
+    assert np.array_equal(reader.lookup([text_key("b")])[0], vectors(1, start=100)[0])
+    assert reader.rows == 2
+
+
+def test_embedding_function_computes_only_misses(tmp_path):
+    calls = []
+
+    def model(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] * 3 for text in texts]
+
+    function = CachedEmbeddingFunction(model, EmbeddingCache("test-model", tmp_path, version="1"))
+    assert function(["aa", "b", "aa"]) == [[2.0] * 3, [1.0] * 3, [2.0] * 3]
+    assert function(["b", "ccc"]) == [[1.0] * 3, [3.0] * 3]
+    assert calls == [["aa", "b"], ["ccc"]]
+    assert (function.hits, function.misses) == (1, 3)
+
+
+def test_read_only_function_never_grows_the_file(tmp_path):
+    cache = EmbeddingCache("test-model", tmp_path, version="1")
+    cache.append([text_key("из сборки")], [[9.0] * 3])
+    size = os.path.getsize(cache.path)
+    calls = []
+
+    def model(texts):
+        calls.append(list(texts))
+        return [[float(len(text))] * 3 for text in texts]
+
+    function = CachedEmbeddingFunction(model, cache, persist=False, memory_size=2)
+    assert function(["из сборки", "вопрос"]) == [[9.0] * 3, [6.0] * 3]
+    function(["вопрос"])  # из памяти
+    function(["a", "b"])  # вытесняют "вопрос"
+    function(["вопрос"])
+    assert calls == [["вопрос"], ["a", "b"], ["вопрос"]]
+    assert os.path.getsize(cache.path) == size
+    assert len(function.recent) == 2
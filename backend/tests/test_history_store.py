@@ -0,0 +1,71 @@
+import json
+
+from history_store import HistoryStore
+
+
+def make_store(path, **kwargs):
+    options = {"max_messages": 4, "max_chars": 1000, "compact_min_lines": 10, "max_chats": 100}
+    options.update(kwargs)
+    return HistoryStore(path=path, **options)
+
+
+def test_history_survives_restart(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    store.add_turn(1, "привет", "здорово")
+    store.add_turn(2, "как дела?", "норм")
+    store.add_turn(1, "что делаешь?", "пишу код")
+    store.clear(2)
+    store.close()
+
+    restored = make_store(path)
+    restored.load()
+    assert restored.messages(1) == [
+        {"role": "user", "content": "привет"},
+        {"role": "assistant", "content": "здорово"},
+        {"role": "user", "content": "что делаешь?"},
+        {"role": "assistant", "content": "пишу код"},
+    ]
+    assert restored.messages(2) == []
+    restored.close()
+
+
+def test_replay_skips_torn_last_line(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    store.add_turn(1, "вопрос", "ответ")
+    store.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"chat_id": 1, "role": "us')  # аварийная остановка посреди записи
+
+    restored = make_store(path)
+    assert [m["content"] for m in restored.messages(1)] == ["вопрос", "ответ"]
+    restored.close()
+
+
+def test_compaction_rewrites_log_to_live_turns(tmp_path):
+    path = tmp_path / "history.jsonl"
+    store = make_store(path)
+    for i in range(20):
+        store.add_turn(1, f"вопрос {i}", f"ответ {i}")
+    store.close()  # дожидается потока записи
+
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    # В журнале не больше порога компакции, и последние реплики на месте
+    assert len(lines) <= 10
+    assert lines[-1] == {"chat_id": 1, "role": "assistant", "content": "ответ 19"}
+
+    restored = make_store(path)
+    assert [m["content"] for m in restored.messages(1)] == ["вопрос 18", "ответ 18", "вопрос 19", "ответ 19"]
+    restored.close()
+
+
+def test_old_chats_are_evicted(tmp_path):
+    store = make_store(tmp_path / "history.jsonl", max_chats=3)
+    for chat_id in range(5):
+        store.add_turn(chat_id, "вопрос", "ответ")
+    store.add_turn(2, "ещё вопрос", "ещё ответ")
+    store.add_turn(5, "вопрос", "ответ")
+    assert list(store.chats) == [4, 2, 5]
+    assert store.live == sum(len(buffer) for buffer in store.chats.values())
+    store.close()
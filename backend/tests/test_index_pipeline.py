@@ -0,0 +1,104 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index_pipeline
+from embedding_cache import EmbeddingCache, text_key
+from index_pipeline import EmbeddingPipeline
+
+
+class StubModel:
+    """Вместо SentenceTransformer: вектор из длины текста, случайная задержка"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.texts = []
+
+    def encode(self, texts, convert_to_numpy=True):
+        self.texts.extend(texts)
+        time.sleep(random.uniform(0, 0.02))  # батчи готовы не по порядку
+        if self.fail_on in texts:
+            raise RuntimeError(f"не посчитать {self.fail_on}")
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class ThreadPool(ThreadPoolExecutor):
+    """Пул процессов в тесте не нужен: те же вызовы в потоках"""
+
+    def __init__(self, max_workers, mp_context=None, initializer=None, initargs=()):
+        super().__init__(max_workers=max_workers)
+
+
+def make_batches(count, size=3):
+    batches = []
+    for b in range(count):
+        ids = [f"{b}-{i}" for i in range(size)]
+        batches.append((ids, ["x" * (b * size + i + 1) for i in range(size)], [{"batch": b}] * size))
+    return batches
+
+
+def use_stub(monkeypatch, model):
+    monkeypatch.setattr(index_pipeline, "ProcessPoolExecutor", ThreadPool)
+    monkeypatch.setattr(index_pipeline, "_model", model)
+
+
+def test_every_batch_is_written_in_order(monkeypatch):
+    use_stub(monkeypatch, StubModel())
+    batches = make_batches(12)
+    batches.insert(5, (["meta"], None, [{"only": "metadata"}]))
+    written = []
+
+    def write(ids, documents, metadatas, embeddings):
+        written.append((ids, embeddings))
+
+    pipeline = EmbeddingPipeline(workers=3, queue_size=2)
+    pipeline.run(iter(batches), write)
+
+    # Одна запись на батч, в исходном порядке, векторы от своих текстов
+    assert [ids for ids, _ in written] == [ids for ids, _, _ in batches]
+    assert written[5] == (["meta"], None)
+    for (ids, documents, _), (_, embeddings) in zip(batches, written):
+        if documents is not None:
+            assert embeddings == [[float(len(text)), 1.0] for text in documents]
+    assert pipeline.written.docs == 36
+    assert pipeline.embedded.docs == 36
+
+
+def test_cached_vectors_skip_the_workers(monkeypatch, tmp_path):
+    model = StubModel()
+    use_stub(monkeypatch, model)
+    cache = EmbeddingCache("test-model", tmp_path, version="1")
+    cache.append([text_key("x")], [[100.0, 1.0]])
+    written = []
+
+    pipeline = EmbeddingPipeline(workers=2, cache=cache)
+    pipeline.run(make_batches(2), lambda ids, documents, metadatas, embeddings: written.append(embeddings))
+
+    assert written[0][0] == [100.0, 1.0]
+    assert "x" not in model.texts
+    assert (pipeline.cached.docs, pipeline.embedded.docs) == (1, 5)
+    # Посчитанное попало в кэш
+    assert cache.lookup([text_key("xxxxxx")])[0].tolist() == [6.0, 1.0]
+
+
+def test_worker_error_is_raised(monkeypatch):
+    use_stub(monkeypatch, StubModel(fail_on="x" * 10))
+    written = []
+
+    with pytest.raises(RuntimeError, match="не посчитать"):
+        EmbeddingPipeline(workers=2, queue_size=1).run(
+            make_batches(10), lambda ids, documents, metadatas, embeddings: written.append(ids)
+        )
+    # Батчи до сбойного записаны, после него - нет
+    assert written == [ids for ids, _, _ in make_batches(3)]
+
+
+def test_writer_error_is_raised():
+    def write(ids, documents, metadatas, embeddings):
+        raise OSError("диск заполнен")
+
+    pipeline = EmbeddingPipeline(workers=0, queue_size=1, local_embed=lambda texts: [[1.0]] * len(texts))
+    with pytest.raises(OSError, match="диск заполнен"):
+        pipeline.run(make_batches(20), write)
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import llm_generator_final
+from prompt_assembler import AssembledPrompt
+from retry_policy import RetryableError
+from test_ollama_router import fake_cluster
+
+
+async def collect(question, texts=None):
+    texts = [] if texts is None else texts
+    async for text in llm_generator_final.stream_answer_simple(question):
+        texts.append(text)
+    return texts
+
+
+def setup_stream(monkeypatch, client):
+    async def build_prompt(question, chat_id=None):
+        return AssembledPrompt([{"role": "user", "content": question}], {}, 2048)
+
+    monkeypatch.setattr(llm_generator_final, "build_prompt", build_prompt)
+    monkeypatch.setattr(llm_generator_final, "ollama", client)
+
+
+def test_stream_yields_growing_answer(monkeypatch, tmp_path):
+    async def main():
+        async with fake_cluster(tmp_path, 1, latency=0, load_time=0) as (client, fakes):
+            setup_stream(monkeypatch, client)
+            return await collect("как дела")
+
+    texts = asyncio.run(main())
+    assert texts[-1] == "Это ollama-0. Ты спросил: как дела"
+    assert all(len(text) >= llm_generator_final.MIN_ANSWER_LENGTH for text in texts)
+    assert texts == sorted(texts, key=len)
+
+
+@pytest.mark.parametrize("answer", ["", "  ", "Ок"])
+def test_empty_or_too_short_stream_is_retryable(monkeypatch, tmp_path, answer):
+    texts = []
+
+    async def main():
+        async with fake_cluster(tmp_path, 1, latency=0, load_time=0) as (client, fakes):
+            fakes[0].answer = lambda prompt: answer
+            setup_stream(monkeypatch, client)
+            await collect("как дела", texts)
+
+    with pytest.raises(RetryableError):
+        asyncio.run(main())
+    # Ничего не отдано: вызывающий уйдёт на обычный путь с повторами
+    assert texts == []
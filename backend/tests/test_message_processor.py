@@ -0,0 +1,29 @@
+from build_vector_db_fixed import MessageProcessor, VectorIndexer
+
+
+def prepared(messages):
+    stats = MessageProcessor.new_stats()
+    return {
+        VectorIndexer.doc_id(text): metadata
+        for _, text, metadata in MessageProcessor.iter_prepared(messages, stats)
+    }
+
+
+def test_metadata_does_not_depend_on_position():
+    messages = [
+        {"text": f"сообщение номер {i}", "date": f"2024-01-{i + 1:02d}T10:00:00", "chat_title": "Друзья", "message_id": i}
+        for i in range(10)
+    ]
+    before = prepared(messages)
+    # Удалили одно сообщение в начале и вставили новое - остальные не должны измениться
+    after = prepared([{"text": "новое сообщение", "message_id": 100}] + messages[1:])
+
+    unchanged = set(before) & set(after)
+    assert len(unchanged) == 9
+    assert all(before[doc_id] == after[doc_id] for doc_id in unchanged)
+    assert after[VectorIndexer.doc_id("сообщение номер 3")]["message_id"] == 3
+
+
+def test_plain_strings_get_only_length_metadata():
+    (metadata,) = prepared(["просто текст"]).values()
+    assert metadata == {"message_length": len("просто текст"), "processed": True}
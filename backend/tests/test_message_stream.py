@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import message_stream
+from message_stream import iter_messages, JsonArrayWriter
+
+MESSAGES = [
+    {"text": "привет 👋", "date": "2021-05-01T10:00:00", "id": 12345},
+    {"text": "цитата: \"в кавычках\", [скобки] и {фигурные}", "id": 7, "score": -0.25},
+    {"text": "", "id": 1000000, "forwarded": False, "reply_to": None},
+    {"text": ["составной ", {"type": "bold", "text": "текст"}], "id": 3e5},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 20])
+def test_list_is_parsed_across_chunk_boundaries(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(message_stream, "CHUNK_SIZE", chunk_size)
+    path = tmp_path / "user_messages.json"
+    path.write_text(json.dumps(MESSAGES, ensure_ascii=False, indent=2), encoding="utf-8")
+    assert list(iter_messages(path)) == MESSAGES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1 << 20])
+def test_dict_of_lists_is_flattened(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(message_stream, "CHUNK_SIZE", chunk_size)
+    path = tmp_path / "user_messages.json"
+    data = {"Чат 1": MESSAGES[:2], "пустой": [], "не список": {"x": 1}, "Чат 2": MESSAGES[2:]}
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    assert list(iter_messages(path)) == MESSAGES
+
+
+def test_top_level_numbers_split_by_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_stream, "CHUNK_SIZE", 2)
+    path = tmp_path / "numbers.json"
+    path.write_text("[12345, 6.75e2 ,true,null, -98]", encoding="utf-8")
+    assert list(iter_messages(path)) == [12345, 675.0, True, None, -98]
+
+
+def test_empty_containers(tmp_path):
+    for text in ("[]", " [ ] ", "{}", ""):
+        path = tmp_path / "empty.json"
+        path.write_text(text, encoding="utf-8")
+        assert list(iter_messages(path)) == []
+
+
+def test_truncated_file_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_stream, "CHUNK_SIZE", 4)
+    path = tmp_path / "user_messages.json"
+    path.write_text(json.dumps(MESSAGES, ensure_ascii=False)[:-20], encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_messages(path))
+
+
+def test_jsonl_skips_broken_lines(tmp_path):
+    path = tmp_path / "user_messages.jsonl"
+    lines = [json.dumps(m, ensure_ascii=False) for m in MESSAGES[:2]]
+    path.write_text(lines[0] + "\n{обрыв\n\n" + lines[1] + "\n", encoding="utf-8")
+    assert list(iter_messages(path)) == MESSAGES[:2]
+
+
+def test_writer_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_stream, "CHUNK_SIZE", 3)
+    path = tmp_path / "cleaned.json"
+    with JsonArrayWriter(path) as writer:
+        for message in MESSAGES:
+            writer.write(message)
+    assert writer.count == len(MESSAGES)
+    assert json.loads(path.read_text(encoding="utf-8")) == MESSAGES
+    assert list(iter_messages(path)) == MESSAGES
+
+    with JsonArrayWriter(path):
+        pass
+    assert json.loads(path.read_text(encoding="utf-8")) == []
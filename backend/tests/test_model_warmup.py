@@ -0,0 +1,52 @@
+import asyncio
+
+import model_warmup
+from prompt_assembler import PromptAssembler, TokenCounter
+from prompt_assets import PromptAsset
+
+SYSTEM_PROMPT = "Ты - это я. Отвечай коротко и по-дружески."
+PROFILE = {"personal": {"location": "Казань"}, "hobbies": {"games": ["шахматы"]}}
+
+
+class FakeAssets:
+    def get(self):
+        return PromptAsset(SYSTEM_PROMPT, {"user_profile": PROFILE}, version=1)
+
+
+class FakeBackend:
+    index = 0
+    url = "http://ollama-a"
+
+
+class FakeClient:
+    model = "mistral:7b"
+
+    def __init__(self):
+        self.chats = []
+
+    async def generate(self, prompt, **kwargs):
+        return {"load_duration": 0}
+
+    async def chat(self, messages, **kwargs):
+        self.chats.append(messages)
+        return {"message": {"content": "."}}
+
+
+def test_warm_prompt_shares_prefix_with_real_prompt(monkeypatch):
+    assembler = PromptAssembler(counter=TokenCounter(remote_min_chars=10 ** 9))
+    monkeypatch.setattr(model_warmup, "prompt_assets", FakeAssets())
+    monkeypatch.setattr(model_warmup, "prompt_assembler", assembler)
+    client = FakeClient()
+    warmup = model_warmup.ModelWarmup(client=client)
+
+    assert asyncio.run(warmup.warm(FakeBackend(), "старт"))
+
+    real = asyncio.run(assembler.assemble(
+        SYSTEM_PROMPT, "как прошли выходные?", documents=["ездил на дачу"], profile=PROFILE,
+    ))
+    warm_system = client.chats[0][0]["content"]
+    real_system = real.messages[0]["content"]
+    # Совпадает всё до первого найденного сообщения: system prompt, факты, заголовок блока
+    shared = warm_system[:warm_system.index(f"- {model_warmup.WARMUP_DOCUMENT}")]
+    assert real_system.startswith(shared)
+    assert "Казань" in shared and "Твои реальные сообщения" in shared
@@ -0,0 +1,195 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+import fake_ollama
+from http_clients import close_async_clients
+from llm_scheduler import BACKGROUND, INTERACTIVE, ActivityBeacon, BackgroundSlots
+from ollama_client import OllamaClient
+from ollama_router import NoHealthyBackend, OllamaRouter
+
+
+def make_router(tmp_path, limit=4):
+    router = OllamaRouter([("http://ollama-a", limit)])
+    router.beacon = ActivityBeacon(path=tmp_path / "llm_interactive.stamp", grace=0.3)
+    router.background_slots = BackgroundSlots(directory=tmp_path, share=0.5)
+    router._ensure_health_task = lambda: None  # без HTTP-проверок здоровья
+    return router
+
+
+def test_interactive_goes_before_queued_background(tmp_path):
+    async def main():
+        router = make_router(tmp_path, limit=2)
+        held = [await router.acquire("m"), await router.acquire("m")]
+        order = []
+
+        async def request(name, priority):
+            backend = await router.acquire("m", priority)
+            order.append(name)
+            await router.release(backend, priority=priority)
+
+        background = asyncio.create_task(request("background", BACKGROUND))
+        await asyncio.sleep(0.05)
+        interactive = asyncio.create_task(request("interactive", INTERACTIVE))
+        await asyncio.sleep(0.05)
+        # Чат только что отвечал - ждём, пока отметка остынет
+        await asyncio.sleep(router.beacon.grace)
+        for backend in held:
+            await router.release(backend)
+        await asyncio.wait_for(asyncio.gather(background, interactive), 5)
+        assert order == ["interactive", "background"]
+
+    asyncio.run(main())
+
+
+def test_background_share_holds_across_processes(tmp_path):
+    async def main():
+        # Два роутера с общими файлами слотов - как бот и пересборка базы
+        bot, builder = make_router(tmp_path), make_router(tmp_path)
+        first = await bot.acquire("m", BACKGROUND)
+        second = await builder.acquire("m", BACKGROUND)
+
+        waiter = asyncio.create_task(builder.acquire("m", BACKGROUND))
+        await asyncio.sleep(0.3)
+        assert not waiter.done()  # 2 из 4 слотов - вся фоновая доля
+
+        await bot.release(first, priority=BACKGROUND)
+        third = await asyncio.wait_for(waiter, 2)
+        await builder.release(second, priority=BACKGROUND)
+        await builder.release(third, priority=BACKGROUND)
+        assert builder.backends[0].inflight == 0
+        assert builder.backends[0].slot_handles == []
+
+    asyncio.run(main())
+
+
+def test_background_rechecks_chat_activity_when_granted(tmp_path):
+    async def main():
+        router = make_router(tmp_path, limit=1)
+        held = await router.acquire("m", BACKGROUND)
+        waiter = asyncio.create_task(router.acquire("m", BACKGROUND))
+        await asyncio.sleep(0.05)
+
+        # Пока фоновый запрос стоял в очереди, бот начал отвечать в чате
+        router.beacon.path.touch()
+        await router.release(held, priority=BACKGROUND)
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        assert router.backends[0].inflight == 0
+
+        # Освободившийся слот достаётся чату без ожидания
+        chat = await asyncio.wait_for(router.acquire("m"), 0.5)
+        await router.release(chat)
+
+        backend = await asyncio.wait_for(waiter, 5)
+        await router.release(backend, priority=BACKGROUND)
+
+    asyncio.run(main())
+
+
+def test_cancelled_background_waiter_leaks_no_slot(tmp_path):
+    async def main():
+        router = make_router(tmp_path, limit=2)
+        held = await router.acquire("m", BACKGROUND)
+        waiter = asyncio.create_task(router.acquire("m", BACKGROUND))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await router.release(held, priority=BACKGROUND)
+        assert router.backends[0].inflight == 0
+        assert router.backends[0].background == 0
+
+    asyncio.run(main())
+
+
+@asynccontextmanager
+async def fake_cluster(tmp_path, count, **options):
+    """count поддельных серверов Ollama и клиент, который ходит к ним через роутер"""
+    fakes, servers = [], []
+    for i in range(count):
+        fake = fake_ollama.FakeOllama(f"ollama-{i}", **options)
+        server, task = await fake_ollama.serve(fake, port=0)
+        fakes.append(fake)
+        servers.append((server, task))
+    urls = [f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}" for server, _ in servers]
+    router = OllamaRouter([(url, 1) for url in urls], health_interval=60, unhealthy_after=2)
+    router.beacon = ActivityBeacon(path=tmp_path / "llm_interactive.stamp")
+    router.background_slots = BackgroundSlots(directory=tmp_path, share=0.5)
+    router._ensure_health_task = lambda: None  # проверки здоровья тест вызывает сам
+    try:
+        yield OllamaClient(router=router, model="mistral:7b"), fakes
+    finally:
+        await close_async_clients()
+        for server, task in servers:
+            server.should_exit = True
+            await task
+
+
+def ask(client, text, **kwargs):
+    return client.chat([{"role": "user", "content": text}], **kwargs)
+
+
+def test_requests_are_spread_across_servers(tmp_path):
+    async def main():
+        async with fake_cluster(tmp_path, 2, latency=0.05, load_time=0) as (client, fakes):
+            answers = await asyncio.gather(*(ask(client, f"вопрос {i}") for i in range(8)))
+            assert len(answers) == 8
+            # Лимит 1 на сервер: оба заняты параллельно, ни один не перегружен
+            counts = [fake.calls["/api/chat"] for fake in fakes]
+            assert sum(counts) == 8 and min(counts) > 0
+            assert [fake.max_active for fake in fakes] == [1, 1]
+            assert all(backend.inflight == 0 for backend in client.router.backends)
+
+    asyncio.run(main())
+
+
+def test_failing_server_is_drained_and_traffic_fails_over(tmp_path):
+    async def main():
+        async with fake_cluster(tmp_path, 2, latency=0, load_time=0) as (client, fakes):
+            broken, good = client.router.backends
+            broken.loaded.add(client.model)  # без сбоев запросы шли бы на первый сервер
+            fakes[0].healthy = False
+            errors = 0
+            for i in range(10):
+                try:
+                    await ask(client, f"вопрос {i}")
+                except Exception:
+                    errors += 1
+            assert not broken.healthy
+            assert good.healthy
+            # Ровно unhealthy_after ошибок, дальше всё идёт на живой сервер
+            assert errors == client.router.unhealthy_after
+            assert fakes[1].calls["/api/chat"] == 10 - errors
+
+            # Сервер ожил - проверка здоровья возвращает его в ротацию
+            fakes[0].healthy = True
+            await client.router.check_health()
+            assert broken.healthy
+
+    asyncio.run(main())
+
+
+def test_drained_server_finishes_started_requests(tmp_path):
+    async def main():
+        async with fake_cluster(tmp_path, 2, latency=0, load_time=0.3) as (client, fakes):
+            first = client.router.backends[0]
+            started = asyncio.create_task(ask(client, "долгий", backend=first))
+            await asyncio.sleep(0.1)
+
+            # Проверка здоровья выводит сервер из ротации посреди запроса
+            fakes[0].healthy = False
+            await client.router.check_health()
+            assert not first.healthy
+
+            answer = await started
+            assert "ollama-0" in answer["message"]["content"]
+            assert first.inflight == 0
+
+            # Новые запросы идут на второй сервер, явный запрос к выведенному - ошибка
+            answer = await ask(client, "новый")
+            assert "ollama-1" in answer["message"]["content"]
+            with pytest.raises(NoHealthyBackend):
+                await ask(client, "туда же", backend=first)
+
+    asyncio.run(main())
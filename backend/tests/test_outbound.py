@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import outbound
+from outbound import OutboundSender, TokenBucket
+
+
+class FakeResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeTelegram:
+    """Отвечает заданными ответами по порядку и запоминает время вызовов"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def post(self, url, data=None):
+        self.calls.append((url.rsplit("/", 1)[-1], data.get("chat_id"), time.monotonic()))
+        if self.responses:
+            return self.responses.pop(0)
+        return FakeResponse(200, {"ok": True, "result": {"message_id": len(self.calls)}})
+
+
+def too_many_requests(retry_after):
+    return FakeResponse(429, {"ok": False, "parameters": {"retry_after": retry_after}})
+
+
+def make_sender(monkeypatch, telegram, attempts=5):
+    monkeypatch.setattr(outbound, "get_async_client", lambda name: telegram)
+    monkeypatch.setattr(outbound, "TELEGRAM_CHAT_RATE", 1000)
+    monkeypatch.setattr(outbound, "TELEGRAM_MAX_SEND_ATTEMPTS", attempts)
+    return OutboundSender("http://telegram.test/botTOKEN")
+
+
+def test_token_bucket_spaces_out_acquires():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Два токена есть сразу, ещё два приходят за 2 * 1/20 сек
+    elapsed = asyncio.run(main())
+    assert 0.09 <= elapsed < 0.5
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=1000, capacity=3)
+    bucket.tokens = 0
+    time.sleep(0.02)
+    assert bucket.is_full()
+    assert bucket.tokens == 3
+
+
+def test_429_blocks_chat_for_retry_after(monkeypatch):
+    telegram = FakeTelegram([too_many_requests(0.2)])
+    sender = make_sender(monkeypatch, telegram)
+
+    async def main():
+        return await sender.send_message(1, "привет")
+
+    assert asyncio.run(main()) == 2
+    (_, _, first), (_, _, second) = telegram.calls
+    assert second - first >= 0.2
+
+
+def test_429_in_one_chat_does_not_delay_others(monkeypatch):
+    telegram = FakeTelegram([too_many_requests(0.3)])
+    sender = make_sender(monkeypatch, telegram)
+
+    async def main():
+        blocked = asyncio.create_task(sender.send_message(1, "первый"))
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        await sender.send_message(2, "второй")
+        other_elapsed = time.monotonic() - started
+        await blocked
+        return other_elapsed
+
+    assert asyncio.run(main()) < 0.2
+    assert [chat_id for _, chat_id, _ in telegram.calls] == [1, 2, 1]
+
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    telegram = FakeTelegram([too_many_requests(0.01)] * 3)
+    sender = make_sender(monkeypatch, telegram, attempts=3)
+
+    async def main():
+        return await sender.send_message(1, "привет")
+
+    assert asyncio.run(main()) is None
+    assert len(telegram.calls) == 3
@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+
+from config import PROMPT_MAX_CTX
+from prompt_assembler import PromptAssembler, TokenCounter
+
+
+class FakeClient:
+    """tokenize по словам; supported=False - как Ollama без /api/tokenize"""
+
+    def __init__(self, supported=True):
+        self.supported = supported
+        self.calls = 0
+
+    async def tokenize(self, text, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if not self.supported:
+            request = httpx.Request("POST", "http://ollama/api/tokenize")
+            raise httpx.HTTPStatusError("404", request=request, response=httpx.Response(404, request=request))
+        return text.split()
+
+
+def test_short_items_are_estimated_without_http():
+    client = FakeClient()
+    counter = TokenCounter(client=client, chars_per_token=2.5, remote_min_chars=1000)
+    counts = asyncio.run(counter.count_many(["привет как дела"] * 20 + ["короткий документ"] * 20))
+    assert client.calls == 0
+    assert counts[0] == 6  # 15 символов / 2.5
+
+
+def test_long_text_is_tokenized_once_and_cached():
+    client = FakeClient()
+    counter = TokenCounter(client=client, remote_min_chars=100)
+    system_prompt = "слово " * 200
+
+    async def main():
+        return [await counter.count(system_prompt) for _ in range(5)]
+
+    assert asyncio.run(main()) == [200] * 5
+    assert client.calls == 1
+
+
+def test_missing_tokenize_is_probed_once():
+    client = FakeClient(supported=False)
+    counter = TokenCounter(client=client, remote_min_chars=10)
+    texts = [f"длинный текст номер {i} " * 5 for i in range(10)]
+
+    async def main():
+        # Одновременные подсчёты не должны засыпать сервер запросами
+        await asyncio.gather(*(counter.count(text) for text in texts))
+        await counter.count_many(texts[::-1])
+
+    asyncio.run(main())
+    assert client.calls == 1
+    assert counter.remote is False
+
+
+def test_num_ctx_is_fixed_for_any_prompt_size():
+    assembler = PromptAssembler(counter=TokenCounter(client=FakeClient(), remote_min_chars=10 ** 9))
+
+    async def main():
+        small = await assembler.assemble("Ты - это я.", "привет")
+        large = await assembler.assemble(
+            "Ты - это я. " * 200, "расскажи подробно " * 50,
+            history=[{"role": "user", "content": "реплика " * 50}, {"role": "assistant", "content": "ответ " * 50}] * 5,
+            documents=["документ " * 30] * 10,
+        )
+        return small, large
+
+    small, large = asyncio.run(main())
+    assert small.num_ctx == large.num_ctx == PROMPT_MAX_CTX
+    assert large.total <= PROMPT_MAX_CTX - assembler.num_predict
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from prompt_assets import PromptAssetManager
+from response_cache import ResponseCache
+
+
+def write_prompt(path, system_prompt):
+    path.write_text(json.dumps({"system_prompt": system_prompt}, ensure_ascii=False), encoding="utf-8")
+
+
+def test_edited_file_is_picked_up(tmp_path):
+    path = tmp_path / "prompt_template.json"
+    write_prompt(path, "Ты - старый промт")
+    assets = PromptAssetManager(path=path, check_interval=0)
+    old = assets.get()
+    assert old.system_prompt == "Ты - старый промт"
+
+    write_prompt(path, "Ты - новый промт, длиннее старого")
+    new = assets.get()
+    assert new.system_prompt == "Ты - новый промт, длиннее старого"
+    assert new.version != old.version
+    assert assets.version == new.version
+    # Ответы, закэшированные под старым промтом, с новым не выдаются
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+
+    async def main():
+        await cache.get_or_generate("привет", old.version, lambda: asyncio.sleep(0, "старый"))
+        return await cache.get_or_generate("привет", assets.version, lambda: asyncio.sleep(0, "новый"))
+
+    assert asyncio.run(main()) == ("новый", "generated")
+
+
+def test_file_is_checked_at_most_once_per_interval(tmp_path):
+    path = tmp_path / "prompt_template.json"
+    write_prompt(path, "Первый")
+    assets = PromptAssetManager(path=path, check_interval=60)
+    version = assets.version
+
+    write_prompt(path, "Второй, уже другой")
+    assert assets.version == version
+    assets._last_check = 0.0  # интервал прошёл
+    assert assets.get().system_prompt == "Второй, уже другой"
+
+
+def test_broken_edit_keeps_previous_version(tmp_path):
+    path = tmp_path / "prompt_template.json"
+    write_prompt(path, "Рабочий промт")
+    assets = PromptAssetManager(path=path, check_interval=0)
+    version = assets.version
+
+    path.write_text('{"system_prompt": "недописан', encoding="utf-8")
+    assert assets.version == version
+    write_prompt(path, "")
+    assert assets.get().system_prompt == "Рабочий промт"
+
+    # Исправленный файл подхватывается
+    write_prompt(path, "Рабочий промт v2")
+    assert assets.get().system_prompt == "Рабочий промт v2"
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache, PartialAnswer, normalize_question
+
+
+class Generator:
+    """generate() для кэша: считает вызовы, может ждать сигнала"""
+
+    def __init__(self, answer="ответ", delay=0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.answer
+
+
+def test_exact_hit_after_normalization():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    generate = Generator()
+
+    async def main():
+        first = await cache.get_or_generate("Привет!!", "v1", generate)
+        second = await cache.get_or_generate("привет", "v1", generate)
+        other_version = await cache.get_or_generate("привет", "v2", generate)
+        other_context = await cache.get_or_generate("привет", "v1", generate, context="ctx")
+        return first, second, other_version, other_context
+
+    first, second, other_version, other_context = asyncio.run(main())
+    assert first == ("ответ", "generated")
+    assert second == ("ответ", "cache")
+    assert other_version[1] == other_context[1] == "generated"
+    assert generate.calls == 3
+    assert normalize_question("  Всё ОК?! ") == "все ок"
+
+
+def test_expired_entry_is_regenerated():
+    cache = ResponseCache(max_entries=10, ttl=0.05, semantic=False)
+    generate = Generator()
+
+    async def main():
+        await cache.get_or_generate("вопрос", "v1", generate)
+        await asyncio.sleep(0.06)
+        return await cache.get_or_generate("вопрос", "v1", generate)
+
+    assert asyncio.run(main()) == ("ответ", "generated")
+    assert generate.calls == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl=60, semantic=False)
+    generate = Generator()
+
+    async def main():
+        await cache.get_or_generate("a", "v1", generate)
+        await cache.get_or_generate("b", "v1", generate)
+        await cache.get_or_generate("a", "v1", generate)  # a свежее b
+        await cache.get_or_generate("c", "v1", generate)  # вытесняет b
+        return [(await cache.get_or_generate(q, "v1", generate))[1] for q in ("a", "c", "b")]
+
+    assert asyncio.run(main()) == ["cache", "cache", "generated"]
+    assert len(cache.entries) == 2
+
+
+def test_semantic_tier_respects_threshold():
+    vectors = {"как дела": [1.0, 0.0], "как ты": [0.95, 0.31], "что ешь": [0.0, 1.0]}
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=True, threshold=0.9,
+                          embed=lambda texts: [vectors[text] for text in texts])
+    generate = Generator()
+
+    async def main():
+        await cache.get_or_generate("как дела", "v1", generate)
+        close = await cache.get_or_generate("как ты", "v1", generate)
+        far = await cache.get_or_generate("что ешь", "v1", generate)
+        other_version = await cache.get_or_generate("как ты", "v2", generate)
+        return close, far, other_version
+
+    close, far, other_version = asyncio.run(main())
+    assert close == ("ответ", "cache")
+    assert far[1] == "generated"
+    assert other_version[1] == "generated"
+
+
+def test_concurrent_questions_share_one_generation():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    generate = Generator(delay=0.05)
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_generate("вопрос", "v1", generate) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert generate.calls == 1
+    assert sorted(source for _, source in results) == ["generated", "shared", "shared"]
+    assert cache.inflight == {}
+
+
+def test_follower_generates_itself_when_leader_is_cancelled():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    generate = Generator(delay=0.05)
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_generate("вопрос", "v1", generate))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_generate("вопрос", "v1", generate))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == ("ответ", "generated")
+    assert generate.calls == 2
+
+
+def test_partial_answer_is_neither_cached_nor_shared():
+    cache = ResponseCache(max_entries=10, ttl=60, semantic=False)
+    broken = Generator(answer=PartialAnswer("начало отв"), delay=0.05)
+    complete = Generator()
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_generate("вопрос", "v1", broken))
+        await asyncio.sleep(0.01)
+        follower = await cache.get_or_generate("вопрос", "v1", complete)
+        return await leader, follower, await cache.get_or_generate("вопрос", "v1", complete)
+
+    leader, follower, later = asyncio.run(main())
+    assert leader == ("начало отв", "generated")
+    assert follower == ("ответ", "generated")
+    assert later[1] == "generated"
+    assert complete.calls == 2
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from retry_policy import RetryPolicy, RetryableError, CircuitBreaker, CircuitOpenError, DeadlineExceeded
+
+
+def make_policy(**kwargs):
+    options = {"deadline": 1.0, "max_attempts": 3, "base_delay": 0.01, "max_delay": 0.01}
+    options.update(kwargs)
+    return RetryPolicy("test", **options)
+
+
+def test_retries_transient_errors_until_success():
+    timeouts = []
+
+    async def attempt(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) < 3:
+            raise RetryableError("пустой ответ")
+        return "ответ"
+
+    assert asyncio.run(make_policy(attempt_timeout=0.5).run(attempt)) == "ответ"
+    assert len(timeouts) == 3
+    assert all(timeout <= 0.5 for timeout in timeouts)
+
+
+def test_non_retryable_error_is_raised_at_once():
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        raise ValueError("ошибка в коде")
+
+    with pytest.raises(ValueError):
+        asyncio.run(make_policy().run(attempt))
+    assert len(calls) == 1
+
+
+def test_deadline_bounds_all_attempts():
+    async def attempt(timeout):
+        await asyncio.sleep(10)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(make_policy(deadline=0.1).run(attempt))
+    assert time.monotonic() - started < 1
+
+
+def test_attempt_timeout_shrinks_to_remaining_deadline():
+    timeouts = []
+
+    async def attempt(timeout):
+        timeouts.append(timeout)
+        await asyncio.sleep(0.06)
+        raise RetryableError("пустой ответ")
+
+    with pytest.raises((RetryableError, DeadlineExceeded)):
+        asyncio.run(make_policy(deadline=0.1, attempt_timeout=5).run(attempt))
+    assert timeouts[0] <= 0.1
+    assert all(later < timeouts[0] for later in timeouts[1:])
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    failure = httpx.ConnectError("нет соединения")
+
+    breaker.record(failure)
+    assert breaker.state == "closed"
+    breaker.record()  # успех обнуляет счётчик
+    breaker.record(failure)
+    assert breaker.state == "closed"
+    breaker.record(failure)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_client_errors_do_not_trip_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record(RetryableError("пустой ответ"))
+    breaker.record(ValueError("ошибка в коде"))
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record(httpx.ConnectError("нет соединения"))
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.check()  # пробный запрос
+    with pytest.raises(CircuitOpenError):
+        breaker.check()  # остальные ждут его результата
+
+    # Неудачная проба снова размыкает предохранитель
+    breaker.record(httpx.ConnectError("нет соединения"))
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    breaker.check()
+    breaker.record()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_policy_fails_fast_while_breaker_is_open():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    calls = []
+
+    async def attempt(timeout):
+        calls.append(timeout)
+        raise httpx.ConnectError("нет соединения")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(make_policy(max_attempts=5, breaker=breaker).run(attempt))
+    assert len(calls) == 2
@@ -0,0 +1,106 @@
+import pytest
+
+import sharding
+from llm_scheduler import split_slots
+from metrics import Metrics
+from ollama_router import OllamaRouter
+from sharding import ShardRouter, shard_for
+
+
+@pytest.mark.parametrize("total", [1, 2, 5, 8])
+@pytest.mark.parametrize("parts", [1, 2, 3, 4])
+def test_split_slots_never_exceeds_total(total, parts):
+    shares = [split_slots(total, parts, part) for part in range(parts)]
+    assert sum(shares) == total
+    assert max(shares) - min(shares) <= 1
+
+
+@pytest.mark.parametrize("limits", [[1], [4], [3, 1], [2, 2, 1], [1, 1, 1]])
+def test_router_share_splits_each_backend_exactly(limits):
+    capacity = sum(limits)
+    backends = [(f"http://ollama-{i}", limit) for i, limit in enumerate(limits)]
+    for num_shards in range(1, capacity + 1):
+        routers = [OllamaRouter(backends) for _ in range(num_shards)]
+        for shard, router in enumerate(routers):
+            router.share(shard, num_shards)
+
+        # На каждом сервере шарды вместе держат ровно его лимит
+        for i, limit in enumerate(limits):
+            assert sum(router.backends[i].max_inflight for router in routers) == limit
+        # И у каждого шарда есть хотя бы один слот
+        capacities = [router.capacity for router in routers]
+        assert min(capacities) >= 1
+        assert max(capacities) - min(capacities) <= 1
+
+
+def test_shard_without_share_is_never_picked_for_slots():
+    router = OllamaRouter([("http://ollama-a", 1), ("http://ollama-b", 1)])
+    router.share(1, 2)
+    assert [b.max_inflight for b in router.backends] == [0, 1]
+    assert router.pick().url == "http://ollama-b"
+    assert [b.url for b in router._candidates("m")] == ["http://ollama-b"]
+
+
+def test_refuses_more_shards_than_slots():
+    with pytest.raises(ValueError):
+        ShardRouter(3, sender=None, slots=2)
+
+
+class FakeQueue(list):
+    put = list.append
+
+    def close(self):
+        pass
+
+    def cancel_join_thread(self):
+        pass
+
+
+class FakeProcess:
+    exitcode = -9
+
+    def is_alive(self):
+        return False
+
+
+def test_dead_shard_gets_its_unfinished_updates_again(monkeypatch):
+    monkeypatch.setattr(sharding, "metrics", Metrics())
+    router = ShardRouter(2, sender=None, slots=2)
+
+    def start_shard(shard):
+        router.in_queues[shard] = FakeQueue()
+        router.resp_queues[shard] = FakeQueue()
+        router.processes[shard] = FakeProcess()
+
+    router._start_shard = start_shard
+    for shard in range(2):
+        start_shard(shard)
+
+    updates = [{"update_id": i, "message": {"chat": {"id": chat_id}}} for i, chat_id in enumerate((2, 3, 4, 6), 1)]
+    for update in updates:
+        router.dispatch(update)
+    router._handle_outbound(("complete", 1))
+    dead = shard_for(2, 2)
+
+    router._restart_shard(dead, -9)
+    assert router.in_queues[dead] == [updates[2], updates[3]]
+    assert router.in_queues[1 - dead] == [updates[1]]
+
+
+def test_shard_metrics_are_combined():
+    registry = Metrics()
+    registry.inc("bot_accepted_total", 1)
+    registry.set("bot_queue_depth", 0)
+    registry.merge(0, {"bot_accepted_total": 5}, {"bot_queue_depth": 2})
+    registry.merge(1, {"bot_accepted_total": 3}, {"bot_queue_depth": 4})
+    values = registry.snapshot()
+    assert values["bot_accepted_total"] == 9
+    assert values['bot_queue_depth{shard="1"}'] == 4
+
+    # Перезапуск шарда не уменьшает суммы счётчиков
+    registry.retire(1)
+    registry.merge(1, {"bot_accepted_total": 1}, {"bot_queue_depth": 0})
+    assert registry.snapshot()["bot_accepted_total"] == 10
+    text = registry.render()
+    assert text.count("# TYPE bot_queue_depth gauge") == 1
+    assert 'bot_queue_depth{shard="0"} 2' in text
@@ -0,0 +1,97 @@
+import threading
+
+from update_state import UpdateStateStore
+
+
+def update(update_id):
+    return {"update_id": update_id, "message": {"chat": {"id": 1}, "text": f"m{update_id}"}}
+
+
+def restart(store):
+    store.save()
+    restored = UpdateStateStore(path=store.path, dedup_size=store.recent.maxlen)
+    return restored, restored.load()
+
+
+def test_pending_updates_are_replayed_after_restart(tmp_path):
+    store = UpdateStateStore(path=tmp_path / "bot_state.json", dedup_size=10)
+    for update_id in (5, 6, 7):
+        assert store.begin(update(update_id))
+    store.complete(6)
+
+    restored, replay = restart(store)
+    assert [u["update_id"] for u in replay] == [5, 7]
+    # Офсет не обгоняет самое старое неотвеченное обновление,
+    # а getUpdates продолжает после последнего принятого
+    assert restored.offset == 5
+    assert restored.next_fetch_offset() == 8
+
+
+def test_offset_moves_past_completed_updates(tmp_path):
+    store = UpdateStateStore(path=tmp_path / "bot_state.json", dedup_size=10)
+    store.begin(update(5))
+    store.begin(update(6))
+    store.complete(5)
+    store.complete(6)
+
+    restored, replay = restart(store)
+    assert replay == []
+    assert restored.offset == 7
+    assert restored.next_fetch_offset() == 7
+
+
+def test_duplicates_are_rejected_after_restart(tmp_path):
+    store = UpdateStateStore(path=tmp_path / "bot_state.json", dedup_size=2)
+    for update_id in (1, 2, 3):
+        store.begin(update(update_id))
+        store.complete(update_id)
+    store.begin(update(4))
+    assert not store.begin(update(4))
+
+    restored, _ = restart(store)
+    assert not restored.begin(update(4))  # незавершённое
+    assert not restored.begin(update(3))  # недавно отвеченное
+    # Выпавшее из окна дедупликации снова принимается
+    assert restored.begin(update(1))
+
+
+def test_save_writes_only_when_changed(tmp_path):
+    path = tmp_path / "bot_state.json"
+    store = UpdateStateStore(path=path, dedup_size=10)
+    store.save()
+    assert not path.exists()
+
+    store.begin(update(1))
+    store.save()
+    assert path.exists()
+    assert not store.dirty
+    assert not path.with_suffix(".tmp").exists()
+
+
+def test_unreadable_state_starts_clean(tmp_path):
+    path = tmp_path / "bot_state.json"
+    path.write_text("{обрыв", encoding="utf-8")
+    store = UpdateStateStore(path=path, dedup_size=10)
+    assert store.load() == []
+    assert store.next_fetch_offset() is None
+
+
+def test_saves_from_threads_do_not_clash(tmp_path):
+    store = UpdateStateStore(path=tmp_path / "bot_state.json", dedup_size=100)
+
+    def work(start):
+        for update_id in range(start, start + 50):
+            store.begin(update(update_id))
+            store.complete(update_id)
+            store.save()
+
+    threads = [threading.Thread(target=work, args=(i * 50,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.save()
+
+    restored, replay = restart(store)
+    assert replay == []
+    assert restored.offset == 200
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from webhook_server import SECRET_HEADER, create_webhook_app
+
+PATH = "/telegram/webhook"
+
+
+def make_client():
+    received = []
+    app = create_webhook_app(received.append, path=PATH, secret="s3cret")
+    return TestClient(app), received
+
+
+def test_valid_update_is_accepted():
+    client, received = make_client()
+    response = client.post(PATH, json={"update_id": 7}, headers={SECRET_HEADER: "s3cret"})
+    assert response.status_code == 200
+    assert received == [{"update_id": 7}]
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    client, received = make_client()
+    assert client.post(PATH, json={"update_id": 7}, headers={SECRET_HEADER: "wrong"}).status_code == 403
+    assert client.post(PATH, json={"update_id": 7}).status_code == 403
+    assert received == []
+
+
+def test_malformed_body_is_rejected():
+    client, received = make_client()
+    headers = {SECRET_HEADER: "s3cret", "Content-Type": "application/json"}
+    assert client.post(PATH, content=b"{not json", headers=headers).status_code == 400
+    assert client.post(PATH, json={"message": {}}, headers=headers).status_code == 400
+    assert received == []
+
+
+def test_webhook_without_secret_refuses_to_start():
+    with pytest.raises(ValueError):
+        create_webhook_app(lambda update: None, path=PATH, secret="")
+
+
+def test_async_handler_finishes_before_the_reply():
+    received = []
+
+    async def on_update(update):
+        await asyncio.sleep(0.01)
+        received.append(update)
+
+    client = TestClient(create_webhook_app(on_update, path=PATH, secret="s3cret"))
+    response = client.post(PATH, json={"update_id": 7}, headers={SECRET_HEADER: "s3cret"})
+    assert response.status_code == 200
+    assert received == [{"update_id": 7}]
@@ -0,0 +1,110 @@
+# update_state.py - ДОЛГОВРЕМЕННОЕ СОСТОЯНИЕ ПОЛУЧЕНИЯ ОБНОВЛЕНИЙ
+#
+# Хранит в data/bot_state.json:
+#   offset     - все обновления с меньшим update_id уже отвечены
+#   pending    - принятые, но ещё не отвеченные обновления (переигрываются после рестарта)
+#   recent_ids - последние отвеченные update_id для защиты от повторной обработки
+# Обновление считается завершённым только после отправки ответа.
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from config import BOT_STATE_FILE, UPDATE_DEDUP_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateStateStore:
+    """Офсет, журнал незавершённых обновлений и набор для дедупликации"""
+
+    def __init__(self, path=BOT_STATE_FILE, dedup_size=UPDATE_DEDUP_SIZE):
+        self.path = path
+        self.offset = None
+        self.pending = {}
+        self.recent = deque(maxlen=dedup_size)
+        self.recent_set = set()
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # save() зовут из потоков - пишем по одному
+
+    def load(self):
+        """Читает состояние с диска; возвращает список обновлений для повторной обработки"""
+        if not self.path.exists():
+            return []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ Не удалось прочитать {self.path}: {e}")
+            return []
+
+        self.offset = data.get("offset")
+        for update_id in data.get("recent_ids", []):
+            self._remember(update_id)
+        self.pending = {u["update_id"]: u for u in data.get("pending", [])}
+
+        logger.info(f"📂 Состояние: offset={self.offset}, незавершённых={len(self.pending)}")
+        return sorted(self.pending.values(), key=lambda u: u["update_id"])
+
+    def next_fetch_offset(self):
+        """Офсет для первого getUpdates после старта"""
+        known = [u + 1 for u in self.recent] + [u + 1 for u in self.pending]
+        if self.offset is not None:
+            known.append(self.offset)
+        return max(known) if known else None
+
+    def begin(self, update):
+        """Регистрирует новое обновление; False - дубликат, обрабатывать не нужно"""
+        update_id = update.get("update_id")
+        with self._lock:
+            if update_id in self.recent_set or update_id in self.pending:
+                return False
+            self.pending[update_id] = update
+            self.dirty = True
+            return True
+
+    def complete(self, update_id):
+        """Отмечает обновление отвеченным и сдвигает офсет"""
+        with self._lock:
+            if self.pending.pop(update_id, None) is None:
+                return
+            self._remember(update_id)
+            if self.pending:
+                self.offset = min(self.pending)
+            else:
+                self.offset = max(self.offset or 0, update_id + 1)
+            self.dirty = True
+
+    def _remember(self, update_id):
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_set.discard(self.recent[0])
+        self.recent.append(update_id)
+        self.recent_set.add(update_id)
+
+    def save(self):
+        """Атомарно записывает состояние, если оно изменилось.
+
+        Пишет на диск - из event loop вызывать через asyncio.to_thread.
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self.dirty:
+                    return
+                data = {
+                    "offset": self.offset,
+                    "pending": list(self.pending.values()),
+                    "recent_ids": list(self.recent),
+                }
+                self.dirty = False
+
+            tmp_path = self.path.with_suffix(".tmp")
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                with self._lock:
+                    self.dirty = True
+                logger.error(f"❌ Не удалось сохранить {self.path}: {e}")
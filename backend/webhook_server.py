@@ -0,0 +1,71 @@
+# webhook_server.py - ПРИЁМ ОБНОВЛЕНИЙ TELEGRAM ЧЕРЕЗ WEBHOOK
+#
+# Проверка без Telegram - POST записанного обновления:
+#   curl -X POST localhost:8443/telegram/webhook \
+#        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \
+#        -H "Content-Type: application/json" -d @update.json
+
+import asyncio
+import inspect
+import logging
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+import uvicorn
+from config import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(on_update, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+    """Создаёт приложение, которое передаёт каждое обновление в on_update(update).
+
+    on_update может быть корутиной - тогда ответ Telegram уходит после неё.
+    """
+    if not secret:
+        # Без секрета любой, кто знает адрес, может слать боту поддельные обновления
+        raise ValueError("❌ WEBHOOK_SECRET не установлен в .env - webhook без него не запускаю")
+    app = FastAPI()
+
+    @app.post(path)
+    async def receive_update(request: Request):
+        if request.headers.get(SECRET_HEADER) != secret:
+            logger.warning("⚠️ Webhook: неверный секретный токен")
+            raise HTTPException(status_code=403, detail="forbidden")
+
+        try:
+            update = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid json")
+
+        if not isinstance(update, dict) or "update_id" not in update:
+            raise HTTPException(status_code=400, detail="not an update")
+
+        # Отвечаем Telegram сразу - сама обработка идёт в воркерах
+        result = on_update(update)
+        if inspect.isawaitable(result):
+            await result
+        return {"ok": True}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics():
+        return metrics.render()
+
+    return app
+
+
+async def serve_webhook(on_update, stop_event, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """Запускает HTTP-сервер webhook в текущем event loop до установки stop_event"""
+    app = create_webhook_app(on_update)
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    server.install_signal_handlers = lambda: None  # сигналы обрабатывает бот
+    logger.info(f"🌐 Webhook слушает http://{host}:{port}{WEBHOOK_PATH}")
+
+    serving = asyncio.create_task(server.serve())
+    stopping = asyncio.create_task(stop_event.wait())
+    await asyncio.wait({serving, stopping}, return_when=asyncio.FIRST_COMPLETED)
+    stopping.cancel()
+    server.should_exit = True
+    await serving
@@ -108,22 +108,25 @@ def run_full_pipeline():
     
     return True
 
-def run_bot_only():
+def run_bot_only(workers=None):
     """Запускает только Telegram бота"""
     print("\n" + "="*60)
     print("🤖 Запуск только Telegram бота")
     print("="*60)
     
+    bot_args = ["--workers", str(workers)] if workers else []
+    
     try:
         # Импортируем и запускаем бота напрямую
         from backend import telegram_bot
+        sys.argv[1:] = bot_args
         telegram_bot.main()
     except ImportError as e:
         print(f"❌ Не могу импортировать модуль: {e}")
         print("💡 Запускаю через subprocess...")
         
         # Используем только имя файла, так как cwd установлен в "backend"
-        subprocess.run([sys.executable, "3_telegram_bot.py"], cwd="backend")
+        subprocess.run([sys.executable, "3_telegram_bot.py", *bot_args], cwd="backend")
 
 def main():
     """Основная функция"""
@@ -145,8 +148,11 @@ def main():
                 print("\n❌ ПАЙПЛАЙН ЗАВЕРШИЛСЯ С ОШИБКАМИ")
                 sys.exit(1)
         elif sys.argv[1] == "--bot":
-            # Только бот
-            run_bot_only()
+            # Только бот (опционально: --workers N процессов-шардов)
+            workers = None
+            if "--workers" in sys.argv:
+                workers = int(sys.argv[sys.argv.index("--workers") + 1])
+            run_bot_only(workers)
         elif sys.argv[1] == "--docker":
             # Режим для Docker (автоматически определяет)
             print("🐳 Запуск в Docker режиме...")
@@ -195,11 +201,13 @@ def print_help():
     print("\nОпции:")
     print("  --full    : Запустить полный пайплайн (сбор данных + бот)")
     print("  --bot     : Запустить только Telegram бота")
+    print("              [--workers N] - обрабатывать чаты в N процессах")
     print("  --docker  : Автоматический режим для Docker")
     print("  --help    : Показать эту справку")
     print("\nПримеры:")
     print("  python main.py --full     # Полный запуск")
     print("  python main.py --bot      # Только бот")
+    print("  python main.py --bot --workers 4  # Бот на 4 процессах")
     print("  python main.py            # Интерактивный режим")
 
 if __name__ == "__main__":